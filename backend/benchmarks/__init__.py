@@ -0,0 +1,7 @@
+# ベンチマーク用パッケージ
+# ネットワークに一切つながずに計測するため、APIキーにはダミーを入れておく
+# （src.configはキーが無いとgetpassで入力待ちになってしまう）
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "dummy-key-for-benchmark")
+os.environ.setdefault("LANGSMITH_API_KEY", "dummy-key-for-benchmark")
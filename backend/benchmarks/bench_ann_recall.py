@@ -0,0 +1,85 @@
+# ANN索引(HNSW / IVFFlat)の recall@k と検索の速さを、索引なし（全件を正確に比べる）と比べる
+# 使い方: backendディレクトリで `python -m benchmarks.bench_ann_recall --rows 20000 --dim 768`
+# pgvectorの入ったPostgresが必要（接続先は.envのuser/password/host/port/dbname）。
+# 合成したクラスタ状のベクトルを計測用のコレクションに書き込み、最後に削除する。
+# 正解はnumpyで全件のコサイン距離を計算して求める。
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings  # noqa: F401  (LangSmithのトレースを止める)
+from src.ann_index import IndexSpec, drop_index_sql
+from src.vector_store import Vectorstore
+
+
+def _corpus(rows: int, dim: int, clusters: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, size=rows)] + 0.3 * rng.normal(size=(rows, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def _queries(corpus: np.ndarray, n: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    picked = corpus[rng.integers(0, len(corpus), size=n)]
+    queries = picked + 0.1 * rng.normal(size=picked.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+async def _sweep(store: Vectorstore, queries, truth, k: int, label: str, **tuning):
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = await store.asearch_by_vector(query.tolist(), k=k, **tuning)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({int(d.id) for d in found} & expected) / k)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"[{label:<22}] recall@{k} {statistics.mean(recalls):.3f} | p50 {statistics.median(latencies)*1000:7.2f} ms | p95 {p95*1000:7.2f} ms")
+
+
+async def main(args):
+    corpus = _corpus(args.rows, args.dim, args.clusters)
+    queries = _queries(corpus, args.queries)
+    truth = [set(np.argsort(1 - corpus @ q)[:args.k].tolist()) for q in queries]
+
+    store = Vectorstore(embedding_model="bench-model", collection_name="bench_ann_recall", dimensions=args.dim)
+    try:
+        docs = [Document(id=str(i), page_content=f"chunk {i}") for i in range(args.rows)]
+        for i in range(0, args.rows, 1000):
+            await store.acopy_with_vectors(docs[i:i + 1000], corpus[i:i + 1000])
+        print(f"{args.rows} vectors (dim={args.dim}), {args.queries} queries, k={args.k}")
+
+        await _sweep(store, queries, truth, args.k, "exact (no index)")
+
+        started = time.perf_counter()
+        await store.aensure_index(IndexSpec(method="hnsw"))
+        print(f"hnsw built in {time.perf_counter() - started:.1f}s: {await store.aindex_status('hnsw')}")
+        for ef in (10, 20, 40, 80, 160, 320):
+            await _sweep(store, queries, truth, args.k, f"hnsw ef_search={ef}", ef_search=ef)
+        await store._aexecute_autocommit(drop_index_sql(await store._acollection_id(), "hnsw"))
+
+        started = time.perf_counter()
+        await store.aensure_index(IndexSpec(method="ivfflat"))
+        print(f"ivfflat built in {time.perf_counter() - started:.1f}s")
+        for probes in (1, 2, 5, 10, 20, 50):
+            await _sweep(store, queries, truth, args.k, f"ivfflat probes={probes}", probes=probes)
+        await store._aexecute_autocommit(drop_index_sql(await store._acollection_id(), "ivfflat"))
+    finally:
+        await store._astore.adelete_collection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
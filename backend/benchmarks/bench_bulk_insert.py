@@ -0,0 +1,54 @@
+# 埋め込み済みのチャンクを書き込む速さ(rows/s)を、PGVector.aadd_embeddings(行ごとのINSERT)と
+# COPY(バイナリ)で比べる
+# 使い方: backendディレクトリで `python -m benchmarks.bench_bulk_insert --rows 20000`
+# pgvectorの入ったPostgresが必要（接続先は.envのuser/password/host/port/dbname）。
+# 計測用のコレクションに書き込み、最後に削除する。
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings  # noqa: F401  (LangSmithのトレースを止める)
+from src.vector_store import Vectorstore
+
+
+def _rows(n: int, dim: int, prefix: str):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    docs = [
+        Document(id=f"{prefix}-{i}", page_content=f"ベンチマーク用のチャンク{i}。" * 20, metadata={"source_file": "bench.pdf", "page": i // 10 + 1})
+        for i in range(n)
+    ]
+    return docs, vectors
+
+
+async def _measure(store: Vectorstore, docs, vectors, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(docs), batch_size):
+        await store.aadd_with_vectors(docs[i:i + batch_size], vectors[i:i + batch_size].tolist())
+    return time.perf_counter() - start
+
+
+async def main(rows: int, dim: int, batch_size: int):
+    for bulk_insert, label in [(False, "add_embeddings"), (True, "copy          ")]:
+        store = Vectorstore(embedding_model="bench-model", collection_name=f"bench_bulk_insert_{label.strip()}", bulk_insert=bulk_insert)
+        docs, vectors = _rows(rows, dim, label.strip())
+        try:
+            elapsed = await _measure(store, docs, vectors, batch_size)
+            found = await store.asearch_score_by_vector(vectors[0].tolist(), k=1)
+            assert found and found[0][0].id == docs[0].id, "書き込んだ行が検索で読めません"
+            print(f"[{label}] {rows} rows (dim={dim}, batch={batch_size}) in {elapsed:7.2f} s | {rows/elapsed:9.1f} rows/s")
+        finally:
+            await store._astore.adelete_collection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.dim, args.batch_size))
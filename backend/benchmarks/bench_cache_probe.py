@@ -0,0 +1,45 @@
+# SemanticCacheの1回の問い合わせ(プローブ)にかかる時間を、キャッシュ件数ごとに計測する
+# 使い方: backendディレクトリで `python -m benchmarks.bench_cache_probe --dim 768`
+# 注意: gemini-embedding-001の既定の3072次元で10万件にすると約1.2GBのメモリを使う
+
+import argparse
+import time
+
+import numpy as np
+
+from src.vector_index import VectorIndex
+
+
+def _percentile(samples, p):
+    return float(np.percentile(samples, p))
+
+
+def bench(size: int, dim: int, probes: int, rng) -> dict:
+    index = VectorIndex(initial_capacity=size)
+    index.add_many(rng.normal(size=(size, dim)).astype(np.float32), list(range(size)))
+    queries = rng.normal(size=(probes, dim)).astype(np.float32)
+
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q, k=1)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"size": size, "p50_ms": _percentile(samples, 50), "p99_ms": _percentile(samples, 99), "mean_ms": float(np.mean(samples))}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"dim={args.dim}, probes={args.probes}")
+    for size in args.sizes:
+        r = bench(size, args.dim, args.probes, rng)
+        print(f"{r['size']:>8} entries | p50 {r['p50_ms']:7.3f} ms | p99 {r['p99_ms']:7.3f} ms | mean {r['mean_ms']:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# ChatBot.runをN個同時に投げて、1個だけの時とほぼ同じ時間で終わるかを確かめるベンチマーク
+# 使い方: backendディレクトリで `python -m benchmarks.bench_concurrency --n 10`
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import BlockingVectorstore, FakeCache, FakeChatModel, FakeVectorstore
+from src import config
+from src.bot import ChatBot
+
+
+def _build_bot(vector_db, llm_latency: float) -> ChatBot:
+    return ChatBot(
+        template=config.TEMPLATE,
+        hyde_template=config.HYDE_TEMPLATE,
+        vector_db=vector_db,
+        llm=FakeChatModel(latency=llm_latency),
+        cache=FakeCache(),
+    )
+
+
+async def _measure(bot: ChatBot, n: int, tag: str) -> float:
+    # 回答のキャッシュに当たらないよう、毎回違う質問にする
+    start = time.perf_counter()
+    await asyncio.gather(*[bot.run(f"質問{tag}-{i}") for i in range(n)])
+    return time.perf_counter() - start
+
+
+async def main(n: int, llm_latency: float, search_latency: float):
+    for label, vector_db in [
+        ("async", FakeVectorstore(latency=search_latency)),
+        ("blocking", BlockingVectorstore(latency=search_latency)),
+    ]:
+        bot = _build_bot(vector_db, llm_latency)
+        single = await _measure(bot, 1, "single")
+        concurrent = await _measure(bot, n, "concurrent")
+        print(f"[{label:8}] 1 question: {single*1000:8.1f} ms | {n} questions: {concurrent*1000:8.1f} ms | ratio: {concurrent/single:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.n, args.llm_latency, args.search_latency))
@@ -0,0 +1,48 @@
+# 同時に来た埋め込みを1件ずつ送る場合と、EmbeddingBatcherでまとめて送る場合を比べる
+# 使い方: backendディレクトリで `python -m benchmarks.bench_embedding_batching --n 200`
+# 偽の埋め込みモデルは「1回の呼び出しの固定費 + 1件ごとの費用」で時間がかかる
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import FakeEmbeddings
+from src.embeddings import EmbeddingBatcher
+
+
+async def _run(embedder, n: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*[embedder.aembed_query(f"質問{i}") for i in range(n)])
+    return time.perf_counter() - start
+
+
+async def main(n: int, batch_size: int, wait_ms: float, concurrency_limit: int):
+    # 1件ずつ: APIの同時接続数の上限をセマフォで再現する
+    direct = FakeEmbeddings()
+    sem = asyncio.Semaphore(concurrency_limit)
+
+    class _Limited:
+        async def aembed_query(self, text):
+            async with sem:
+                return await direct.aembed_query(text)
+
+    elapsed = await _run(_Limited(), n)
+    print(f"[direct ] {n} queries in {elapsed*1000:8.1f} ms | {n/elapsed:8.1f} q/s | API calls: {direct.calls}")
+
+    batched_model = FakeEmbeddings()
+    batcher = EmbeddingBatcher(batched_model, max_batch_size=batch_size, max_wait_ms=wait_ms)
+    elapsed = await _run(batcher, n)
+    stats = batcher.stats()
+    print(f"[batched] {n} queries in {elapsed*1000:8.1f} ms | {n/elapsed:8.1f} q/s | API calls: {batched_model.calls}")
+    print(f"          batch sizes: {stats['batch_sizes']}")
+    print(f"          queue delay: mean {stats['mean_queue_delay_ms']:.2f} ms, max {stats['max_queue_delay_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=5)
+    parser.add_argument("--concurrency-limit", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.n, args.batch_size, args.wait_ms, args.concurrency_limit))
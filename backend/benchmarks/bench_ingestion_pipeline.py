@@ -0,0 +1,72 @@
+# 1バッチずつ「埋め込み → 書き込み」を順番に行う場合と、IngestionPipelineで並行させる場合の
+# 取り込みの速さ(chunks/s)を比べる
+# 使い方: backendディレクトリで `python -m benchmarks.bench_ingestion_pipeline --chunks 2000`
+# 埋め込みは偽のモデル（共有のレート制限器を通す）、DBは書き込みにwrite_latency秒かかる偽物で代用する
+
+import argparse
+import asyncio
+import time
+
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings
+from src.embeddings import RateLimitedEmbeddings
+from src.rate_limiter import RateLimiter
+from src.vector_store import IngestionPipeline
+
+
+class FakeWriter:
+    """1回の書き込みに固定費 + 1行ごとの費用がかかるDB"""
+    def __init__(self, call_latency: float, row_latency: float):
+        self._call_latency = call_latency
+        self._row_latency = row_latency
+        self.rows = 0
+
+    async def write(self, docs, vectors):
+        await asyncio.sleep(self._call_latency + self._row_latency * len(docs))
+        self.rows += len(docs)
+
+
+def _embeddings(args):
+    limiter = RateLimiter("bench", requests_per_minute=args.rpm, tokens_per_minute=10_000_000, max_concurrency=args.embed_workers)
+    return RateLimitedEmbeddings(FakeEmbeddings(call_latency=args.embed_latency, item_latency=0.001), limiter)
+
+
+async def sequential(docs, args) -> float:
+    embeddings, writer = _embeddings(args), FakeWriter(args.write_latency, 0.0005)
+    start = time.perf_counter()
+    for i in range(0, len(docs), args.batch_size):
+        batch = docs[i:i + args.batch_size]
+        vectors = await embeddings.aembed_documents([d.page_content for d in batch])
+        await writer.write(batch, vectors)
+    assert writer.rows == len(docs)
+    return time.perf_counter() - start
+
+
+async def pipelined(docs, args) -> float:
+    embeddings, writer = _embeddings(args), FakeWriter(args.write_latency, 0.0005)
+    pipeline = IngestionPipeline(embeddings.aembed_documents, writer.write, batch_size=args.batch_size, embed_workers=args.embed_workers, queue_size=args.queue_size)
+    result = await pipeline.run(docs)
+    assert result.written == len(docs)
+    return result.seconds
+
+
+async def main(args):
+    docs = [Document(id=str(i), page_content=f"ベンチマーク用のチャンク{i}。" * 20) for i in range(args.chunks)]
+    print(f"{args.chunks} chunks, batch {args.batch_size}, embed {args.embed_latency*1000:.0f} ms/call, write {args.write_latency*1000:.0f} ms/call")
+    elapsed = await sequential(docs, args)
+    print(f"[sequential] {elapsed:7.2f} s | {len(docs)/elapsed:8.1f} chunks/s")
+    elapsed = await pipelined(docs, args)
+    print(f"[pipelined ] {elapsed:7.2f} s | {len(docs)/elapsed:8.1f} chunks/s (embed workers={args.embed_workers}, queue={args.queue_size})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--embed-latency", type=float, default=0.15)
+    parser.add_argument("--write-latency", type=float, default=0.05)
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=3000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+# 1リクエストあたりのログの費用を、同期で書き込む以前のやり方とキューで裏のスレッドに任せるやり方で比べる
+# 使い方: backendディレクトリで `python -m benchmarks.bench_logging --requests 2000`
+# 以前: 各loggerにコンソール・log.txt・error.txtのハンドラを直接付け、ChatBot.runが状態(ans)を丸ごとINFOで出していた
+# 以後: キューに積むだけ(logger.pyの_TruncatingQueueHandler)。INFOには要約だけ、丸ごとのダンプはDEBUGでN件に1件
+# コンソールの出力先はどちらも/dev/nullにする（端末の速さを測らないように）
+
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src import config
+from logger import _DebugSampler, _TruncatingQueueHandler
+
+_FORMAT = logging.Formatter('[%(asctime)s] [%(name)s] %(levelname)s: %(message)s', '%Y-%m-%d %H:%M:%S')
+
+
+def _handlers(log_dir: str, devnull):
+    console = logging.StreamHandler(devnull)
+    console.setLevel(logging.INFO)
+    log_file = logging.FileHandler(os.path.join(log_dir, "log.txt"), encoding="utf-8")
+    log_file.setLevel(logging.DEBUG)
+    error_file = logging.FileHandler(os.path.join(log_dir, "error.txt"), encoding="utf-8")
+    error_file.setLevel(logging.ERROR)
+    for handler in (console, log_file, error_file):
+        handler.setFormatter(_FORMAT)
+    return [console, log_file, error_file]
+
+
+def _state(chunk_chars: int):
+    docs = [Document(page_content="吸" * chunk_chars, metadata={"source_file": "bench.pdf", "page_info": i}) for i in range(config.RETRIEVER_K)]
+    return {"question": "質問", "context": docs, "answer": "回答" * 50, "timings": {"retrieve_ms": 12.0, "generate_ms": 300.0}}
+
+
+def before(logger: logging.Logger, ans: dict):
+    """以前のChatBot._runのログ"""
+    logger.info(f"ans type: {type(ans)}")
+    logger.info(f"ans keys: {ans.keys() if isinstance(ans, dict) else 'not a dict'}")
+    logger.info(f"ans content: {ans}")
+    logger.info(f"⏱️ [parallel] total 400 ms | retrieve_ms=12, generate_ms=300")
+
+
+def after(logger: logging.Logger, ans: dict):
+    """今のChatBot._runのログ"""
+    logger.debug("ans content: %s", ans)
+    logger.info(f"⏱️ [parallel] total 400 ms | retrieve_ms=12, generate_ms=300 | {len(ans['context'])} docs, answer {len(ans['answer'])} chars")
+
+
+def _measure(logger, log_request, ans, requests: int):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        log_request(logger, ans)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return samples
+
+
+def main(args):
+    ans = _state(args.chunk_chars)
+    devnull = open(os.devnull, "w", encoding="utf-8")
+    print(f"{args.requests} requests, {config.RETRIEVER_K} docs x {args.chunk_chars} chars in the state")
+    variants = [("sync, full dump", False, logging.INFO), ("queue, summary", True, logging.INFO), ("queue, DEBUG sampled", True, logging.DEBUG)]
+    for label, queued, level in variants:
+        with tempfile.TemporaryDirectory() as log_dir:
+            handlers = _handlers(log_dir, devnull)
+            logger = logging.getLogger(f"bench.logging.{label}")
+            logger.propagate = False
+            logger.setLevel(level)
+            listener = None
+            if queued:
+                log_queue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+                listener.start()
+                handler = _TruncatingQueueHandler(log_queue, config.LOG_MAX_MESSAGE_CHARS)
+                handler.addFilter(_DebugSampler(config.LOG_DEBUG_SAMPLE_EVERY))
+                logger.addHandler(handler)
+            else:
+                for handler in handlers:
+                    logger.addHandler(handler)
+            log_request = after if queued else before
+
+            samples = _measure(logger, log_request, ans, args.requests)
+            if listener is not None:
+                listener.stop()
+            for handler in handlers:
+                handler.close()
+            written = os.path.getsize(os.path.join(log_dir, "log.txt"))
+        print(f"[{label:<22}] p50 {np.percentile(samples, 50):7.1f} us | p99 {np.percentile(samples, 99):7.1f} us | "
+              f"max {max(samples):8.1f} us | log.txt {written / args.requests:7.0f} bytes/request")
+    devnull.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--chunk-chars", type=int, default=config.CHUNK_SIZE)
+    main(parser.parse_args())
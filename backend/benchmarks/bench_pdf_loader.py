@@ -0,0 +1,35 @@
+# PDFLoaderのページ並列解析が、ワーカー数に応じてどれだけ速くなるかを計測する
+# 使い方: backendディレクトリで `python -m benchmarks.bench_pdf_loader --pages 200 --workers 1 2 4`
+# 注意: 1回目はプロセスの起動(spawn)の時間も含まれるので、ワーカー数ごとに1回空打ちしてから計る
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import write_sample_pdf
+from src.loader import PDFLoader
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sample.pdf")
+        write_sample_pdf(path, args.pages)
+        print(f"cpu_count={os.cpu_count()}, pages={args.pages}")
+        for workers in args.workers:
+            loader = PDFLoader(path, workers=workers, pages_per_task=args.pages_per_task)
+            next(loader.iter_chunks())  # プロセスプールを温めておく
+            start = time.perf_counter()
+            chunks = sum(1 for _ in loader.iter_chunks())
+            elapsed = time.perf_counter() - start
+            print(f"workers={workers}: {args.pages / elapsed:8.1f} pages/s ({chunks} chunks in {elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# HyDEの後に検索する順番モードと、HyDEと質問そのままでの検索を同時に始める並列モードで
+# 1つの質問にかかる時間（グラフ全体）と段階ごとの時間を比べるベンチマーク
+# 使い方: backendディレクトリで `python -m benchmarks.bench_speculative_retrieval --deadline-ms 300`
+# キャッシュと質問の埋め込みは両モードで同じなので、グラフ(hyde → retrieve → generate)だけを測る。
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from benchmarks.fakes import FakeCache, FakeChatModel, FakeVectorstore
+from src import config
+from src.bot import ChatBot
+from src.cache_tiers import LRUTier
+
+
+def _build_bot(mode: str, deadline_ms, hyde_latency: float, llm_latency: float, search_latency: float) -> ChatBot:
+    bot = ChatBot(
+        template=config.TEMPLATE,
+        hyde_template=config.HYDE_TEMPLATE,
+        vector_db=FakeVectorstore(latency=search_latency),
+        llm=FakeChatModel(latency=llm_latency),
+        cache=FakeCache(),
+        retrieval_mode=mode,
+        hyde_deadline_ms=deadline_ms,
+    )
+    # HyDEの生成は回答の生成と別の時間にできるようにする
+    bot._hyde_chain = PromptTemplate.from_template(config.HYDE_TEMPLATE) | FakeChatModel(latency=hyde_latency) | StrOutputParser()
+    # 毎回同じ仮想文書・同じベクトルになるので、HyDEと検索結果のキャッシュは切っておく
+    bot._hyde_cache = LRUTier(0, versioned=False)
+    bot._retrievals = LRUTier(0)
+    return bot
+
+
+async def _measure(bot: ChatBot, runs: int):
+    totals, stages = [], {}
+    for i in range(runs):
+        start = time.perf_counter()
+        state = await bot._graph.ainvoke({"question": f"質問{i}", "question_vector": [0.0] * 8})
+        totals.append((time.perf_counter() - start) * 1000)
+        for name, value in state.get("timings", {}).items():
+            stages.setdefault(name, []).append(float(value))
+    return totals, stages
+
+
+async def main(args):
+    variants = [("sequential", None), ("parallel", None)]
+    if args.deadline_ms:
+        variants.append(("parallel", args.deadline_ms))
+    baseline = None
+    for mode, deadline_ms in variants:
+        bot = _build_bot(mode, deadline_ms, args.hyde_latency, args.llm_latency, args.search_latency)
+        totals, stages = await _measure(bot, args.runs)
+        p50 = statistics.median(totals)
+        baseline = baseline or p50
+        label = mode if deadline_ms is None else f"{mode} ({deadline_ms:.0f} ms deadline)"
+        stage_text = " ".join(
+            f"{name}={statistics.mean(values) * 100 if name == 'hyde_timed_out' else statistics.median(values):.0f}{'%' if name == 'hyde_timed_out' else ''}"
+            for name, values in sorted(stages.items())
+        )
+        print(f"[{label:<28}] p50 {p50:7.1f} ms ({p50 / baseline:4.2f}x) | {stage_text}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--hyde-latency", type=float, default=0.4, help="HyDEの生成にかかる秒数")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="回答の生成にかかる秒数")
+    parser.add_argument("--search-latency", type=float, default=0.05)
+    parser.add_argument("--deadline-ms", type=float, default=None, help="並列モードでHyDEを待つ上限")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+# ベクトルの持ち方（次元の切り詰め・float16・二値化+並べ直し）ごとに
+# 1件あたりの大きさ・検索の速さ・recall@k（元のfloat32の全次元での正確な上位k件に対して）を比べる
+# 使い方: backendディレクトリで `python -m benchmarks.bench_vector_compression`
+#         実際の埋め込みで測る時は `--vectors snapshot/vectors.npy`（起動時に保存されるスナップショット）
+# 検索はnumpyでの全件走査。Postgres(pgvector)の速さそのものではなく、計算量とデータ量の比較として見る。
+# --vectorsが無い時は、先頭の次元ほど分散の大きい合成データ（Matryoshka型の埋め込みに似せたもの）を使う。
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+
+def _synthetic(rows: int, dim: int, clusters: int = 50, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(1.0 + np.arange(dim) / 64)  # 先頭の次元ほど情報が多い
+    centers = rng.normal(size=(clusters, dim)) * scale
+    vectors = centers[rng.integers(0, clusters, size=rows)] + 0.5 * rng.normal(size=(rows, dim)) * scale
+    return vectors.astype(np.float32)
+
+
+def _normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def _top_k(distances, k):
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top])]
+
+
+class Float:
+    """先頭dim次元に切り詰めて正規化し直し、dtype(float32/float16)で持つ"""
+    def __init__(self, corpus, dim, dtype):
+        self.name = f"{np.dtype(dtype).name} dim={dim}"
+        self._dim = dim
+        stored = _normalize(corpus[:, :dim]).astype(dtype)
+        self.bytes_per_vector = stored[0].nbytes
+        # pgvectorのhalfvecは距離をfloat32で計算するので、丸めた値をfloat32に戻して計算する
+        # （numpyのfloat16の行列積は遅く、和もfloat16で取るので比較にならない）
+        self._matrix = stored.astype(np.float32)
+
+    def search(self, query, k):
+        q = _normalize(query[:self._dim]).astype(np.float32)
+        return _top_k(1.0 - self._matrix @ q, k)
+
+
+class BinaryRerank:
+    """符号だけのビット列のハミング距離で候補を拾い、候補だけ元のfloat32で並べ直す"""
+    def __init__(self, corpus, dim, candidates):
+        self.name = f"binary dim={dim} + rerank {candidates}"
+        self._dim = dim
+        self._candidates = candidates
+        self._full = _normalize(corpus[:, :dim]).astype(np.float32)
+        self._bits = np.packbits(self._full > 0, axis=1)
+        self.bytes_per_vector = self._bits[0].nbytes  # 索引の大きさ（並べ直しに使う元のベクトルは別に持つ）
+
+    def search(self, query, k):
+        q = _normalize(query[:self._dim]).astype(np.float32)
+        hamming = np.bitwise_count(self._bits ^ np.packbits(q > 0)).sum(axis=1)
+        candidates = _top_k(hamming, max(k, self._candidates))
+        distances = 1.0 - self._full[candidates] @ q
+        return candidates[np.argsort(distances)[:k]]
+
+
+def main(args):
+    if args.vectors:
+        corpus = np.load(args.vectors).astype(np.float32)
+        rows, dim = corpus.shape
+        source = args.vectors
+    else:
+        rows, dim = args.rows, args.dim
+        corpus = _synthetic(rows, dim)
+        source = "synthetic"
+    rng = np.random.default_rng(1)
+    queries = corpus[rng.integers(0, rows, size=args.queries)] + 0.05 * rng.normal(size=(args.queries, dim)).astype(np.float32)
+
+    full = _normalize(corpus)
+    truth = [set(_top_k(1.0 - full @ _normalize(q), args.k).tolist()) for q in queries]
+    print(f"{rows} vectors (dim={dim}, {source}), {args.queries} queries, k={args.k}")
+
+    variants = [Float(corpus, dim, np.float32), Float(corpus, dim, np.float16)]
+    for d in args.dims:
+        if d < dim:
+            variants += [Float(corpus, d, np.float32), Float(corpus, d, np.float16)]
+    variants += [BinaryRerank(corpus, dim, c) for c in args.candidates]
+
+    for variant in variants:
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = variant.search(query, args.k)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(set(found.tolist()) & expected) / args.k)
+        print(
+            f"[{variant.name:<28}] {variant.bytes_per_vector:6d} B/vector ({variant.bytes_per_vector * rows / 2**20:7.1f} MiB) "
+            f"| p50 {statistics.median(latencies)*1000:7.2f} ms | recall@{args.k} {statistics.mean(recalls):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", help="埋め込みの行列(.npy)。省略時は合成データ")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--dims", type=int, nargs="+", default=[1536, 768])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[40, 100])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,303 @@
+# ベンチマーク用の偽物たち
+# 外部API(LLM・埋め込み)とDBの代わりに、決まった時間だけ待って決まった値を返す。
+# 待ち時間のばらつき(jitter)と失敗の割合(failure_rate)はseedで決まるので、何度測っても同じ列になる。
+
+import asyncio
+import os
+import random
+import time
+import zlib
+import numpy as np
+from typing import Any, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from src import config  # noqa: F401  (configの読み込みでLANGSMITH_TRACINGがtrueになる)
+from src.vector_index import VectorIndex
+
+# 計測中にLangSmithへトレースを送りに行かないようにする
+os.environ["LANGSMITH_TRACING"] = "false"
+
+
+class FakeAPIError(RuntimeError):
+    """failure_rateで起こす、APIの一時的な失敗の代わり"""
+
+
+def text_vector(text: str, dim: int) -> List[float]:
+    """テキストごとに決まったベクトル（hash()と違ってプロセスをまたいでも同じになる）"""
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    return rng.normal(size=dim).tolist()
+
+
+class FakeChatModel(BaseChatModel):
+    """latency秒（±jitter秒）待ってから固定の文字列を返すチャットモデル。failure_rateの割合で失敗する"""
+    latency: float = 0.2
+    jitter: float = 0.0
+    failure_rate: float = 0.0
+    seed: int = 0
+    reply: str = "これはベンチマーク用の回答です。"
+    echo: bool = False  # Trueなら入力ごとに違う文字列を返す（HyDEの文書が毎回同じにならないように）
+    _rng: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def _draw(self) -> float:
+        """今回の待ち時間を決める。失敗する回ならFakeAPIErrorを投げる"""
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        if self._rng.random() < self.failure_rate:
+            raise FakeAPIError("fake chat model failure")
+        return delay
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        content = self.reply
+        if self.echo:
+            content += " " + " ".join(str(m.content) for m in messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._draw())
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._draw())
+        return self._result(messages)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    1回の呼び出しにcall_latency秒（±jitter秒）、1件ごとにitem_latency秒かかる埋め込みモデル。
+    failure_rateの割合で呼び出しが失敗する。同じテキストには常に同じベクトルを返す。呼び出し回数も数える。
+    """
+    def __init__(self, dim: int = 8, call_latency: float = 0.03, item_latency: float = 0.0005, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self._dim = dim
+        self._call_latency = call_latency
+        self._item_latency = item_latency
+        self._jitter = jitter
+        self._failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        return text_vector(text, self._dim)
+
+    def _draw(self, count: int) -> float:
+        self.calls += 1
+        self.texts += count
+        delay = max(0.0, self._call_latency + self._rng.uniform(-self._jitter, self._jitter)) + self._item_latency * count
+        if self._rng.random() < self._failure_rate:
+            raise FakeAPIError("fake embeddings failure")
+        return delay
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_documents(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        time.sleep(self._draw(len(texts)))
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    async def aembed_documents(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        await asyncio.sleep(self._draw(len(texts)))
+        return [self._vector(t) for t in texts]
+
+
+class FakeVectorstore:
+    """Vectorstoreの代わり。検索にlatency秒かかる"""
+    def __init__(self, latency: float = 0.05, k: int = config.RETRIEVER_K):
+        self._latency = latency
+        self._docs = [
+            Document(page_content=f"ベンチマーク用のドキュメント{i}です。", metadata={"source_file": "bench.pdf", "page_info": i + 1})
+            for i in range(k)
+        ]
+
+    async def aembed_query(self, text: str):
+        # テキストごとに違うベクトル（同じベクトルだと検索結果のキャッシュに当たってしまう）
+        return text_vector(text, 8)
+
+    def search(self, query: str, k: int):
+        time.sleep(self._latency)
+        return self._docs[:k]
+
+    async def asearch(self, query: str, k: int):
+        await asyncio.sleep(self._latency)
+        return self._docs[:k]
+
+    async def asearch_by_vector(self, vector, k: int):
+        return [doc for doc, _ in await self.asearch_score_by_vector(vector, k)]
+
+    async def aget_ids_by_metadata(self, key: str, values: list):
+        return [doc.id for doc, _ in await self.aget_by_metadata(key, values)]
+
+    async def aget_vectors(self, ids):
+        return {}
+
+    async def asearch_score_by_vector(self, vector, k: int):
+        await asyncio.sleep(self._latency)
+        # HyDEでの検索とは少し違う順位を返す。距離はHyDEを飛ばさない程度に遠くしておく
+        return [(doc, 0.5 + 0.01 * i) for i, doc in enumerate(self._docs[::-1][:k])]
+
+    async def asearch_with_vectors(self, vector, k: int):
+        return [(doc, distance, text_vector(doc.page_content, 8)) for doc, distance in await self.asearch_score_by_vector(vector, k)]
+
+
+class BlockingVectorstore(FakeVectorstore):
+    """非同期メソッドの中で同期的にブロックする（psycopg2で検索していた頃の再現）"""
+    async def asearch(self, query: str, k: int):
+        return self.search(query, k)
+
+    async def asearch_score_by_vector(self, vector, k: int):
+        return [(doc, 0.5) for doc in self.search("", k)]
+
+
+class InMemoryVectorstore:
+    """
+    Postgres無しで動くVectorstoreの代わり。埋め込みはFakeEmbeddings、検索はプロセス内のVectorIndexで行う。
+    ChatBot・IncrementalIndexer・SemanticCacheが使うメソッドだけを持つ。検索と書き込みにそれぞれlatency秒かかる。
+    """
+    def __init__(self, embeddings: FakeEmbeddings | None = None, dim: int = 8, latency: float = 0.0, embedding_model: str = "fake-embedding"):
+        self._embeddings = embeddings or FakeEmbeddings(dim=dim)
+        self._dim = dim
+        self._latency = latency
+        self._embedding_model = embedding_model
+        self._rows = {}  # {ID: (Document, ベクトル)}
+        self._index = VectorIndex()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def embedding_model(self) -> str:
+        return self._embedding_model
+
+    @property
+    def dimensions(self) -> int:
+        return self._dim
+
+    async def aembed_query(self, text: str):
+        return await self._embeddings.aembed_query(text)
+
+    async def aembed_documents(self, texts: list[str]):
+        return await self._embeddings.aembed_documents(texts)
+
+    async def aadd_with_vectors(self, chunks, vectors):
+        await asyncio.sleep(self._latency)
+        replaced = {doc.id for doc in chunks if doc.id in self._rows}
+        if replaced:
+            self._index.retain(lambda doc: doc.id not in replaced)
+        for doc, vector in zip(chunks, vectors):
+            doc = Document(id=doc.id or str(len(self._rows)), page_content=doc.page_content, metadata=dict(doc.metadata))
+            self._rows[doc.id] = (doc, vector)
+            self._index.add(vector, doc)
+
+    async def asearch_score_by_vector(self, vector, k: int):
+        await asyncio.sleep(self._latency)
+        return self._index.search(vector, k=k)
+
+    async def asearch_with_vectors(self, vector, k: int):
+        return [(doc, distance, self._rows[doc.id][1]) for doc, distance in await self.asearch_score_by_vector(vector, k)]
+
+    async def asearch_by_vector(self, vector, k: int):
+        return [doc for doc, _ in await self.asearch_score_by_vector(vector, k)]
+
+    async def asearch(self, query: str, k: int):
+        return await self.asearch_by_vector(await self.aembed_query(query), k)
+
+    async def aget_all_with_vectors(self):
+        return list(self._rows.values())
+
+    async def aget_by_metadata(self, key: str, values: list):
+        wanted = {str(v) for v in values}
+        return [(doc, vector) for doc, vector in self._rows.values() if str(doc.metadata.get(key)) in wanted]
+
+    async def aget_metadata(self, key: str, values: list):
+        return {doc.id: dict(doc.metadata) for doc, _ in await self.aget_by_metadata(key, values)}
+
+    async def aget_vectors(self, ids):
+        # IDでの読み直しもDBへの往復なので、検索と同じだけ待つ
+        await asyncio.sleep(self._latency)
+        return {i: self._rows[i][1] for i in ids if i in self._rows}
+
+    async def adelete(self, ids):
+        ids = set(ids or ())
+        if ids:
+            for i in ids:
+                self._rows.pop(i, None)
+            self._index.retain(lambda doc: doc.id not in ids)
+
+    async def aupdate_metadata(self, patches: dict):
+        for i, patch in patches.items():
+            if i in self._rows:
+                self._rows[i][0].metadata.update(patch)
+
+    async def avacuum(self):
+        pass
+
+
+class FakeCache:
+    """SemanticCacheの代わり。常にキャッシュミスする"""
+    def __init__(self, latency: float = 0.02):
+        self._latency = latency
+
+    async def load(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    async def _check(self, query: str, vector=None, revalidate=None):
+        await asyncio.sleep(self._latency)
+        return None
+
+    async def add_question_answer(self, question: str, answer: str, vector=None, probe_ids=()):
+        await asyncio.sleep(self._latency)
+
+    def stats(self) -> dict:
+        return {}
+
+
+def write_sample_pdf(path: str, pages: int, lines_per_page: int = 40):
+    """テキストだけのPDFを書き出す（外部ライブラリ無しで、PDFの読み込みの計測に使う）"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # ページツリーは後で埋める
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for p in range(pages):
+        lines = [f"Page {p + 1} line {i + 1}: absorbance measurement sample text for benchmarking." for i in range(lines_per_page)]
+        body = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R /Resources << /Font << /F1 3 0 R >> >> >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
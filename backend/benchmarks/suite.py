@@ -0,0 +1,334 @@
+# ネットワークにもPostgresにもつながずに、ChatBotのパイプライン全体の速さを測るベンチマークの一式
+# 使い方: backendディレクトリで `python -m benchmarks.suite --out results.json`
+#         前の結果と比べる: `python -m benchmarks.suite --out new.json --baseline results.json`
+# LLMと埋め込みは待ち時間・ばらつき・失敗の割合を決められる偽物(benchmarks/fakes.py)、
+# 文書とSemanticCacheの保存先はプロセス内のInMemoryVectorstoreで代用する。
+# 偽物の待ち時間はseedで決まるので、コミットの間の差はコードの差だけになる。
+# 測るもの:
+#   - pipeline: ChatBot.runの端から端までの時間と、段階ごと（キャッシュ・検索・HyDE・生成）の時間の分布
+#   - ingestion: IncrementalIndexerでの取り込みの速さ(chunks/s)。初回と、同じ文書の再アップロード
+#   - cache_probe: SemanticCacheの1回の問い合わせにかかる時間を、キャッシュの件数ごとに
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, InMemoryVectorstore, text_vector
+from src import config
+from src.bot import ChatBot
+from src.cache import SemanticCache
+from src.ingestion import IncrementalIndexer
+
+PERCENTILES = (50, 90, 95, 99)
+# 比べる時に見る値。chunks_per_secondだけは大きいほど良い
+_LATENCY_KEYS = {f"p{p}" for p in PERCENTILES} | {"mean"}
+_THROUGHPUT_KEYS = {"chunks_per_second"}
+
+
+def summarize(samples) -> dict:
+    """ミリ秒のリストを{p50, p90, p95, p99, mean, n}にまとめる"""
+    if not samples:
+        return {"n": 0}
+    summary = {f"p{p}": float(np.percentile(samples, p)) for p in PERCENTILES}
+    summary["mean"] = float(np.mean(samples))
+    summary["n"] = len(samples)
+    return summary
+
+
+def _timed(samples: dict, name: str, func):
+    """asyncの関数を包んで、かかった時間(ミリ秒)をsamples[name]に貯める"""
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            samples.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+    return wrapper
+
+
+class _GraphRecorder:
+    """ChatBotのグラフを包み、終わった時の状態に入っている段階ごとの時間を貯める"""
+    def __init__(self, graph, samples: dict):
+        self._graph = graph
+        self._samples = samples
+
+    async def ainvoke(self, state, *args, **kwargs):
+        result = await self._graph.ainvoke(state, *args, **kwargs)
+        for name, value in result.get("timings", {}).items():
+            if isinstance(value, float):
+                self._samples.setdefault(name, []).append(value)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._graph, name)
+
+
+def _corpus(chunks: int) -> list[Document]:
+    return [
+        Document(
+            id=f"bench-{i}",
+            page_content=f"ベンチマーク用の文書{i // 10}の{i % 10}番目のチャンクです。吸光度の測定{i}について説明します。",
+            metadata={"source_file": f"bench{i // 10}.pdf", "page_info": i % 10 + 1},
+        )
+        for i in range(chunks)
+    ]
+
+
+def _questions(args, corpus: list[Document], rng) -> list[str]:
+    """
+    質問の列を作る。
+    - grounded_ratioの割合はチャンクの本文そのまま（質問そのままでの検索で十分なのでHyDEを飛ばせる）
+    - repeat_ratioの割合は前に出た質問の繰り返し（完全一致のキャッシュに当たる）
+    - 残りは毎回違う質問
+    """
+    questions = []
+    for i in range(args.requests):
+        draw = rng.random()
+        if questions and draw < args.repeat_ratio:
+            questions.append(questions[int(rng.integers(len(questions)))])
+        elif draw < args.repeat_ratio + args.grounded_ratio:
+            questions.append(corpus[int(rng.integers(len(corpus)))].page_content)
+        else:
+            questions.append(f"ベンチマーク用の質問{i}: 吸光度とは何ですか？")
+    return questions
+
+
+def _semantic_cache(store: InMemoryVectorstore, **kwargs) -> SemanticCache:
+    cache = SemanticCache(embedding_model=store.embedding_model, compact_interval=0, **kwargs)
+    # Postgresの代わりにプロセス内の保存先を使う
+    cache._vector_store = store
+    return cache
+
+
+async def bench_pipeline(args) -> dict:
+    embeddings = FakeEmbeddings(dim=args.dim, call_latency=args.embed_latency, item_latency=0.0, jitter=args.jitter * args.embed_latency, failure_rate=args.failure_rate, seed=args.seed)
+    store = InMemoryVectorstore(embeddings, dim=args.dim, latency=args.search_latency)
+    corpus = _corpus(args.corpus)
+    await store.aadd_with_vectors(corpus, [text_vector(doc.page_content, args.dim) for doc in corpus])
+
+    llm = FakeChatModel(latency=args.llm_latency, jitter=args.jitter * args.llm_latency, failure_rate=args.failure_rate, seed=args.seed)
+    cache = _semantic_cache(InMemoryVectorstore(embeddings, dim=args.dim))
+    bot = ChatBot(template=config.TEMPLATE, hyde_template=config.HYDE_TEMPLATE, vector_db=store, llm=llm, cache=cache, hyde_deadline_ms=args.hyde_deadline_ms)
+    # HyDEの生成は回答の生成と別の待ち時間にし、仮想文書も質問ごとに変える
+    hyde_llm = FakeChatModel(latency=args.hyde_latency, jitter=args.jitter * args.hyde_latency, failure_rate=args.failure_rate, seed=args.seed + 1, echo=True)
+    bot._hyde_chain = PromptTemplate.from_template(config.HYDE_TEMPLATE) | hyde_llm | StrOutputParser()
+
+    stages = {}
+    bot._graph = _GraphRecorder(bot._graph, stages)
+    bot._lookup = _timed(stages, "lookup_ms", bot._lookup)
+    bot._store = _timed(stages, "store_ms", bot._store)
+
+    questions = _questions(args, corpus, np.random.default_rng(args.seed))
+    queue = asyncio.Queue()
+    for question in questions:
+        queue.put_nowait(question)
+    totals, errors = [], {}
+
+    async def _worker():
+        while not queue.empty():
+            question = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                await bot.run(question)
+                totals.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+    await cache.load()
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    await bot.aclose()
+
+    return {
+        "requests": len(questions),
+        "errors": errors,
+        "requests_per_second": len(questions) / elapsed,
+        "end_to_end_ms": summarize(totals),
+        "stages_ms": {name: summarize(values) for name, values in sorted(stages.items())},
+        "cache": bot.cache_stats(),
+        "hyde_gate": bot._gate.stats() if bot._gate is not None else None,
+    }
+
+
+async def bench_ingestion(args) -> dict:
+    embeddings = FakeEmbeddings(dim=args.dim, call_latency=args.embed_latency, item_latency=0.001, jitter=args.jitter * args.embed_latency, failure_rate=args.failure_rate, seed=args.seed)
+    indexer = IncrementalIndexer(InMemoryVectorstore(embeddings, dim=args.dim, latency=args.write_latency))
+    results = {}
+    # 2回目は同じ文書の再アップロード。ベクトルは全て使い回せるはず
+    for label in ("initial", "reupload"):
+        docs = [Document(page_content=f"取り込み用のチャンク{i}。" * 20, metadata={"source_file": "ingest.pdf", "page_info": i // 5 + 1}) for i in range(args.ingest_chunks)]
+        started = time.perf_counter()
+        report = await indexer.index(docs, "ingest.pdf", batch_size=config.INGESTION_BATCH_SIZE)
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            "chunks": len(docs),
+            "seconds": elapsed,
+            "chunks_per_second": len(docs) / elapsed if elapsed else 0.0,
+            "new": report.new,
+            "reused": report.reused,
+            "failed": report.failed,
+        }
+    return results
+
+
+async def bench_cache_probe(args) -> list:
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for size in args.probe_sizes:
+        store = InMemoryVectorstore(dim=args.probe_dim)
+        vectors = rng.normal(size=(size, args.probe_dim)).astype(np.float32)
+        now = time.time()
+        rows = [
+            Document(id=f"cached-{i}", page_content=f"キャッシュ済みの質問{i}", metadata={"answer": f"回答{i}", "probe_ids": [], "created_at": now, "last_hit": 0.0, "hits": 0})
+            for i in range(size)
+        ]
+        await store.aadd_with_vectors(rows, list(vectors))
+        cache = _semantic_cache(store, max_entries=size)
+        await cache.load()
+
+        # 半分はキャッシュ済みの質問の近く（当たり）、残りは無関係な質問（外れ）
+        hits, misses = [], []
+        for i in range(args.probes):
+            hit = i % 2 == 0
+            query = vectors[int(rng.integers(size))] + rng.normal(scale=0.01, size=args.probe_dim) if hit else rng.normal(size=args.probe_dim)
+            started = time.perf_counter()
+            answer = await cache._check("", vector=query)
+            (hits if answer is not None else misses).append((time.perf_counter() - started) * 1000)
+        await cache.aclose()
+        results.append({"size": size, "dim": args.probe_dim, "hit_ms": summarize(hits), "miss_ms": summarize(misses)})
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _flatten(data, prefix: str = "") -> dict:
+    """比べられる数値だけを{"pipeline.end_to_end_ms.p50": 値}の形に平らにする"""
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, list):
+        for i, item in enumerate(data):
+            label = f"size={item['size']}" if isinstance(item, dict) and "size" in item else str(i)
+            flat.update(_flatten(item, f"{prefix}[{label}]"))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        key = prefix.rsplit(".", 1)[-1]
+        if key in _LATENCY_KEYS or key in _THROUGHPUT_KEYS:
+            flat[prefix] = float(data)
+    return flat
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """baselineよりtolerance(割合)以上悪くなった値の一覧を返し、全ての差を表示する"""
+    now, before = _flatten(current["results"]), _flatten(baseline["results"])
+    regressions = []
+    print(f"\n=== vs baseline {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}) ===")
+    for key in sorted(now.keys() & before.keys()):
+        if not before[key]:
+            continue
+        change = (now[key] - before[key]) / before[key]
+        # 遅延は増えたら、スループットは減ったら悪化
+        worse = change if key.rsplit(".", 1)[-1] in _LATENCY_KEYS else -change
+        mark = "❌" if worse > tolerance else ("✅" if worse < -tolerance else "  ")
+        if worse > tolerance:
+            regressions.append(key)
+        print(f"{mark} {key:<60} {before[key]:10.2f} → {now[key]:10.2f} ({change:+.1%})")
+    return regressions
+
+
+def _print_summary(results: dict):
+    pipeline = results.get("pipeline")
+    if pipeline:
+        e2e = pipeline["end_to_end_ms"]
+        print(f"[pipeline ] {pipeline['requests']} requests, errors={pipeline['errors']} | "
+              f"p50 {e2e.get('p50', 0):.1f} / p95 {e2e.get('p95', 0):.1f} / p99 {e2e.get('p99', 0):.1f} ms | {pipeline['requests_per_second']:.1f} req/s")
+        for name, stats in pipeline["stages_ms"].items():
+            print(f"            {name:<18} p50 {stats['p50']:8.1f} | p95 {stats['p95']:8.1f} | n={stats['n']}")
+    for label, stats in (results.get("ingestion") or {}).items():
+        print(f"[ingestion] {label:<9} {stats['chunks']} chunks in {stats['seconds']:.2f} s | {stats['chunks_per_second']:.1f} chunks/s (new={stats['new']}, reused={stats['reused']}, failed={stats['failed']})")
+    for probe in results.get("cache_probe") or []:
+        hit, miss = probe["hit_ms"], probe["miss_ms"]
+        print(f"[cache    ] {probe['size']:>8} entries | hit p50 {hit.get('p50', 0):.3f} ms | miss p50 {miss.get('p50', 0):.3f} ms | miss p99 {miss.get('p99', 0):.3f} ms")
+
+
+async def main(args) -> int:
+    if not args.verbose:
+        # パイプラインの中のINFOログを出すと、その時間まで測ってしまう
+        logging.disable(logging.INFO)
+    results = {}
+    if "pipeline" in args.scenarios:
+        results["pipeline"] = await bench_pipeline(args)
+    if "ingestion" in args.scenarios:
+        results["ingestion"] = await bench_ingestion(args)
+    if "cache_probe" in args.scenarios:
+        results["cache_probe"] = await bench_cache_probe(args)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "params": vars(args),
+        },
+        "results": results,
+    }
+    _print_summary(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved to {args.out}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default="benchmark_results.json", help="結果のJSONの保存先（空文字なら保存しない）")
+    parser.add_argument("--baseline", default=None, help="比べる前の結果のJSON")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="この割合より悪くなったら悪化とみなす")
+    parser.add_argument("--fail-on-regression", action="store_true", help="悪化があれば終了コード1で終わる")
+    parser.add_argument("--scenarios", nargs="+", default=["pipeline", "ingestion", "cache_probe"], choices=["pipeline", "ingestion", "cache_probe"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="パイプラインのINFOログも出す")
+    # 偽のAPIの振る舞い
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="回答の生成にかかる秒数")
+    parser.add_argument("--hyde-latency", type=float, default=0.4, help="HyDEの生成にかかる秒数")
+    parser.add_argument("--embed-latency", type=float, default=0.03, help="埋め込みの1回の呼び出しにかかる秒数")
+    parser.add_argument("--search-latency", type=float, default=0.01)
+    parser.add_argument("--write-latency", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.2, help="待ち時間のばらつき（待ち時間に対する割合、±）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="LLM・埋め込みの呼び出しが失敗する割合")
+    # pipeline
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--corpus", type=int, default=500, help="検索対象のチャンク数")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--grounded-ratio", type=float, default=0.3, help="チャンクの本文そのままの質問の割合")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="前に出た質問の繰り返しの割合")
+    parser.add_argument("--hyde-deadline-ms", type=float, default=config.HYDE_DEADLINE_MS)
+    # ingestion
+    parser.add_argument("--ingest-chunks", type=int, default=1000)
+    # cache_probe
+    parser.add_argument("--probe-sizes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--probe-dim", type=int, default=768)
+    parser.add_argument("--probes", type=int, default=200)
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
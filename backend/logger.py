@@ -1,4 +1,10 @@
+import atexit
+import copy
+import itertools
 import logging
+import logging.handlers
+import multiprocessing
+import queue
 import sys
 import os
 from src import config
@@ -6,6 +12,46 @@ from src import config
 # logをコンソール出力するメゾっト
 # logをlog.txtに保存するメゾッド
 # errorをerror.txtに保存するメゾッド
+# 書き込みはイベントループを止めないよう、裏のスレッドで行う。
+#   - 各モジュールのloggerはキューに積むだけ(QueueHandler)。整形・コンソール/ファイルへの書き込みはQueueListenerのスレッドが行う
+#   - 長すぎるメッセージは積む前に切り詰める（検索結果の本文を丸ごと出すようなログがディスクとp99を食わないように）
+#   - DEBUGのログは、N件に1件だけ残す（リクエストの中身を丸ごと出すダンプ用）
+#   - ファイルは大きさで切り替える(RotatingFileHandler)
+#   - ファイルに書くのは親プロセスだけ。PDF抽出などの子プロセスはキュー経由で親に送るだけにする
+#     （子プロセスがそれぞれ同じファイルを開いて切り替えると、切り替えが壊れるので）
+#     そのため、LoggerManagerはimportした時点ではなく、最初にget_loggerを呼んだ時に作る
+
+
+class _TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """
+    レコードをキューに積むだけのハンドラ。
+    標準のQueueHandlerは積む前に整形まで済ませてしまうので、メッセージの組み立てと切り詰めだけを行い、
+    整形（時刻・例外のトレースバック）は書き込むスレッドに任せる。
+    """
+    def __init__(self, log_queue, max_chars:int):
+        super().__init__(log_queue)
+        self._max_chars = max_chars
+
+    def prepare(self, record):
+        message = record.getMessage()
+        if self._max_chars and len(message) > self._max_chars:
+            message = f"{message[:self._max_chars]}… (+{len(message) - self._max_chars} chars)"
+        # 同じレコードが他のハンドラにも渡るので、書き換えるのはコピーの方
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        return record
+
+
+class _DebugSampler(logging.Filter):
+    """DEBUGのレコードはevery件に1件だけ通す（INFO以上は全て通す）"""
+    def __init__(self, every:int):
+        super().__init__()
+        self._every = max(1, every)
+        self._count = itertools.count()
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or next(self._count) % self._every == 0
 
 
 class LoggerManager:
@@ -16,40 +62,124 @@ class LoggerManager:
         self._log_dir = config.LOG_DIR
         self._formatter = logging.Formatter(self._FORMAT, self._DATEFORMAT)
         self._ensure_log_dir()
+        # 書き込み先のハンドラは全てのloggerで共有し、裏のスレッド1本だけが使う
+        self._handlers = (
+            self._create_console_handler(),
+            # DEBUGを出すかはloggerのレベル(LOG_LEVEL)で決める
+            self._create_file_handler('log.txt', logging.DEBUG),
+            self._create_file_handler('error.txt', logging.ERROR),
+        )
+        self._queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, *self._handlers, respect_handler_level=True)
+        self._listener.start()
+        # 子プロセスから送られてくるログ用。使う時に作る
+        self._worker_queue = None
+        self._worker_listener = None
+        self._running = True
+        self._queue_handler = _TruncatingQueueHandler(self._queue, config.LOG_MAX_MESSAGE_CHARS)
+        self._queue_handler.addFilter(_DebugSampler(config.LOG_DEBUG_SAMPLE_EVERY))
+        # 終了時に、キューに残っているログを書き切ってから止める
+        atexit.register(self.shutdown)
 
     def _ensure_log_dir(self):
         if not os.path.exists(self._log_dir):
             os.makedirs(self._log_dir)
-    
+
     def _create_console_handler(self):
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(logging.INFO)
-        console_formatter = logging.Formatter(self._FORMAT, self._DATEFORMAT)
-        console_handler.setFormatter(console_formatter)
+        console_handler.setFormatter(self._formatter)
         return console_handler
-    
+
     def _create_file_handler(self, filename:str, level:int):
-        file_handler = logging.FileHandler(
-            os.path.join(self._log_dir, filename), 
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(self._log_dir, filename),
+            maxBytes=config.LOG_MAX_BYTES,
+            backupCount=config.LOG_BACKUP_COUNT,
             encoding='utf-8'
         )
         file_handler.setLevel(level)
-        file_formatter = logging.Formatter(self._FORMAT, self._DATEFORMAT)
-        file_handler.setFormatter(file_formatter)
+        file_handler.setFormatter(self._formatter)
         return file_handler
-    
+
     def get_logger(self, module_name:str):
         logger = logging.getLogger(module_name)
 
         if logger.hasHandlers():
             return logger
 
-        logger.setLevel(logging.INFO)
-        logger.addHandler(self._create_console_handler())
-        logger.addHandler(self._create_file_handler('log.txt', logging.INFO))
-        logger.addHandler(self._create_file_handler('error.txt', logging.ERROR))
+        logger.setLevel(config.LOG_LEVEL)
+        logger.addHandler(self._queue_handler)
         return logger
-    
-_manager = LoggerManager()
+
+    def worker_queue(self):
+        """
+        子プロセスがログを送るキューを返す（spawnの子プロセスにも渡せるmultiprocessingのキュー）。
+        受け取ったログは、親プロセスのハンドラで書く
+        """
+        if self._worker_queue is None:
+            self._worker_queue = multiprocessing.get_context("spawn").Queue()
+            self._worker_listener = logging.handlers.QueueListener(
+                self._worker_queue, *self._handlers, respect_handler_level=True
+            )
+            self._worker_listener.start()
+        return self._worker_queue
+
+    def shutdown(self):
+        """キューに残っているログを書き切って、裏のスレッドを止める"""
+        if self._running:
+            self._running = False
+            if self._worker_listener is not None:
+                self._worker_listener.stop()
+            self._listener.stop()
+
+
+class _WorkerLoggerManager:
+    """
+    子プロセス用。ファイルは開かず、親プロセスのキューに積むだけ。
+    キューが無い時はどこにも出さない(NullHandler)
+    """
+    def __init__(self, log_queue=None):
+        if log_queue is None:
+            self._handler = logging.NullHandler()
+        else:
+            # 標準のQueueHandlerは積む前に整形を済ませるので、例外などを含めても親に送れる
+            self._handler = logging.handlers.QueueHandler(log_queue)
+
+    def get_logger(self, module_name:str):
+        logger = logging.getLogger(module_name)
+        if self._handler in logger.handlers:
+            return logger
+        # 先に付いていたハンドラ（ファイルに書くもの）は外す
+        logger.handlers.clear()
+        logger.setLevel(config.LOG_LEVEL)
+        logger.addHandler(self._handler)
+        return logger
+
+
+_manager: LoggerManager | _WorkerLoggerManager | None = None
+
+
+def _get_manager():
+    global _manager
+    if _manager is None:
+        _manager = LoggerManager()
+    return _manager
+
+
 def get_logger(module_name: str):
-    return _manager.get_logger(module_name)
+    return _get_manager().get_logger(module_name)
+
+
+def worker_log_queue():
+    """子プロセスにログを送ってもらうためのキュー（親プロセスで呼ぶ）"""
+    return _get_manager().worker_queue()
+
+
+def init_worker_logging(log_queue=None):
+    """
+    ProcessPoolExecutorのinitializerに渡す。
+    子プロセスではファイルのハンドラを作らず、親プロセスのキューに送るだけにする
+    """
+    global _manager
+    _manager = _WorkerLoggerManager(log_queue)
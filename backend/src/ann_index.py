@@ -0,0 +1,153 @@
+# このファイルの設計思想：
+# PGVectorのlangchain_pg_embeddingは全コレクションで1つのテーブルで、embedding列は次元の決まっていないvector型。
+# そのままではANN索引(HNSW / IVFFlat)を張れないので、コレクションごとに
+#   - 「collection_id = そのコレクション かつ 次元 = dim」に絞った部分索引
+#   - 次元を固定した式 (embedding::vector(dim)) への索引（halfvecにキャストすれば索引の大きさは半分）
+# を作る。検索も同じ式で並べ替えるSQLをここで組み立て、プランナーが索引を使えるようにする。
+# 二値量子化(binary)の時は、ビット列のハミング距離で候補を多めに拾い、元の精度のベクトルで並べ直す。
+# collection_idはSQLに直接埋め込む（パラメータにすると部分索引の条件と照合できない場合がある）。
+# 次元が違う行（EMBEDDING_DIMENSIONSを変える前の行）は索引にも検索にも入らない。
+
+import uuid
+from dataclasses import dataclass
+import numpy as np
+
+# pgvectorで索引を張れる次元の上限
+_MAX_VECTOR_DIM = 2000
+_MAX_HALFVEC_DIM = 4000
+_MAX_BIT_DIM = 64000
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    method: str = "hnsw"  # "hnsw" か "ivfflat"
+    m: int = 16  # HNSW: 1つの点からのリンク数
+    ef_construction: int = 64  # HNSW: 構築時の候補数
+    lists: int | None = None  # IVFFlat: クラスタ数（Noneなら行数/1000）
+
+    def __post_init__(self):
+        if self.method not in ("hnsw", "ivfflat"):
+            raise ValueError(f"未対応の索引です: {self.method}")
+
+
+@dataclass(frozen=True)
+class VectorLayout:
+    """索引と検索でベクトルをどう扱うか"""
+    dim: int
+    precision: str = "auto"  # "vector"(float32) / "halfvec"(float16) / "auto"(2000次元まではvector)
+    quantization: str | None = None  # None か "binary"
+    rerank_candidates: int = 40  # binaryの時に、並べ直す前に拾う候補の数
+
+    def __post_init__(self):
+        if self.precision not in ("auto", "vector", "halfvec"):
+            raise ValueError(f"未対応の精度です: {self.precision}")
+        if self.quantization not in (None, "binary"):
+            raise ValueError(f"未対応の量子化です: {self.quantization}")
+
+    @property
+    def type(self) -> str:
+        if self.precision == "auto":
+            return vector_type(self.dim)
+        limit = _MAX_VECTOR_DIM if self.precision == "vector" else _MAX_HALFVEC_DIM
+        if self.quantization is None and self.dim > limit:
+            raise ValueError(f"{self.dim}次元の{self.precision}には索引を張れません（上限{limit}次元）")
+        return self.precision
+
+    @property
+    def expr(self) -> str:
+        return f"(embedding::{self.type}({self.dim}))"
+
+    @property
+    def bits_expr(self) -> str:
+        return f"(binary_quantize(embedding)::bit({self.dim}))"
+
+    def query(self) -> str:
+        return f"CAST(:query AS {self.type}({self.dim}))"
+
+    def predicate(self, collection_id:uuid.UUID) -> str:
+        return f"collection_id = {_collection_literal(collection_id)} AND vector_dims(embedding) = {int(self.dim)}"
+
+
+def vector_type(dim:int) -> str:
+    if dim <= _MAX_VECTOR_DIM:
+        return "vector"
+    if dim <= _MAX_HALFVEC_DIM:
+        return "halfvec"
+    raise ValueError(f"{dim}次元のベクトルには索引を張れません（上限{_MAX_HALFVEC_DIM}次元）")
+
+
+def index_name(collection_id:uuid.UUID, method:str, layout:VectorLayout | None = None) -> str:
+    suffix = "_bq" if layout is not None and layout.quantization == "binary" else ""
+    return f"ix_emb_{method}{suffix}_{uuid.UUID(str(collection_id)).hex[:16]}"
+
+
+def _collection_literal(collection_id:uuid.UUID) -> str:
+    # UUIDとして解釈し直してから埋め込むので、任意の文字列は入らない
+    return f"'{uuid.UUID(str(collection_id))}'::uuid"
+
+
+def create_index_sql(collection_id:uuid.UUID, layout:VectorLayout, spec:IndexSpec, rows:int = 0) -> str:
+    if spec.method == "hnsw":
+        options = f"m = {int(spec.m)}, ef_construction = {int(spec.ef_construction)}"
+    else:
+        options = f"lists = {int(spec.lists or max(1, rows // 1000))}"
+    if layout.quantization == "binary":
+        if layout.dim > _MAX_BIT_DIM:
+            raise ValueError(f"{layout.dim}次元のビット列には索引を張れません（上限{_MAX_BIT_DIM}次元）")
+        target = f"{layout.bits_expr} bit_hamming_ops"
+    else:
+        target = f"{layout.expr} {layout.type}_cosine_ops"
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(collection_id, spec.method, layout)} "
+        f"ON langchain_pg_embedding USING {spec.method} ({target}) "
+        f"WITH ({options}) WHERE {layout.predicate(collection_id)}"
+    )
+
+
+def drop_index_sql(collection_id:uuid.UUID, method:str, layout:VectorLayout | None = None) -> str:
+    return f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(collection_id, method, layout)}"
+
+
+def tuning_sql(ef_search:int | None = None, probes:int | None = None) -> list[str]:
+    """このトランザクションの中だけ検索の精度と速さの釣り合いを変える"""
+    statements = []
+    if ef_search:
+        statements.append(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+    if probes:
+        statements.append(f"SET LOCAL ivfflat.probes = {int(probes)}")
+    return statements
+
+
+def knn_sql(collection_id:uuid.UUID, layout:VectorLayout, with_vectors:bool = False) -> str:
+    """
+    :query(ベクトルの文字列)に近い順に:k件。距離はPGVectorと同じコサイン距離。
+    with_vectorsなら行のベクトル(embedding)も返す（同じ行をもう一度読みに行かずに済む）。
+    """
+    distance = f"{layout.expr} <=> {layout.query()}"
+    columns = "id, document, cmetadata, embedding" if with_vectors else "id, document, cmetadata"
+    if layout.quantization == "binary":
+        # ビット列で:candidates件まで絞り、その中だけ元の精度で距離を計算して並べ直す
+        return (
+            f"SELECT {columns}, {distance} AS distance FROM ("
+            f"SELECT id, document, cmetadata, embedding FROM langchain_pg_embedding "
+            f"WHERE {layout.predicate(collection_id)} "
+            f"ORDER BY {layout.bits_expr} <~> binary_quantize({layout.query()}) LIMIT :candidates"
+            f") candidates ORDER BY distance LIMIT :k"
+        )
+    return (
+        f"SELECT {columns}, {distance} AS distance "
+        f"FROM langchain_pg_embedding WHERE {layout.predicate(collection_id)} "
+        f"ORDER BY {distance} LIMIT :k"
+    )
+
+
+def knn_params(vector, k:int, layout:VectorLayout) -> dict:
+    params = {"query": vector_literal(vector), "k": k}
+    if layout.quantization == "binary":
+        params["candidates"] = max(k, layout.rerank_candidates)
+    return params
+
+
+def vector_literal(vector) -> str:
+    # float32の最短表記にする（float64に直すと桁が増えて送る量が倍になる）
+    return "[" + ",".join(str(x) for x in np.asarray(vector, dtype=np.float32)) + "]"
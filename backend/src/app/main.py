@@ -1,8 +1,13 @@
 # main.py
+import asyncio
+import os
+import time
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from src.app.router import upload
 from src.app.router import chat
+from src.app.router import health
+from src.app.router import metrics
 from src.app.dependencies import set_bot
 from logger import get_logger
 
@@ -12,51 +17,135 @@ from src.vector_store import Vectorstore
 from src.bot import ChatBot
 from fastapi.middleware.cors import CORSMiddleware
 from src.factories import Factories
-
-# グローバル変数として保持（簡易的な実装）
-# 実際は app.state に持たせるのがきれいですが、わかりやすさ優先でここに書きます
-bot_instance = None
+from src.jobs import IngestionQueue, JobStore
+from src.processor import DocumentProcessor
+from src.ingestion import IncrementalIndexer
+from src.snapshot import arestore_snapshot, load_snapshot, save_snapshot, source_fingerprint
+from src.cache_tiers import get_corpus_version
+from src.embeddings import embedding_batcher_stats, get_embedding_memo
+from src.metrics import StatsCollector
+from src.rate_limiter import rate_limiter_stats
+from src.db import get_engine_registry
+from prometheus_client import REGISTRY
+
+async def _warm_up(app: FastAPI):
+    """
+    重たい初期化（元の文書の索引付け、ChatBotの構築、キャッシュの読み込み）を裏で行う。
+    終わるまでは /health/ready が503を返す。
+    """
+    logger = get_logger("Lifespan")
+    started = time.perf_counter()
+    try:
+        vector_store = app.state.vector_store
+        source_file = os.path.basename(config.WEB_PATH)
+        # 保存したキャッシュの回答と比べられるよう、コーパスの版を最初に読み込む
+        await get_corpus_version().aload()
+
+        # 1. 元の文書: スナップショットが使えれば解析し直さない
+        fingerprint = await asyncio.to_thread(source_fingerprint, config.WEB_PATH, vector_store.embedding_model)
+        snapshot = await asyncio.to_thread(load_snapshot, config.SNAPSHOT_DIR, fingerprint)
+        if snapshot is not None:
+            logger.info(f"⚡ Loaded snapshot with {len(snapshot)} chunks in {time.perf_counter() - started:.3f}s")
+            # DBが作り直されていても、スナップショットのベクトルで書き戻せば解析も埋め込みも要らない
+            restored, removed = await arestore_snapshot(vector_store, snapshot, source_file)
+            if restored or removed:
+                logger.warning(f"♻️ {source_file} in the DB did not match the snapshot: restored {restored}, removed {removed} chunks")
+                await get_corpus_version().abump(f"(snapshot restore: {source_file} +{restored} -{removed})")
+        else:
+            def _chunks():
+                for doc in Factories.choiseloader(config.WEB_PATH).iter_chunks():
+                    doc.metadata.setdefault("source_file", source_file)
+                    yield doc
+            # 読みながら差分を調べ、変わっていないチャンクは既存のベクトルを使い回す
+            report = await IncrementalIndexer(vector_store).index(_chunks(), source_file, batch_size=config.INGESTION_BATCH_SIZE)
+            logger.info(f"💾 Indexed {config.WEB_PATH}: new={report.new}, reused={report.reused}, deleted={report.deleted}")
+            rows = await vector_store.aget_by_metadata("source_file", [source_file])
+            await asyncio.to_thread(save_snapshot, config.SNAPSHOT_DIR, [d for d, _ in rows], [v for _, v in rows], fingerprint)
+            logger.info(f"📦 Saved snapshot with {len(rows)} chunks to {config.SNAPSHOT_DIR}")
+        phase_source = time.perf_counter() - started
+
+        # 2. ChatBotのインスタンス化 (lifespanで作成した vector_store を渡す)
+        bot_instance = ChatBot(
+            template=config.TEMPLATE,
+            hyde_template=config.HYDE_TEMPLATE,
+            vector_db=vector_store
+        )
+        await bot_instance.warmup()  # SemanticCacheをメモリに読み込む
+        app.state.bot = bot_instance
+        set_bot(bot_instance)
+
+        app.state.startup_seconds = time.perf_counter() - started
+        app.state.ready = True
+        logger.info(f"🤖 Bot is ready! startup took {app.state.startup_seconds:.3f}s (source: {phase_source:.3f}s, bot: {app.state.startup_seconds - phase_source:.3f}s)")
+    except Exception as e:
+        app.state.startup_error = str(e)
+        logger.error(f"❌ Warm-up failed: {e}")
+        return
+
+    # ANN索引は作っている間も検索できる（索引が無い間は全件を比べる）ので、準備完了の後で作る
+    try:
+        await vector_store.aensure_index()
+    except Exception as e:
+        logger.error(f"❌ Failed to build vector index: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     アプリ起動時に1回だけ実行される処理
-    ここで重たい処理（データのロード、VectorStoreの構築）を済ませる
+    すぐに終わる準備だけをここで行い、重たい処理は_warm_upとして裏で走らせる
     """
     logger = get_logger("Lifespan")
-    logger.info("🚀 System Starting... Loading Data...")
-
-    # 1. データのロード (ETL)
-    loader = Factories.choiseloader(config.WEB_PATH)
-    docs = loader.load()
-    logger.info(f"✅ Loaded {len(docs)} chunks from {config.WEB_PATH}.")
+    logger.info("🚀 System Starting...")
+    app.state.ready = False
+    app.state.bot = None
 
-    # 2. VectorStoreの初期化
+    # 1. VectorStoreの初期化（DBへの接続は使う時まで行われない）
     vector_store = Vectorstore(config.EMBEDDING_MODEL, collection_name="RAG_docs")
     app.state.vector_store = vector_store  # FastAPIのstateにも保存しておく
+    get_corpus_version().attach(vector_store)  # コーパスの版はこのコレクションに保存する
 
-    # 3. ChatBotのインスタンス化 (ここで作成した vector_store を渡す)
-    bot_instance = ChatBot(
-        template=config.TEMPLATE,
-        hyde_template=config.HYDE_TEMPLATE,
-        vector_db=vector_store
-    )
-    set_bot(bot_instance)
-    logger.info("🤖 Bot is ready!")
+    # 2. 取り込みジョブのワーカーを起動（前回終わらなかったジョブもここで再開される）
+    ingestion = IngestionQueue(vector_store, DocumentProcessor(), JobStore())
+    await ingestion.start()
+    app.state.ingestion = ingestion
+
+    # 3. 重たい初期化は裏で行う
+    warm_up = asyncio.create_task(_warm_up(app))
 
     yield  # ここでアプリが稼働開始
 
     # 終了時の処理（必要なら）
     logger.info("🛑 System Shutdown.")
+    warm_up.cancel()
+    await asyncio.gather(warm_up, return_exceptions=True)
+    await ingestion.stop()
+    if app.state.bot is not None:
+        await app.state.bot.aclose()
     set_bot(None)
-    bot_instance = None
+    await get_engine_registry().aclose()
 
 
 # アプリ作成
 app = FastAPI(lifespan=lifespan, title="Aozora RAG API")
 
 
+def _runtime_stats() -> dict:
+    """/metricsが読まれた時に、キャッシュの段・相乗り・レート制限器・埋め込みのバッチャー・DBの接続プールが数えている累計を集める"""
+    bot = getattr(app.state, "bot", None)
+    cache = bot.cache_stats() if bot is not None else {}
+    return {
+        "singleflight": cache.pop("singleflight", None),
+        "cache": {**cache, "embedding_memo": get_embedding_memo().stats()},
+        "limiters": rate_limiter_stats(),
+        "embedding_batchers": embedding_batcher_stats(),
+        "db_pools": get_engine_registry().stats(),
+    }
+
+
+REGISTRY.register(StatsCollector(_runtime_stats))
+
+
 
 # === CORS設定 (Security Policy) ===
     
@@ -80,6 +169,8 @@ app.add_middleware(
     
 app.include_router(chat.router)
 app.include_router(upload.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,30 +1,39 @@
 # routers/chat.py
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from src.schemas import ChatInput, ChatOutput
 from src.bot import ChatBot
 from src.app.dependencies import get_bot # さっき作った依存関係
+from src.metrics import STREAM_TIME_TO_FIRST_TOKEN, STREAM_TIME_TO_SOURCES, STREAM_TOTAL
+from src.scheduler import Overloaded, get_llm_scheduler, request_scope
+from logger import get_logger
 import asyncio
+import json
+import time
+
+logger = get_logger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
 @router.post("/", response_model=ChatOutput)
 async def chat_endpoint(
     payload: ChatInput, 
     bot: ChatBot = Depends(get_bot) # ここで準備済みのBotを受け取る
 ):
-    sem = asyncio.Semaphore(3)
-
-    async def _runner(q):
-        async with sem:  # 整理券を取る（なければ待つ）
-            return await bot.run(q)
-        
     # ユーザーの質問
     questions = payload.questions
 
     try:
-        chat_responses = await asyncio.gather(
-            *[_runner(q) for q in questions]  # これはforループの各質問を並列処理する。
-        )
+        # LLMの同時実行数はアプリ全体のスケジューラが絞る。混んでいればLLMを呼ぶ前に断る
+        get_llm_scheduler().admit()
+        with request_scope():
+            chat_responses = await asyncio.gather(
+                *[bot.run(q) for q in questions]  # これはforループの各質問を並列処理する。
+            )
         
         # ChatResponseオブジェクトからAnswerItemsに変換
         responses = [
@@ -41,7 +50,81 @@ async def chat_endpoint(
         
         return ChatOutput(responses=responses)
 
-        
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         # エラーログなどはここで処理
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def _stream_question(bot: ChatBot, index: int, question: str, queue: asyncio.Queue):
+    """1つの質問のイベントを計測しながらキューに流す"""
+    start = time.perf_counter()
+    first_token_at = None
+    sources_at = None
+    try:
+        async for event in bot.astream(question):
+            elapsed = time.perf_counter() - start
+            if event["type"] == "sources" and sources_at is None:
+                sources_at = elapsed
+                STREAM_TIME_TO_SOURCES.observe(elapsed)
+            elif event["type"] in ("token", "cache_hit") and first_token_at is None:
+                first_token_at = elapsed
+                STREAM_TIME_TO_FIRST_TOKEN.observe(elapsed)
+            await queue.put({"index": index, "question": question, "elapsed_ms": round(elapsed * 1000, 1), **event})
+    except Overloaded as e:
+        logger.warning(f"⚠️ Stream rejected (question={question}): {e}")
+        await queue.put({"index": index, "question": question, "type": "error", "detail": str(e), "status": e.status_code, "retry_after": e.retry_after})
+    except Exception as e:
+        logger.error(f"❌ Stream error (question={question}): {e}")
+        await queue.put({"index": index, "question": question, "type": "error", "detail": str(e)})
+    finally:
+        total = time.perf_counter() - start
+        STREAM_TOTAL.observe(total)
+        logger.info(
+            f"stream finished: index={index}, "
+            f"time_to_sources={sources_at if sources_at is None else round(sources_at * 1000, 1)}ms, "
+            f"time_to_first_token={first_token_at if first_token_at is None else round(first_token_at * 1000, 1)}ms, "
+            f"total={round(total * 1000, 1)}ms"
+        )
+
+
+async def _event_stream(bot: ChatBot, questions: list[str]):
+    # 各質問を並行に走らせ、進んだ順にイベントを混ぜて送る
+    queue: asyncio.Queue = asyncio.Queue()
+    with request_scope():
+        tasks = [asyncio.create_task(_stream_question(bot, i, q, queue)) for i, q in enumerate(questions)]
+    finished = asyncio.gather(*tasks)
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, finished}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            yield _sse(getter.result())
+        # 全ての質問が終わった後に残っているイベントを流し切る
+        while not queue.empty():
+            yield _sse(queue.get_nowait())
+        yield _sse({"type": "end"})
+    finally:
+        # クライアントが切断した場合は残りの生成を止める
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/stream")
+async def chat_stream_endpoint(
+    payload: ChatInput,
+    bot: ChatBot = Depends(get_bot)
+):
+    """質問ごとの参照元・回答トークンをServer-Sent Eventsで順次返す"""
+    try:
+        get_llm_scheduler().admit()
+    except Overloaded as e:
+        raise _overloaded(e)
+    return StreamingResponse(_event_stream(bot, payload.questions or []), media_type="text/event-stream")
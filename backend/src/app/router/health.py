@@ -0,0 +1,39 @@
+# routers/health.py
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+
+@router.get("/live")
+async def liveness():
+    """プロセスが動いていれば常に200を返す"""
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+async def readiness(request: Request):
+    """裏での初期化が終わり、質問に答えられる状態なら200、そうでなければ503を返す"""
+    state = request.app.state
+    if getattr(state, "ready", False):
+        return {"status": "ready", "startup_seconds": state.startup_seconds}
+    error = getattr(state, "startup_error", None)
+    return JSONResponse(status_code=503, content={"status": "failed" if error else "starting", "error": error})
+
+
+@router.get("/index")
+async def index_status(request: Request):
+    """文書コレクションのANN索引の状態（有無・使えるか・作成中なら進み具合）を返す"""
+    try:
+        return await request.app.state.vector_store.aindex_status()
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": str(e)})
+
+
+@router.get("/cache")
+async def cache_status(request: Request):
+    """回答・HyDE・検索結果のキャッシュの段ごとのヒット率、同じ質問の相乗りの回数と、今のコーパスの版を返す"""
+    bot = getattr(request.app.state, "bot", None)
+    if bot is None:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return bot.cache_stats()
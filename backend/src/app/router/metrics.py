@@ -0,0 +1,12 @@
+# routers/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheusが読み取る、段階ごとの所要時間・実行中の数・キャッシュのヒット数・APIの呼び出し数"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,7 +1,8 @@
+import asyncio
 from fastapi import APIRouter, UploadFile, Form, HTTPException, Request
 from pydantic import BaseModel
 from src.processor import DocumentProcessor
-from langchain_core.documents import Document
+from src.jobs import IngestionJob, JobStatus
 from logger import get_logger
 
 logger = get_logger(__name__)
@@ -9,12 +10,14 @@ logger = get_logger(__name__)
 router = APIRouter()
 class UploadResponse(BaseModel):
     message: str
-    processed_pages: int
+    job_id: str
+    status: JobStatus
     
-@router.post("/upload", operation_id="upload_file", response_model=UploadResponse)
+@router.post("/upload", operation_id="upload_file", response_model=UploadResponse, status_code=202)
 async def upload_file(request: Request, file:UploadFile, title:str = Form(...)) -> UploadResponse:
     """
-    ファイルをアップロードし、ドキュメントとして処理します。
+    ファイルを受け付け、取り込みジョブとして登録します。
+    解析・埋め込みは裏で行われるので、進み具合は GET /upload/jobs/{job_id} で確認してください。
     
     - **file**: アップロードするファイル
     - **title**: ユーザーが指定するタイトル
@@ -22,20 +25,32 @@ async def upload_file(request: Request, file:UploadFile, title:str = Form(...))
     try:
         logger.info(f"📥 Uploading file: {file.filename}, title: {title}")
         processor = DocumentProcessor()
-        documents = await processor.process(file, user_title=title)
-        logger.info(f"📄 Processed {len(documents)} documents")
-        
-        vector_store = request.app.state.vector_store
-        logger.info(f"💾 Adding documents to vector store...")
-        # レート制限対策: バッチサイズを小さく、待機時間を長く
-        vector_store.add(documents, batch_size=10, sleep_time=10)
-        logger.info(f"✅ Successfully added {len(documents)} documents to vector store")
-        
+        file_path = await processor.save(file)
+        ingestion = request.app.state.ingestion
+        try:
+            job = await ingestion.submit(file_path, file.filename, title)
+        except asyncio.QueueFull:
+            file_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=503, detail={"error": "Too many uploads in progress. Please retry later."})
+        logger.info(f"📝 Queued ingestion job {job.id} for {file.filename}")
+
         return UploadResponse(
-            message=f"Successfully processed '{title}'",
-            processed_pages=len(documents)
+            message=f"Accepted '{title}'",
+            job_id=job.id,
+            status=job.status,
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail={"error": str(e)})
+
+
+@router.get("/upload/jobs/{job_id}", operation_id="get_upload_job", response_model=IngestionJob)
+async def get_upload_job(request: Request, job_id: str) -> IngestionJob:
+    """取り込みジョブの状態（queued / parsing / embedding n/m / done / failed）を返します。"""
+    job = request.app.state.ingestion.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": f"Job {job_id} not found"})
+    return job
@@ -1,13 +1,24 @@
 #===　1.モジュール等の事前準備の段階 ===#
+import asyncio
+import operator
+import time
 from langchain.chat_models import init_chat_model
 from langchain_core.documents import Document
-from typing_extensions import List, TypedDict
+from typing_extensions import Annotated, List, TypedDict
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langgraph.graph import START, StateGraph
 from src.vector_store import Vectorstore
 from src import config
 from src.cache import SemanticCache
+from src.singleflight import SingleFlight, normalize_question
+from src.rate_limiter import Priority, estimate_tokens, get_rate_limiter
+from src.fusion import reciprocal_rank_fusion
+from src.hyde_gate import HydeGate
+from src.context_packer import ContextPacker
+from src.cache_tiers import LRUTier, get_corpus_version, vector_key
+from src.scheduler import LLMScheduler, Overloaded, get_llm_scheduler
+from src.metrics import CHAT_RUN_SECONDS, GRAPH_NODE_IN_FLIGHT, GRAPH_NODE_SECONDS, HYDE_SHED, track
 from logger import get_logger
 from pydantic import ValidationError, BaseModel
 from typing import Optional
@@ -27,93 +38,432 @@ class ChatResponse(BaseModel):
 class State(TypedDict):
         question: str
         context: List[Document]
+        context_vectors: dict  # 検索結果の{ID: ベクトル}（検索のSQLで一緒に取ったもの。詰める時の重複判定に使う）
         answer: str
         pre_query: str
+        question_vector: List[float]
+        hyde_bypassed: bool  # 質問そのままでの検索で足りたのでHyDEを飛ばしたか
+        packing: dict  # 検索結果をプロンプトに詰めた時のトークン数（前後・節約分）
+        probe_ids: List[str]  # 質問そのままでの検索結果のID（キャッシュした回答を確かめ直す時に使う）
+        timings: Annotated[dict, operator.or_]  # 段階ごとの所要時間(ミリ秒)。各ノードが自分の分を足していく
+
+
+def _ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def _ids(results) -> List[str]:
+    return [doc.id for doc, _ in results if doc.id]
+
+
+def _node(name: str, func):
+    """グラフのノードを包み、ノードごとの所要時間と実行中の数をPrometheusに記録する"""
+    return track(GRAPH_NODE_SECONDS, GRAPH_NODE_IN_FLIGHT, node=name)(func)
+
+
+def _format_timings(timings: dict) -> str:
+    return ", ".join(f"{name}={value:.0f}" if isinstance(value, float) else f"{name}={value}" for name, value in timings.items())
 
 
 class ChatBot:
-    def __init__(self, template:str, hyde_template:str, vector_db: Vectorstore, chat_model=config.CHAT_MODEL, model_provider=config.MODEL_PROVIDER):
+    def __init__(self, template:str, hyde_template:str, vector_db: Vectorstore, chat_model=config.CHAT_MODEL, model_provider=config.MODEL_PROVIDER, llm=None, cache: Optional[SemanticCache] = None, retrieval_mode: str = config.RETRIEVAL_MODE, hyde_deadline_ms: Optional[float] = config.HYDE_DEADLINE_MS, hyde_gate: Optional[HydeGate] = None, context_packer: Optional[ContextPacker] = None, scheduler: Optional[LLMScheduler] = None):
         self._template = template
         self._hyde_template = hyde_template
         self._vector_db = vector_db
-        self._llm = init_chat_model(chat_model, model_provider=model_provider, max_retries=3, timeout=30)
+        # llm・cacheは外から差し込めるようにしておく（ベンチマークやテスト用）
+        self._llm = llm or init_chat_model(chat_model, model_provider=model_provider, max_retries=3, timeout=30)
         hyde_prompt = PromptTemplate.from_template(self._hyde_template)
         self._prompt = PromptTemplate.from_template(self._template)
         self._hyde_chain = hyde_prompt | self._llm | StrOutputParser()
+        # "parallel"ならHyDEと質問そのままでの検索を同時に始める。"sequential"ならhyde → retrieveの順
+        if retrieval_mode not in ("parallel", "sequential"):
+            raise ValueError(f"未対応の検索モードです: {retrieval_mode}")
+        self._retrieval_mode = retrieval_mode
+        self._hyde_deadline = hyde_deadline_ms / 1000 if hyde_deadline_ms else None
+        # HyDEを飛ばすかを決める門番。HYDE_BYPASSがFalseなら常にHyDEを使う
+        self._gate = hyde_gate or (HydeGate() if config.HYDE_BYPASS else None)
+        self._audits = set()
+        self._packer = context_packer or ContextPacker()
         self._graph = self._graph_builder()
         self._logger = get_logger(__name__)
-        self._cache = SemanticCache(embedding_model=config.EMBEDDING_MODEL)
-    
-    def _hyde_preparation(self, state:State):
-        original_question = state["question"]
-        hypothetical_document = self._hyde_chain.invoke({"question": original_question})
-        return {"pre_query": hypothetical_document}
+        # SemanticCacheは__len__を持つので、空のキャッシュを渡された時に `or` だと差し替わってしまう
+        self._cache = cache if cache is not None else SemanticCache(embedding_model=config.EMBEDDING_MODEL)
+        self._flight = SingleFlight()
+        # LLMの呼び出しはプロセス共通のレート制限器を通す（対話なので取り込みより優先）
+        self._llm_limiter = get_rate_limiter("llm")
+        # HyDE・回答の生成の同時実行数はアプリ全体で絞る（混んでいればOverloadedで断る）
+        self._scheduler = scheduler or get_llm_scheduler()
+        # SemanticCacheの手前・パイプラインの途中に置くキャッシュの段（src/cache_tiers.py）
+        self._answers = LRUTier(config.ANSWER_CACHE_SIZE)
+        self._hyde_cache = LRUTier(config.HYDE_CACHE_SIZE, versioned=False)
+        self._retrievals = LRUTier(config.RETRIEVAL_CACHE_SIZE)
+
+    async def _hypothetical_document(self, question: str, priority: Priority = Priority.INTERACTIVE) -> str:
+        key = normalize_question(question)
+        cached = await self._hyde_cache.aget(key)
+        if cached is not None:
+            return cached.value
+        # 429はレート制限器に伝えて、待ってからやり直す（他の呼び出しも一緒に絞られる）
+        async with self._scheduler.slot("hyde"):
+            hypothetical_document = await self._llm_limiter.call(
+                lambda: self._hyde_chain.ainvoke({"question": question}),
+                tokens=estimate_tokens(self._hyde_template + question),
+                priority=priority,
+            )
+        self._hyde_cache.put(key, hypothetical_document)
+        return hypothetical_document
+
+    async def _search(self, vector):
+        """
+        ((Document, 距離)を近い順にRETRIEVER_K件, その{ID: ベクトル})を返す。同じベクトルの検索はコーパスの版が同じ間は使い回す。
+        ベクトルは検索のSQLで一緒に取っておき、回答を作る前の重複判定でDBへ読み直しに行かない。
+        """
+        key = vector_key(vector, config.RETRIEVER_K)
+        cached = await self._retrievals.aget(key)
+        if cached is not None:
+            return cached.value
+        rows = await self._vector_db.asearch_with_vectors(vector, k=config.RETRIEVER_K)
+        found = ([(doc, distance) for doc, distance, _ in rows], {doc.id: embedding for doc, _, embedding in rows if doc.id})
+        self._retrievals.put(key, found)
+        return found
+
+    async def _search_text(self, query: str):
+        # 埋め込みはCachedEmbeddingsのメモに当たるので、同じHyDEの文書なら検索結果の段にも当たる
+        return await self._search(await self._vector_db.aembed_query(query))
+
+    async def _raw_search(self, state: State, timings: dict):
+        """質問そのままのベクトルで検索する。((Document, 距離)を近い順に, {ID: ベクトル})を返す"""
+        started = time.perf_counter()
+        vector = state.get("question_vector") or await self._vector_db.aembed_query(state["question"])
+        found = await self._search(vector)
+        timings["raw_retrieve_ms"] = _ms(started)
+        return found
 
+    def _bypass(self, state: State, results) -> bool:
+        return self._gate.decide(state["question"], [distance for _, distance in results])
 
-    def _retrieve(self, state: State):
+    async def _hyde_preparation(self, state:State):
+        timings = {}
+        if self._gate is not None:
+            try:
+                results, vectors = await self._raw_search(state, timings)
+            except Exception as e:
+                self._logger.error(f"質問そのままでの検索中にエラーが発生しました: {e}")
+                results, vectors = [], {}
+            if self._bypass(state, results):
+                return {"pre_query": "", "context": [doc for doc, _ in results], "context_vectors": vectors, "hyde_bypassed": True, "probe_ids": _ids(results), "timings": timings}
+            probe = None
+        else:
+            # 飛ばすかの判断はしないが、キャッシュした回答を後で確かめ直すための検索結果のID(probe_ids)は取っておく
+            # （無いとコーパスが変わるたびに全部作り直しになる）。質問のベクトルは計算済みなので、HyDEと同時に走らせる
+            probe = asyncio.create_task(self._raw_search(state, timings))
+        started = time.perf_counter()
+        try:
+            hypothetical_document = await self._hypothetical_document(state["question"])
+        except BaseException:
+            if probe is not None:
+                probe.cancel()
+            raise
+        timings["hyde_ms"] = _ms(started)
+        if probe is not None:
+            try:
+                results, _ = await probe
+            except Exception as e:
+                self._logger.warning(f"⚠️ 質問そのままでの検索に失敗したので、この回答は確かめ直せません: {e}")
+                results = []
+        return {"pre_query": hypothetical_document, "hyde_bypassed": False, "probe_ids": _ids(results), "timings": timings}
+
+
+    async def _retrieve(self, state: State):
+        if state.get("hyde_bypassed"):
+            # hydeノードで取った文書をそのまま使う
+            return {"context": state["context"]}
         pre_query = state["pre_query"]
+        started = time.perf_counter()
         try:
-            retrieved_docs = self._vector_db.search(
-                query = pre_query,
-                k=config.RETRIEVER_K
-            )
-            return {"context": retrieved_docs}
+            results, vectors = await self._search_text(pre_query)
+            return {"context": [doc for doc, _ in results], "context_vectors": vectors, "timings": {"retrieve_ms": _ms(started)}}
         except Exception as e:
             self._logger.error(f"ドキュメントの検索中にエラーが発生しました: {e}")
-            return {"context": []}
-        
+            return {"context": [], "context_vectors": {}, "timings": {"retrieve_ms": _ms(started)}}
 
-    async def _generate(self, state: State):
-        docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+
+    async def _speculative_retrieve(self, state: State):
+        """
+        HyDEの生成を待たずに、質問そのままのベクトルでの検索も同時に始める。
+        両方そろったらRRFで混ぜる。HyDEが期限(hyde_deadline_ms)までに終わらなければ、
+        質問そのままでの検索結果だけで回答を作る。HyDEの枠が一杯で断られた(Overloaded)時も同じ。
+        HyDEを飛ばすかを判断する時も、HyDEは待たずに始めておき、質問そのままでの検索の結果で
+        飛ばすと決まったら取り消す（飛ばさない質問では、2つが順番に走って遅くならないように）。
+        """
+        started = time.perf_counter()
+        timings = {}
+
+        async def _hyde():
+            t = time.perf_counter()
+            pre_query = await self._hypothetical_document(state["question"])
+            timings["hyde_ms"] = _ms(t)
+            t = time.perf_counter()
+            results, vectors = await self._search_text(pre_query)
+            timings["hyde_retrieve_ms"] = _ms(t)
+            return pre_query, [doc for doc, _ in results], vectors
+
+        raw_task = asyncio.create_task(self._raw_search(state, timings))
+        hyde_task = asyncio.create_task(_hyde())
+        if self._gate is not None:
+            try:
+                await asyncio.wait({raw_task})
+            except BaseException:
+                raw_task.cancel()
+                hyde_task.cancel()
+                raise
+            if raw_task.exception() is None and self._bypass(state, raw_task.result()[0]):
+                hyde_task.cancel()
+                timings["retrieve_ms"] = _ms(started)
+                results, vectors = raw_task.result()
+                return {"context": [doc for doc, _ in results], "context_vectors": vectors, "pre_query": "", "hyde_bypassed": True, "probe_ids": _ids(results), "timings": timings}
+        try:
+            # 期限はHyDEを始めた時(=この関数の始め)から数える
+            timeout = None if self._hyde_deadline is None else max(0.0, self._hyde_deadline - (time.perf_counter() - started))
+            await asyncio.wait({hyde_task}, timeout=timeout)
+            if not hyde_task.done():
+                hyde_task.cancel()
+                timings["hyde_timed_out"] = True
+                self._logger.warning(f"⏱️ HyDEが期限({self._hyde_deadline * 1000:.0f} ms)に間に合わなかったので、質問そのままでの検索結果だけを使います")
+            raw_results, hyde_results = await asyncio.gather(raw_task, hyde_task, return_exceptions=True)
+        finally:
+            raw_task.cancel()
+            hyde_task.cancel()
+
+        result_lists, pre_query, probe_ids, vectors = [], "", [], {}
+        if isinstance(hyde_results, Overloaded):
+            # HyDEの枠が一杯で断られた。エラーではなく、質問そのままでの検索結果だけで答える（負荷を落とす）
+            # 質問そのままでの検索も失敗していれば、答えようが無いので順番モードと同じく429/503で断る
+            if isinstance(raw_results, BaseException):
+                raise hyde_results
+            timings["hyde_shed"] = True
+            HYDE_SHED.inc()
+        elif isinstance(hyde_results, BaseException):
+            if not isinstance(hyde_results, asyncio.CancelledError):
+                self._logger.error(f"HyDEでの検索中にエラーが発生しました: {hyde_results}")
+        else:
+            pre_query, hyde_docs, hyde_vectors = hyde_results
+            result_lists.append(hyde_docs)
+            vectors.update(hyde_vectors)
+        if isinstance(raw_results, BaseException):
+            self._logger.error(f"質問そのままでの検索中にエラーが発生しました: {raw_results}")
+        else:
+            results, raw_vectors = raw_results
+            result_lists.append([doc for doc, _ in results])
+            vectors.update(raw_vectors)
+            probe_ids = _ids(results)
+
+        timings["retrieve_ms"] = _ms(started)
+        context = reciprocal_rank_fusion(result_lists, limit=config.RETRIEVER_K)
+        return {"context": context, "context_vectors": vectors, "pre_query": pre_query, "hyde_bypassed": False, "probe_ids": probe_ids, "timings": timings}
+
+
+    async def _answer(self, question: str, docs: List[Document], priority: Priority = Priority.INTERACTIVE) -> str:
+        docs_content = "\n\n".join(doc.page_content for doc in docs)
         if not docs_content:
-            return {"answer": "申し訳ありませんが、関連する情報が見つかりませんでした。別の質問をお試しください。"}
-        messages = self._prompt.invoke({"question": state["question"], "context": docs_content})
-        response = await self._llm.ainvoke(messages)
+            return "申し訳ありませんが、関連する情報が見つかりませんでした。別の質問をお試しください。"
+        messages = self._prompt.invoke({"question": question, "context": docs_content})
+        async with self._scheduler.slot("generate"):
+            response = await self._llm_limiter.call(
+                lambda: self._llm.ainvoke(messages),
+                tokens=estimate_tokens(messages.to_string()),
+                priority=priority,
+            )
+        return response.content
+
+    async def _pack(self, docs: List[Document], vectors: Optional[dict] = None):
+        """
+        重複を落とし、重なるチャンクをつなげて、トークンの予算まで詰める。
+        vectorsは検索の時に一緒に取った{ID: ベクトル}。足りない分だけDBから読む。
+        """
+        vectors = dict(vectors or {})
+        missing = [doc.id for doc in docs if doc.id and doc.id not in vectors]
+        if missing:
+            try:
+                vectors.update(await self._vector_db.aget_vectors(missing))
+            except Exception as e:
+                self._logger.warning(f"⚠️ 検索結果のベクトルを取り出せなかったので、本文が同じものだけを重複とみなします: {e}")
+        packed = self._packer.pack(docs, vectors)
+        self._logger.info(
+            f"📦 context: {len(docs)} → {len(packed.documents)} chunks, {packed.tokens_before} → {packed.tokens_after} tokens "
+            f"(saved {packed.tokens_saved}; duplicates={packed.duplicates}, merged={packed.merged}, dropped={packed.dropped})"
+        )
+        return packed
+
+    async def _generate(self, state: State):
+        started = time.perf_counter()
+        packed = await self._pack(state["context"], state.get("context_vectors"))
+        answer = await self._answer(state["question"], packed.documents)
+        packing = {"tokens_before": packed.tokens_before, "tokens_after": packed.tokens_after, "tokens_saved": packed.tokens_saved}
+        return {"answer": answer, "packing": packing, "timings": {"generate_ms": _ms(started)}}
+
+
+    async def _audit_bypass(self, question: str, answer: str, docs: List[Document]):
+        """HyDEを飛ばした質問について、HyDEありの回答も裏で作って一致度を記録する（対話より後回し）"""
+        try:
+            pre_query = await self._hypothetical_document(question, priority=Priority.BULK)
+            hyde_results, hyde_vectors = await self._search_text(pre_query)
+            hyde_docs = [doc for doc, _ in hyde_results]
+            hyde_answer = await self._answer(question, (await self._pack(hyde_docs, hyde_vectors)).documents, priority=Priority.BULK)
+            self._gate.record_audit(answer, hyde_answer, docs, hyde_docs)
+        except Exception as e:
+            self._logger.warning(f"⚠️ HyDEを飛ばした回答の確認に失敗しました: {e}")
+
+    def _schedule_audit(self, question: str, state: dict):
+        if not state.get("hyde_bypassed") or self._gate is None or not self._gate.should_audit():
+            return
+        task = asyncio.create_task(self._audit_bypass(question, state["answer"], state.get("context", [])))
+        self._audits.add(task)
+        task.add_done_callback(self._audits.discard)
 
-        return {"answer": response.content}
-    
 
     def _graph_builder(self):
         builder = StateGraph(State)
         # src/bot.py の _build_graph メソッド内
         # # 1. ノードを登録
-        builder.add_node("hyde", self._hyde_preparation)
-        builder.add_node("retrieve", self._retrieve)
-        builder.add_node("generate", self._generate)
-        builder.add_edge(START, "hyde")
-        builder.add_edge("hyde", "retrieve")
+        if self._retrieval_mode == "parallel":
+            # HyDEは検索ノードの中で、質問そのままでの検索と同時に走らせる
+            builder.add_node("retrieve", _node("retrieve", self._speculative_retrieve))
+            builder.add_edge(START, "retrieve")
+        else:
+            builder.add_node("hyde", _node("hyde", self._hyde_preparation))
+            builder.add_node("retrieve", _node("retrieve", self._retrieve))
+            builder.add_edge(START, "hyde")
+            builder.add_edge("hyde", "retrieve")
+        builder.add_node("generate", _node("generate", self._generate))
         builder.add_edge("retrieve", "generate")
         return builder.compile()
 
 
+    def _to_sources(self, docs: List[Document]) -> List[SourceInfo]:
+        return [
+            SourceInfo(
+                title=s.metadata.get("user_title"),
+                url=f"/files/{s.metadata.get('source_file')}",
+                page=s.metadata.get("page_info")
+            )
+            for s in docs
+        ]
+
+    async def warmup(self):
+        """起動時にSemanticCacheをPostgresからメモリへ読み込んでおく"""
+        await self._cache.load()
+
+    async def aclose(self):
+        """終了時に、裏で走っているキャッシュの書き戻しを待つ（HyDEを飛ばした回答の確認は待たずに止める）"""
+        for task in list(self._audits):
+            task.cancel()
+        await self._cache.aclose()
+
+    def cache_stats(self) -> dict:
+        """キャッシュの段ごとのヒット率など"""
+        return {
+            "corpus_version": get_corpus_version().current,
+            "exact": {**self._answers.stats.to_dict(), "size": len(self._answers)},
+            "semantic": self._cache.stats(),
+            "hyde": {**self._hyde_cache.stats.to_dict(), "size": len(self._hyde_cache)},
+            "retrieval": {**self._retrievals.stats.to_dict(), "size": len(self._retrievals)},
+            # 同じ質問が同時に来た時にパイプラインを相乗りさせた回数
+            "singleflight": self._flight.stats(),
+        }
+
+    def _revalidator(self, question: str, question_vector=None):
+        """コーパスが変わった後、キャッシュした回答がまだ使えるか（検索結果が変わっていないか）を確かめる関数を作る"""
+        async def revalidate(entry) -> bool:
+            if not entry.probe_ids:
+                return False
+            vector = question_vector or await self._vector_db.aembed_query(question)
+            results, _ = await self._search(vector)
+            return set(_ids(results)) == entry.probe_ids
+        return revalidate
+
+    async def _lookup(self, question: str):
+        """完全一致の段 → (質問の埋め込み) → SemanticCacheの順に見る。(当たった回答, 質問のベクトル)を返す"""
+        exact = await self._answers.aget(normalize_question(question), revalidate=self._revalidator(question))
+        if exact is not None:
+            self._logger.info(f"Exact cache hit!: {exact.value.answer}")
+            return exact.value, None
+        # 質問の埋め込みは1リクエストで1回だけ計算し、キャッシュの検索と登録で使い回す
+        question_vector = await self._vector_db.aembed_query(question)
+        cache_check = await self._cache._check(question, vector=question_vector, revalidate=self._revalidator(question, question_vector))
+        if cache_check:
+            self._logger.info(f"Cache hit!: {cache_check}")
+            return ChatResponse(answer=cache_check, sources=[]), question_vector
+        return None, question_vector
+
+    async def _store(self, question: str, question_vector, response: "ChatResponse", probe_ids: List[str]):
+        self._answers.put(normalize_question(question), response, probe_ids)
+        await self._cache.add_question_answer(question, response.answer, vector=question_vector, probe_ids=probe_ids)
+
+    @track(CHAT_RUN_SECONDS)
     async def run(self, question: str) -> ChatResponse:
+        # 同じ質問が同時に来ていれば、その実行の結果を一緒に受け取る
+        return await self._flight.do(normalize_question(question), lambda: self._run(question))
+
+    async def _run(self, question: str) -> ChatResponse:
+        started = time.perf_counter()
         try:
-            cache_check = self._cache._check(question)
-            if cache_check:
-                self._logger.info(f"Cache hit!: {cache_check}")
-                return ChatResponse(answer=cache_check, sources=[])
-        
-            ans = await self._graph.ainvoke({"question": question})
-            
-            # デバッグ: ansのデータ構造を確認
-            self._logger.info(f"ans type: {type(ans)}")
-            self._logger.info(f"ans keys: {ans.keys() if isinstance(ans, dict) else 'not a dict'}")
-            self._logger.info(f"ans content: {ans}")
-            
-            self._cache.add_question_answer(question, ans["answer"])
-            sources_info = ans.get("context", [])
-            
+            cached, question_vector = await self._lookup(question)
+            if cached is not None:
+                return cached
+
+            ans = await self._graph.ainvoke({"question": question, "question_vector": question_vector})
             
-            sources_list = [
-                SourceInfo(
-                    title=s.metadata.get("user_title"),
-                    url=f"/files/{s.metadata.get('source_file')}",
-                    page=s.metadata.get("page_info")
-                )
-                for s in sources_info
-            ]
-            return ChatResponse(answer=ans["answer"], sources=sources_list)
+            # 検索結果の本文まで含む状態を丸ごと出すのはDEBUGの時だけ。INFOには要約だけ出す
+            # (%sで渡すと、間引かれたダンプは文字列に組み立てられない)
+            self._logger.debug("ans content: %s", ans)
+            self._logger.info(
+                f"⏱️ [{self._retrieval_mode}] total {_ms(started):.0f} ms | {_format_timings(ans.get('timings', {}))} | "
+                f"{len(ans.get('context', []))} docs, answer {len(ans.get('answer', ''))} chars"
+            )
+            self._schedule_audit(question, ans)
+            response = ChatResponse(answer=ans["answer"], sources=self._to_sources(ans.get("context", [])))
+            await self._store(question, question_vector, response, ans.get("probe_ids", []))
+            return response
         except ValidationError as e:
             self._logger.error(f"question is empty: {e}")
             error_msg = e.errors()[0]['msg']
-            return f"⚠️ 入力エラー: {error_msg}"
\ No newline at end of file
+            return f"⚠️ 入力エラー: {error_msg}"
+
+    async def astream(self, question: str):
+        """
+        runのストリーミング版。進み具合に合わせてイベント(dict)を順に返す。
+        - cache_hit: キャッシュにあった回答（これで終わり）
+        - sources: 検索が終わった時点の参照元
+        - token: 生成中の回答の断片
+        - done: 完成した回答
+        """
+        cached, question_vector = await self._lookup(question)
+        if cached is not None:
+            yield {"type": "cache_hit", "answer": cached.answer}
+            return
+
+        answer, sources = "", []
+        final_state = {}
+        async for mode, chunk in self._graph.astream(
+            {"question": question, "question_vector": question_vector},
+            stream_mode=["updates", "messages"],
+        ):
+            if mode == "updates":
+                for update in chunk.values():
+                    final_state.update(update or {})
+                if "retrieve" in chunk:
+                    sources = self._to_sources(chunk["retrieve"]["context"])
+                    yield {"type": "sources", "sources": [s.model_dump() for s in sources]}
+                elif "generate" in chunk:
+                    answer = chunk["generate"]["answer"]
+            else:
+                # HyDEのLLM呼び出しのトークンは流さず、回答生成のトークンだけを流す
+                message, metadata = chunk
+                text = str(message.text)
+                if metadata.get("langgraph_node") == "generate" and text:
+                    yield {"type": "token", "text": text}
+
+        self._schedule_audit(question, {**final_state, "answer": answer})
+        await self._store(question, question_vector, ChatResponse(answer=answer, sources=sources), final_state.get("probe_ids", []))
+        yield {"type": "done", "answer": answer}
@@ -1,25 +1,232 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
 from langchain_core.documents import Document
+from src import config
 from src.vector_store import Vectorstore
+from src.vector_index import VectorIndex
+from src.cache_tiers import CacheEntry, Revalidate, TierStats, get_corpus_version, is_fresh
+from src.metrics import CACHE_OPERATION_SECONDS, track
 from logger import get_logger
 
 logger = get_logger("SemanticCache")
 
+_UNKNOWN_VERSION = -1  # 版を保存する前に作った行。どの版とも一致しないので、最初に使う時に確かめ直す
+
+
+@dataclass
+class CachedAnswer(CacheEntry):
+    id: str = ""  # Postgresの行のID
+    created_at: float = field(default_factory=time.time)
+    last_hit: float = 0.0  # 最後に当たった時刻（当たっていなければ0）
+    hits: int = 0
+
+
+def select_evictions(entries:list, now:float, max_entries:int, max_age:float | None, policy:str = "lru", low_watermark:float = 0.9) -> dict:
+    """
+    追い出す回答を理由ごとに選ぶ。
+    - invalid: コーパスが変わって古いと分かった回答
+    - expired: 作ってからmax_age秒より古い回答
+    - capacity: 残りがmax_entriesを超えていれば、max_entries * low_watermark件になるまで
+      lru(最後に当たったのが古い順) / lfu(当たった回数が少ない順)に追い出す
+    """
+    if policy not in ("lru", "lfu"):
+        raise ValueError(f"未対応の追い出し方です: {policy}")
+    evictions = {"invalid": [], "expired": [], "capacity": []}
+    remaining = []
+    for entry in entries:
+        if entry.invalid:
+            evictions["invalid"].append(entry)
+        elif max_age is not None and now - entry.created_at > max_age:
+            evictions["expired"].append(entry)
+        else:
+            remaining.append(entry)
+    if len(remaining) > max_entries:
+        target = int(max_entries * low_watermark)
+        if policy == "lru":
+            order = sorted(remaining, key=lambda e: max(e.last_hit, e.created_at))
+        else:
+            order = sorted(remaining, key=lambda e: (e.hits, max(e.last_hit, e.created_at)))
+        evictions["capacity"] = order[:len(remaining) - target]
+    return evictions
+
+# キャッシュの本体はプロセス内のVectorIndex。Postgresは永続化先としてだけ使う。
+# 起動時にPostgresから全件を読み込み、追加は索引に即反映してから裏でPostgresへ書き戻す。
+# 各回答にはコーパスの版と、回答を作った時の検索結果のIDを付けておき、版が古ければ使う時に確かめ直す。
+# 版は行のメタデータ(corpus_version)にも保存し、再起動後は保存した版と今の版を比べる（版の無い古い行は必ず確かめ直す）。
+# 件数と古さには上限があり、裏の整理タスク(compact)がまとめて追い出す。
+# 当たった回数・最後に当たった時刻はメモリ上で数えるだけにし、整理の時に1回のUPDATEでまとめて書き戻す。
 class SemanticCache:
-    def __init__(self, embedding_model:str, threshold:float = 0.2):
-        self._vector_store = Vectorstore(embedding_model=embedding_model, collection_name="SemanticCache")
+    def __init__(self, embedding_model:str, threshold:float = 0.2, max_entries:int = config.SEMANTIC_CACHE_MAX_ENTRIES, max_age:float | None = config.SEMANTIC_CACHE_MAX_AGE_SECONDS, policy:str = config.SEMANTIC_CACHE_EVICTION, compact_interval:float = config.SEMANTIC_CACHE_COMPACT_INTERVAL):
+        # 1件ずつ書き込むので、COPYではなく普通のINSERTで十分
+        self._vector_store = Vectorstore(embedding_model=embedding_model, collection_name="SemanticCache", bulk_insert=False)
         self._threshold = threshold
+        self._index = VectorIndex()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._pending_writes = set()
+        self._versions = get_corpus_version()
+        self._stats = TierStats()
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._policy = policy
+        self._compact_interval = compact_interval
+        self._touched = {}  # 書き戻していない当たりの記録 {ID: 回答}
+        self._compactor = None
+        self._wake = asyncio.Event()
+        self._compact_lock = asyncio.Lock()
+        self.evicted = {"invalid": 0, "expired": 0, "capacity": 0}
+
+    def __len__(self):
+        return len(self._index)
+
+    async def load(self):
+        async with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                rows = await self._vector_store.aget_all_with_vectors()
+            except Exception as e:
+                # テーブルがまだ無い等。空のキャッシュで始める
+                logger.error(f"❌ Failed to load semantic cache from vector store: {e}")
+                rows = []
+            # EMBEDDING_DIMENSIONSを変える前に保存した行は比べられないので読み込まない
+            usable = [(doc, vector) for doc, vector in rows if len(vector) == self._vector_store.dimensions]
+            now = time.time()
+            self._index.add_many(
+                [vector for _, vector in usable],
+                [
+                    CachedAnswer(
+                        doc.metadata.get("answer"), doc.metadata.get("corpus_version", _UNKNOWN_VERSION), frozenset(doc.metadata.get("probe_ids", [])),
+                        id=doc.id, created_at=doc.metadata.get("created_at", now),
+                        last_hit=doc.metadata.get("last_hit", 0.0), hits=doc.metadata.get("hits", 0),
+                    )
+                    for doc, _ in usable
+                ],
+            )
+            self._loaded = True
+            if self._compact_interval and self._compactor is None:
+                self._compactor = asyncio.create_task(self._compact_loop())
+            logger.info(f"✅ Loaded {len(usable)} cached answers into memory")
+            if len(usable) < len(rows):
+                logger.warning(f"⚠️ Skipped {len(rows) - len(usable)} cached answers with other dimensions")
+
+    def stats(self) -> dict:
+        return {**self._stats.to_dict(), "size": len(self._index), "max_entries": self._max_entries, "evicted": dict(self.evicted)}
 
-    def _check(self, query:str):
-        result = self._vector_store.search_score(query=query, k=1)
-        if not result:
-            return None
-        doc, score = result[0]
-        if score < self._threshold:
-            return doc.metadata.get("answer")
-    
-    def add_question_answer(self, question:str, answer:str):
+    @track(CACHE_OPERATION_SECONDS, operation="check")
+    async def _check(self, query:str, vector=None, revalidate:Revalidate | None = None):
+        # 呼び出し側で計算済みのベクトルがあれば、それで検索する（埋め込みAPIを呼ばない）
+        if not self._loaded:
+            await self.load()
+        if vector is None:
+            vector = await self._vector_store.aembed_query(query)
+        # 古いと分かった回答の後に同じ質問の新しい回答が入っていることがあるので、何件か見る
+        for entry, score in self._index.search(vector, k=4):
+            if score >= self._threshold:
+                break
+            if await is_fresh(entry, self._stats, revalidate, self._versions):
+                self._stats.hits += 1
+                entry.hits += 1
+                entry.last_hit = time.time()
+                self._touched[entry.id] = entry
+                return entry.value
+        self._stats.misses += 1
+        return None
+
+    @track(CACHE_OPERATION_SECONDS, operation="add")
+    async def add_question_answer(self, question:str, answer:str, vector=None, probe_ids=()):
+        entry = CachedAnswer(answer, self._versions.current, frozenset(probe_ids), id=str(uuid.uuid4()))
         doc = Document(
+            id=entry.id,
             page_content=question,
-            metadata={"answer": answer}
+            metadata={"answer": answer, "probe_ids": sorted(probe_ids), "corpus_version": entry.version, "created_at": entry.created_at, "last_hit": 0.0, "hits": 0}
         )
-        self._vector_store.add([doc], batch_size=1, sleep_time=0)
\ No newline at end of file
+        if vector is None:
+            vector = await self._vector_store.aembed_query(question)
+        self._index.add(vector, entry)
+        if len(self._index) > self._max_entries:
+            self._wake.set()  # 次の定期実行を待たずに整理する
+        # Postgresへの書き戻しはレスポンスを待たせないよう裏で行う
+        task = asyncio.create_task(self._persist(doc, vector))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def _persist(self, doc:Document, vector):
+        try:
+            await self._vector_store.aadd_with_vectors([doc], [vector])
+        except Exception as e:
+            logger.error(f"❌ Failed to persist cached answer: {e}")
+
+    async def flush(self):
+        """書き戻し中のタスクが全て終わるまで待つ（終了時用）"""
+        if self._pending_writes:
+            await asyncio.gather(*list(self._pending_writes))
+
+    async def aclose(self):
+        """整理タスクを止め、書き戻し中の回答と当たりの記録を書き戻す（終了時用）"""
+        if self._compactor is not None:
+            self._compactor.cancel()
+            await asyncio.gather(self._compactor, return_exceptions=True)
+            self._compactor = None
+        await self.flush()
+        await self._flush_hits()
+
+    async def _compact_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._compact_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error(f"❌ Semantic cache compaction failed: {e}")
+
+    async def compact(self) -> dict:
+        """古い・多すぎる回答をまとめて追い出し、当たりの記録を書き戻す"""
+        async with self._compact_lock:
+            # 書き戻し中の行を先に消そうとして、後から書き込まれてしまわないように待つ
+            await self.flush()
+            evictions = select_evictions(self._index.payloads(), time.time(), self._max_entries, self._max_age, self._policy)
+            doomed = {id(entry) for entries in evictions.values() for entry in entries}
+            if doomed:
+                self._index.retain(lambda entry: id(entry) not in doomed)
+            ids = [entry.id for entries in evictions.values() for entry in entries if entry.id]
+            for entry_id in ids:
+                self._touched.pop(entry_id, None)
+            counts = {reason: len(entries) for reason, entries in evictions.items()}
+            for reason, count in counts.items():
+                self.evicted[reason] += count
+            flushed = await self._flush_hits()
+            if ids:
+                try:
+                    await self._vector_store.adelete(ids)
+                    if len(ids) >= config.SEMANTIC_CACHE_VACUUM_MIN_EVICTIONS:
+                        await self._vector_store.avacuum()
+                except Exception as e:
+                    logger.error(f"❌ Failed to delete evicted answers from vector store: {e}")
+            if ids or flushed:
+                logger.info(f"🧹 Semantic cache compacted: evicted {len(ids)} {counts}, flushed {flushed} hit stats, {len(self._index)} entries left")
+            return counts
+
+    async def _flush_hits(self) -> int:
+        """メモリ上で数えた当たりの回数・時刻（と確かめ直して付け直した版）を1回のUPDATEで書き戻す"""
+        touched, self._touched = self._touched, {}
+        patches = {
+            entry_id: {"hits": entry.hits, "last_hit": entry.last_hit, "corpus_version": entry.version}
+            for entry_id, entry in touched.items() if entry_id
+        }
+        if not patches:
+            return 0
+        try:
+            await self._vector_store.aupdate_metadata(patches)
+        except Exception as e:
+            logger.error(f"❌ Failed to write back cache hit stats: {e}")
+            # 次の整理の時にもう一度書き戻す
+            for entry_id, entry in touched.items():
+                self._touched.setdefault(entry_id, entry)
+            return 0
+        return len(patches)
@@ -0,0 +1,154 @@
+# このファイルの設計思想：
+# ChatBot.runの手前に置く何段かのキャッシュの共通部品。
+#   - 完全一致の段: 正規化した質問 → 回答（埋め込みより前に見るので、当たれば埋め込みも要らない）
+#   - 意味の近さの段: SemanticCache（質問のベクトル → 回答）
+#   - HyDEの段: 正規化した質問 → 仮想文書（文書の中身に依らないので古くならない）
+#   - 検索結果の段: 検索に使うベクトル → 検索結果
+# 文書を取り込むたびにコーパスの版(CorpusVersion)を1つ上げ、各エントリには作った時の版を付けておく。
+# 版は元の文書のコレクションのメタデータに保存するので、再起動しても0に戻らない（保存した回答の版と比べられる）。
+# 版が古いエントリは捨てずに、使われた時にだけ確かめ直す（revalidate）。
+# 回答の段は「その回答を作った時の検索結果のID」を覚えておき、今の検索結果と同じなら回答も今のままでよいとみなす。
+# 確かめ直しは検索1回で済むので、LLMを2回呼んで作り直すよりずっと安い。
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+import numpy as np
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+_VERSION_KEY = "corpus_version"
+
+
+class CorpusVersion:
+    """
+    文書コレクションの版。取り込みで中身が変わるたびにabumpする。
+    attachしたVectorstoreがあれば、版はそのコレクションのメタデータに保存する（無ければメモリの中だけ）。
+    """
+    def __init__(self):
+        self._version = 0
+        self._store = None
+
+    @property
+    def current(self) -> int:
+        return self._version
+
+    def attach(self, store):
+        """版を保存するVectorstore（元の文書のコレクション）"""
+        self._store = store
+
+    async def aload(self) -> int:
+        """保存してある版を読み込む（起動時、保存した回答を読み込む前に呼ぶ）"""
+        if self._store is not None:
+            self._version = await self._store.aget_collection_counter(_VERSION_KEY)
+            logger.info(f"📚 Corpus version is {self._version}")
+        return self._version
+
+    async def abump(self, reason:str = "") -> int:
+        if self._store is not None:
+            # 他のプロセスが上げていても追い越さないよう、DBの値を1つ上げた結果を使う
+            self._version = await self._store.aincrement_collection_counter(_VERSION_KEY)
+        else:
+            self._version += 1
+        logger.info(f"📚 Corpus version → {self._version} {reason}".rstrip())
+        return self._version
+
+
+# プロセス全体で共有する版
+_corpus_version = CorpusVersion()
+
+def get_corpus_version() -> CorpusVersion:
+    return _corpus_version
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    version: int  # 作った（または確かめ直した）時のコーパスの版
+    probe_ids: frozenset = frozenset()  # 回答を作った時の、質問そのままでの検索結果のID
+    invalid: bool = False  # 確かめ直しで古いと分かった
+
+
+Revalidate = Callable[[CacheEntry], Awaitable[bool]]
+
+
+class TierStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # 版が古かったので確かめ直した回数
+        self.revalidated = 0  # 確かめ直して、そのまま使えた回数
+
+    def to_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "stale": self.stale,
+            "revalidated": self.revalidated,
+        }
+
+
+async def is_fresh(entry:CacheEntry, stats:TierStats, revalidate:Revalidate | None = None, versions:CorpusVersion | None = None) -> bool:
+    """版が今のものならTrue。古ければrevalidateで確かめ直し、使えれば今の版を付け直す"""
+    versions = versions or get_corpus_version()
+    if entry.invalid:
+        return False
+    if entry.version == versions.current:
+        return True
+    stats.stale += 1
+    current = versions.current
+    try:
+        fresh = revalidate is not None and await revalidate(entry)
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to revalidate a cached entry: {e}")
+        fresh = False
+    if not fresh:
+        entry.invalid = True
+        return False
+    entry.version = current
+    stats.revalidated += 1
+    return True
+
+
+class LRUTier:
+    """キーで引くキャッシュの1段。versioned=Falseならコーパスの版を見ない"""
+    def __init__(self, maxsize:int, versioned:bool = True, versions:CorpusVersion | None = None):
+        self._maxsize = maxsize
+        self._versioned = versioned
+        self._versions = versions or get_corpus_version()
+        self._entries: "OrderedDict[Any, CacheEntry]" = OrderedDict()
+        self.stats = TierStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def aget(self, key, revalidate:Revalidate | None = None) -> CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is not None and self._versioned and not await is_fresh(entry, self.stats, revalidate, self._versions):
+            self._entries.pop(key, None)
+            entry = None
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry
+
+    def put(self, key, value, probe_ids=()) -> CacheEntry:
+        entry = CacheEntry(value, self._versions.current, frozenset(probe_ids))
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+
+def vector_key(vector, k:int) -> str:
+    """検索結果の段のキー。同じベクトル・同じ件数なら同じキーになる"""
+    data = np.asarray(vector, dtype=np.float32).tobytes()
+    return f"{k}:{hashlib.blake2b(data, digest_size=16).hexdigest()}"
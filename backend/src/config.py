@@ -22,10 +22,73 @@ WEB_PATH = "/Users/tokutoku/Desktop/RAG_load/吸光度.pdf"
 CHAT_MODEL = "gemini-2.5-flash"
 MODEL_PROVIDER = "google-genai"
 EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_FULL_DIMENSIONS = 3072  # 埋め込みモデルが返すベクトルの次元
+EMBEDDING_DIMENSIONS = 3072  # 保存するベクトルの次元。小さくすると先頭だけ残して正規化し直す（768/1536等）
 CHUNK_SIZE = 700
 CHUNK_OVERLAP = 100
 RETRIEVER_K = 5
+RETRIEVAL_MODE = "parallel"  # "parallel": HyDEと質問そのままでの検索を同時に行いRRFで混ぜる / "sequential": HyDEの後に検索
+HYDE_DEADLINE_MS = None  # parallelの時、HyDEをこれ以上待たない時間(ミリ秒)。Noneなら最後まで待つ
+HYDE_BYPASS = True  # 質問そのままでの検索で十分に近い文書が取れたらHyDE(LLM呼び出し)を飛ばす
+HYDE_BYPASS_MAX_DISTANCE = 0.2  # 飛ばすには1位のコサイン距離がこれ以下
+HYDE_BYPASS_MARGIN = 0.05  # 飛ばすには2位以下の平均距離と1位の差がこれ以上
+HYDE_BYPASS_AUDIT_EVERY = 20  # 飛ばした質問の何件に1件、裏でHyDEありの回答も作って一致度を記録するか(0なら記録しない)
 MAX_CHARACTER_LENGTH = 1000
+CONTEXT_TOKEN_BUDGET = 2000  # 回答の生成でプロンプトに入れる検索結果のトークン数の上限
+CONTEXT_DUPLICATE_SIMILARITY = 0.95  # ベクトルのコサイン類似度がこれ以上のチャンクは重複とみなして落とす
+PDF_WORKERS = min(4, os.cpu_count() or 1)  # PDFを並列に解析するプロセス数
+PDF_PAGES_PER_TASK = 8  # 1つのプロセスに一度に渡すページ数
+EMBEDDING_MEMO_SIZE = 4096  # 埋め込みベクトルのLRUメモに保持する件数
+EMBEDDING_BATCH_SIZE = 32  # 同時に来た埋め込みをまとめて送る最大件数
+EMBEDDING_BATCH_WAIT_MS = 5  # まとめるために待つ最大時間(ミリ秒)
+ANSWER_CACHE_SIZE = 1024  # 正規化した質問の完全一致で引く回答のキャッシュの件数
+HYDE_CACHE_SIZE = 1024  # 質問ごとのHyDEの仮想文書のキャッシュの件数
+RETRIEVAL_CACHE_SIZE = 1024  # 検索に使うベクトルごとの検索結果のキャッシュの件数
+SEMANTIC_CACHE_MAX_ENTRIES = 10000  # SemanticCacheに残す回答の最大件数（超えたらこの9割まで追い出す）
+SEMANTIC_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600  # これより前に作った回答は追い出す（Noneなら期限なし）
+SEMANTIC_CACHE_EVICTION = "lru"  # 件数を超えた時の追い出し方。"lru"(最後に当たったのが古い順) / "lfu"(当たった回数が少ない順)
+SEMANTIC_CACHE_COMPACT_INTERVAL = 300  # 裏で追い出し・当たりの記録の書き戻しをする間隔(秒)。0なら裏では行わない
+SEMANTIC_CACHE_VACUUM_MIN_EVICTIONS = 1000  # 一度にこれ以上追い出したらVACUUMする
+# === 取り込みジョブ === #
+INGESTION_JOB_DIR = "ingestion_jobs"  # ジョブの状態を保存するディレクトリ
+INGESTION_WORKERS = 2  # 同時に処理するジョブの数
+INGESTION_MAX_QUEUED = 100  # 待たせておけるジョブの最大数
+INGESTION_BATCH_SIZE = 10  # 1回に埋め込み・保存するチャンク数
+INGESTION_READ_SIZE = 200  # ファイルから一度に読んで差分を調べるチャンク数（スレッドとDBへの往復を減らすため、埋め込みのバッチより大きくする）
+INGESTION_EMBED_WORKERS = 4  # 同時に埋め込みAPIへ送るバッチの数（実際の上限はレート制限器が決める）
+INGESTION_QUEUE_SIZE = 8  # 埋め込み・書き込みの各ステージの前で待たせておけるバッチの数
+VECTOR_BULK_INSERT = True  # 埋め込み済みのチャンクをCOPYでまとめて書き込むか
+SNAPSHOT_DIR = "snapshot"  # 元の文書のチャンクとベクトルのスナップショットの保存先
+EMBEDDING_SECONDS_PER_CHUNK = 0.05  # 節約時間の見積もりに使う1チャンクあたりの埋め込み時間（実測が無い時）
+# === ANN索引 === #
+VECTOR_INDEX = {"method": "hnsw", "m": 16, "ef_construction": 64}  # コレクションごとに作る索引（"ivfflat"なら"lists"）
+HNSW_EF_SEARCH = 40  # HNSWの検索時の候補数（大きいほど正確で遅い）
+IVFFLAT_PROBES = 10  # IVFFlatの検索時に調べるクラスタ数（大きいほど正確で遅い）
+VECTOR_PRECISION = "auto"  # 索引と検索の精度。"vector"(float32) / "halfvec"(float16) / "auto"(2000次元を超えたらhalfvec)
+VECTOR_QUANTIZATION = None  # "binary"なら二値化したビット列の索引で候補を拾い、元の精度で並べ直す
+RERANK_CANDIDATES = 40  # 二値化の時に、並べ直す前に拾う候補の数
+# === API呼び出しのレート制限 === #
+CHARS_PER_TOKEN = 2  # トークン数の見積もりに使う1トークンあたりの文字数（日本語寄り）
+RATE_LIMIT_MAX_RETRIES = 5  # 429の時にやり直す最大回数
+RATE_LIMITS = {
+    # クォータ（1分あたりのリクエスト数・トークン数）と同時実行数の上限
+    "embedding": {"requests_per_minute": 3000, "tokens_per_minute": 1_000_000, "max_concurrency": 8, "latency_target": 5.0},
+    "llm": {"requests_per_minute": 1000, "tokens_per_minute": 1_000_000, "max_concurrency": 8, "latency_target": 30.0},
+}
+# === LLMの呼び出しの順番待ち（アプリ全体） === #
+LLM_SCHEDULER_LIMITS = {
+    # max_concurrency: 同時に呼ぶ数（2つの合計をRATE_LIMITS["llm"]の同時実行数に合わせる）
+    # max_queue: 待たせておける数（超えたら429） / max_wait: 待たせる最大秒数（超えたら503）
+    "hyde": {"max_concurrency": 3, "max_queue": 64, "max_wait": 10.0},
+    "generate": {"max_concurrency": 5, "max_queue": 64, "max_wait": 20.0},
+}
+# === DBの接続プール（全てのVectorstoreで共有） === #
+DB_POOL_SIZE = 5  # 常に開いておく接続の数
+DB_MAX_OVERFLOW = 5  # 混んだ時に一時的に追加で開く接続の数（Postgresの接続数はDB_POOL_SIZE+これが上限）
+DB_POOL_TIMEOUT = 10  # 空きの接続を待つ最大秒数
+DB_POOL_RECYCLE = 1800  # これより長く使った接続は作り直す(秒)。DBやロードバランサに切られる前に
+DB_POOL_PRE_PING = True  # 貸し出す前に接続が生きているか確かめる
+DB_PREPARE_THRESHOLD = 2  # 同じSQLがこの回数実行されたらサーバー側でprepareする。Noneならしない（PgBouncerのtransactionモード等）
 
 # === プロンプトのテンプレート ===#
 TEMPLATE = """Use the following pieces of context to answer the question at the end.
@@ -47,4 +110,9 @@ QUESTIONS_LIST = [
 ]
 
 
-LOG_DIR = "logs"
\ No newline at end of file
+LOG_DIR = "logs"
+LOG_LEVEL = "INFO"  # "DEBUG"にすると、リクエストの中身のダンプもlog.txtに出す（LOG_DEBUG_SAMPLE_EVERY件に1件）
+LOG_MAX_MESSAGE_CHARS = 2000  # 1件のログのメッセージの最大文字数。超えた分は切り詰める
+LOG_DEBUG_SAMPLE_EVERY = 100  # DEBUGのログは何件に1件残すか
+LOG_MAX_BYTES = 10 * 1024 * 1024  # log.txt・error.txtがこの大きさを超えたら切り替える
+LOG_BACKUP_COUNT = 5  # 切り替えた古いログファイルを何世代残すか
\ No newline at end of file
@@ -0,0 +1,120 @@
+# このファイルの設計思想：
+# 検索で取れたチャンクをそのまま全部つなげてプロンプトに入れると、
+#   - 同じページの隣り合うチャンクはCHUNK_OVERLAP分の文字が重なっている
+#   - 同じ文書を何度もアップロードすると、ほぼ同じチャンクが複数返ってくる
+# ので、同じ内容を何度もLLMに送ることになる（プロンプトのトークン数が遅さと料金を決める）。
+# ContextPackerは関連度の順番を保ったまま、
+#   1. ベクトルがほぼ同じ（コサイン類似度がduplicate_similarity以上）チャンクを落とし、
+#   2. 同じsource_file・同じページで文字が重なる・含まれるチャンクを1つにつなげ、
+#   3. 関連度の高い順にトークンの予算(token_budget)まで詰める。
+# トークン数はレート制限と同じ見積もり(estimate_tokens)を使う。
+
+from dataclasses import dataclass
+import numpy as np
+from langchain_core.documents import Document
+from src import config
+from src.rate_limiter import estimate_tokens
+
+_MIN_OVERLAP = 20  # これより短い一致は偶然とみなし、つなげない
+
+
+@dataclass
+class PackResult:
+    documents: list[Document]
+    tokens_before: int
+    tokens_after: int
+    duplicates: int = 0  # ほぼ同じなので落としたチャンク数
+    merged: int = 0  # 他のチャンクにつなげたチャンク数
+    dropped: int = 0  # 予算に入らなかったチャンク数
+    truncated: bool = False  # 最初のチャンクだけで予算を超えたので切り詰めたか
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class ContextPacker:
+    def __init__(self, token_budget:int = config.CONTEXT_TOKEN_BUDGET, duplicate_similarity:float = config.CONTEXT_DUPLICATE_SIMILARITY):
+        self._token_budget = token_budget
+        self._duplicate_similarity = duplicate_similarity
+
+    def pack(self, docs:list[Document], vectors:dict | None = None) -> PackResult:
+        """docsは関連度の高い順。vectorsは{文書ID: ベクトル}（無い文書は本文が完全に同じ時だけ重複とみなす）"""
+        tokens_before = sum(estimate_tokens(doc.page_content) for doc in docs)
+        unique, duplicates = self._drop_duplicates(docs, vectors or {})
+        groups, merged = self._merge_overlaps(unique)
+
+        packed, used, dropped, truncated = [], 0, 0, False
+        for text, members in groups:
+            tokens = estimate_tokens(text)
+            if used + tokens > self._token_budget:
+                if packed:
+                    dropped += len(members)
+                    continue
+                # 最も関連度の高いチャンクだけで予算を超える時は、切り詰めてでも入れる
+                text = text[:self._token_budget * config.CHARS_PER_TOKEN]
+                tokens = estimate_tokens(text)
+                truncated = True
+            packed.append(Document(id=members[0].id, page_content=text, metadata=dict(members[0].metadata)))
+            used += tokens
+        return PackResult(packed, tokens_before, used, duplicates, merged, dropped, truncated)
+
+    def _drop_duplicates(self, docs:list[Document], vectors:dict):
+        kept, kept_vectors, seen_texts, duplicates = [], [], set(), 0
+        for doc in docs:
+            if doc.page_content in seen_texts:
+                duplicates += 1
+                continue
+            vector = vectors.get(doc.id)
+            if vector is not None:
+                vector = np.asarray(vector, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                vector = vector / norm if norm else vector
+                if any(float(vector @ other) >= self._duplicate_similarity for other in kept_vectors):
+                    duplicates += 1
+                    continue
+                kept_vectors.append(vector)
+            seen_texts.add(doc.page_content)
+            kept.append(doc)
+        return kept, duplicates
+
+    def _merge_overlaps(self, docs:list[Document]):
+        """[(本文, 元のチャンクのリスト)]を、グループの中で最も関連度の高いチャンクの順で返す"""
+        groups, merged = [], 0
+        for doc in docs:
+            key = (doc.metadata.get("source_file"), doc.metadata.get("page_info"))
+            for group in groups:
+                if group[0] != key:
+                    continue
+                text = _join(group[1], doc.page_content)
+                if text is not None:
+                    group[1] = text
+                    group[2].append(doc)
+                    merged += 1
+                    break
+            else:
+                groups.append([key, doc.page_content, [doc]])
+        return [(text, members) for _, text, members in groups], merged
+
+
+def _join(a:str, b:str) -> str | None:
+    """aとbが重なっていれば1つにつなげた文字列を、重なっていなければNoneを返す"""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    overlap = _overlap(a, b)
+    if overlap:
+        return a + b[overlap:]
+    overlap = _overlap(b, a)
+    if overlap:
+        return b + a[overlap:]
+    return None
+
+
+def _overlap(head:str, tail:str) -> int:
+    """headの末尾とtailの先頭が一致する最長の文字数（_MIN_OVERLAP未満なら0）"""
+    for size in range(min(len(head), len(tail)) - 1, _MIN_OVERLAP - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
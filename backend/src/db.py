@@ -0,0 +1,164 @@
+# このファイルの設計思想：
+# Vectorstoreはコレクションごとに作る（元の文書のRAG_docs、SemanticCacheなど）。
+# 以前はそれぞれがPGVectorに接続文字列を渡していたので、インスタンスの数だけSQLAlchemyのエンジン(=接続プール)ができ、
+# コレクションを増やすたびに、Postgresの接続数の上限に対してアイドルな接続が増えていた。
+# そこでプロセス全体で1つのEngineRegistryが、接続先ごとにエンジンを1つだけ作って全てのVectorstoreで共有する。
+#   - プールの大きさ・溢れた時の追加分・貸し出し前の生存確認(pre-ping)・作り直す間隔(recycle)はconfigで決める
+#   - 非同期(psycopg v3)の接続は、同じSQLがDB_PREPARE_THRESHOLD回実行されたらサーバー側でprepareする
+#     （検索のSQLはコレクションごとに文面が変わらないので、2回目以降は解析・計画を飛ばせる）
+#   - コレクションのUUIDは変わらないので、問い合わせた結果をここで覚えて全てのインスタンスで使い回す
+#   - 接続を借りるまで待った時間と貸し出し回数はPrometheusに、今のプールの埋まり具合は/metricsが読まれた時に出す
+
+import asyncio
+import time
+from sqlalchemy import URL, create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from src import config
+from src.metrics import DB_POOL_CHECKOUTS, DB_POOL_CONNECTS, DB_POOL_WAIT_SECONDS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def database_url(driver:str) -> URL:
+    """configの接続先をURLにする（パスワードに記号が入っていてもそのまま使えるよう、文字列を組み立てない）"""
+    return URL.create(
+        f"postgresql+{driver}",
+        username=config.USER,
+        password=config.PASSWORD,
+        host=config.HOST,
+        port=int(config.PORT) if config.PORT else None,
+        database=config.DBNAME,
+    )
+
+
+class _TimedPool:
+    """プールから接続を借りるまでの時間を計る（空きが無ければ待った時間、新しく接続した時はその時間も含む）"""
+    kind = ""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.labels(engine=self.kind).observe(time.perf_counter() - started)
+
+
+class _TimedQueuePool(_TimedPool, QueuePool):
+    kind = "sync"
+
+
+class _TimedAsyncPool(_TimedPool, AsyncAdaptedQueuePool):
+    kind = "async"
+
+
+def _pool_options() -> dict:
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+
+
+def _count_checkouts(engine, kind:str):
+    checkouts = DB_POOL_CHECKOUTS.labels(engine=kind)
+    connects = DB_POOL_CONNECTS.labels(engine=kind)
+    event.listen(engine, "checkout", lambda *_: checkouts.inc())
+    event.listen(engine, "connect", lambda *_: connects.inc())
+
+
+def _pool_stats(engine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+    }
+
+
+class EngineRegistry:
+    """接続先(URL)ごとに同期・非同期のエンジンを1つずつ作り、全てのVectorstoreで共有する"""
+    def __init__(self):
+        self._engines: dict = {}  # URL → Engine（同期版はCLIからの取り込み用）
+        self._async_engines: dict = {}  # URL → AsyncEngine
+        self._collection_ids: dict = {}  # (URL, コレクション名) → UUID
+        self._loading: dict = {}  # (URL, コレクション名) → 問い合わせ中のタスク
+
+    def engine(self, url:URL | None = None):
+        url = url or database_url("psycopg2")
+        if url not in self._engines:
+            engine = create_engine(url, poolclass=_TimedQueuePool, **_pool_options())
+            _count_checkouts(engine, _TimedQueuePool.kind)
+            self._engines[url] = engine
+            logger.info(f"🔌 Created sync engine for {url.host}/{url.database} (pool {config.DB_POOL_SIZE}+{config.DB_MAX_OVERFLOW})")
+        return self._engines[url]
+
+    def async_engine(self, url:URL | None = None):
+        url = url or database_url("psycopg")
+        if url not in self._async_engines:
+            engine = create_async_engine(
+                url,
+                poolclass=_TimedAsyncPool,
+                connect_args={"prepare_threshold": config.DB_PREPARE_THRESHOLD},
+                **_pool_options(),
+            )
+            _count_checkouts(engine.sync_engine, _TimedAsyncPool.kind)
+            self._async_engines[url] = engine
+            logger.info(f"🔌 Created async engine for {url.host}/{url.database} (pool {config.DB_POOL_SIZE}+{config.DB_MAX_OVERFLOW})")
+        return self._async_engines[url]
+
+    async def collection_id(self, url:URL, name:str, load):
+        """
+        コレクションのUUID。load()（async、UUIDを返す）は接続先とコレクション名ごとに最初の1回だけ呼ぶ。
+        同時に来た問い合わせは同じload()の結果を待つ。失敗したら覚えず、次の呼び出しでやり直す。
+        """
+        key = (url, name)
+        if key in self._collection_ids:
+            return self._collection_ids[key]
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        collection_id = await asyncio.shield(task)
+        self._collection_ids[key] = collection_id
+        return collection_id
+
+    def forget_collection(self, url:URL, name:str):
+        """コレクションを消して作り直した時など、覚えているUUIDを捨てる"""
+        self._collection_ids.pop((url, name), None)
+
+    def stats(self) -> dict:
+        """{"sync"/"async": {"size", "checked_out", "checked_in", "overflow"}}（接続先が複数なら足し合わせる）"""
+        stats = {}
+        for kind, engines in (("sync", self._engines.values()), ("async", [e.sync_engine for e in self._async_engines.values()])):
+            for engine in engines:
+                pool = _pool_stats(engine)
+                total = stats.setdefault(kind, dict.fromkeys(pool, 0))
+                for key, value in pool.items():
+                    total[key] += value
+        return stats
+
+    async def aclose(self):
+        """終了時に全ての接続を閉じる"""
+        for engine in self._async_engines.values():
+            await engine.dispose()
+        for engine in self._engines.values():
+            engine.dispose()
+        self._engines.clear()
+        self._async_engines.clear()
+        self._collection_ids.clear()
+
+
+# アプリ全体で1つだけ作る
+_registry: EngineRegistry | None = None
+
+def get_engine_registry() -> EngineRegistry:
+    global _registry
+    if _registry is None:
+        _registry = EngineRegistry()
+    return _registry
@@ -0,0 +1,297 @@
+# このファイルの設計思想：
+# 同じテキストを何度も埋め込みAPIに送らないようにする。
+# (モデル名, テキストのハッシュ) をキーにしたLRUメモをプロセス全体で1つだけ持つ。
+# Vectorstoreはこのメモを通した埋め込みモデル(CachedEmbeddings)を使う。
+# さらに、同時に来たembed_queryの呼び出しはEmbeddingBatcherが1回のembed_documentsにまとめる。
+# 実際にAPIを呼ぶ手前ではRateLimitedEmbeddingsが共有のレート制限器を通す。
+# 保存する次元を減らす時は、TruncatedEmbeddingsが先頭の次元だけを残して正規化し直す。
+
+import asyncio
+import hashlib
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, List, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src import config
+from src.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_QUEUE_DELAY_SECONDS
+from src.rate_limiter import Priority, RateLimiter, estimate_tokens, get_rate_limiter
+
+
+class EmbeddingMemo:
+    """埋め込みベクトルのLRUメモ。ヒット数・ミス数も数えておく"""
+    def __init__(self, maxsize:int = config.EMBEDDING_MEMO_SIZE):
+        self._maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model:str, text:str) -> Tuple[str, str]:
+        return (model, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+    def get(self, model:str, text:str):
+        key = self.key(model, text)
+        vector = self._entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def put(self, model:str, text:str, vector:List[float]):
+        key = self.key(model, text)
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self._maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+# プロセス全体で共有するメモ
+_memo = EmbeddingMemo()
+
+def get_embedding_memo() -> EmbeddingMemo:
+    return _memo
+
+
+class CachedEmbeddings(Embeddings):
+    """埋め込みモデルを包み、メモにあるテキストはAPIを呼ばずに返す"""
+    def __init__(self, embeddings:Embeddings, model:str, memo:EmbeddingMemo | None = None):
+        self._embeddings = embeddings
+        self._model = model
+        self._memo = memo or get_embedding_memo()
+        # クエリ用と文書用では埋め込み方(task_type)が違うので、メモのキーも分ける
+        self._query_key = f"{model}:query"
+        self._document_key = f"{model}:document"
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    def embed_query(self, text:str) -> List[float]:
+        vector = self._memo.get(self._query_key, text)
+        if vector is None:
+            vector = self._embeddings.embed_query(text)
+            self._memo.put(self._query_key, text, vector)
+        return vector
+
+    async def aembed_query(self, text:str) -> List[float]:
+        vector = self._memo.get(self._query_key, text)
+        if vector is None:
+            vector = await self._embeddings.aembed_query(text)
+            self._memo.put(self._query_key, text, vector)
+        return vector
+
+    def _split_misses(self, texts:List[str]):
+        vectors = [self._memo.get(self._document_key, t) for t in texts]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        return vectors, missing
+
+    def embed_documents(self, texts:List[str]) -> List[List[float]]:
+        vectors, missing = self._split_misses(texts)
+        if missing:
+            new_vectors = self._embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self._memo.put(self._document_key, texts[i], vector)
+        return vectors
+
+    async def aembed_documents(self, texts:List[str]) -> List[List[float]]:
+        vectors, missing = self._split_misses(texts)
+        if missing:
+            new_vectors = await self._embeddings.aembed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self._memo.put(self._document_key, texts[i], vector)
+        return vectors
+
+
+class TruncatedEmbeddings(Embeddings):
+    """
+    Matryoshka型のモデル(gemini-embedding-001等)は先頭の次元ほど多くの情報を持つので、
+    先頭dimensions次元だけを残し、長さ1に正規化し直す（コサイン距離の意味を保つため）。
+    """
+    def __init__(self, embeddings:Embeddings, dimensions:int):
+        self._embeddings = embeddings
+        self._dimensions = dimensions
+
+    def _truncate(self, vector:List[float]) -> List[float]:
+        if len(vector) <= self._dimensions:
+            return vector
+        head = np.asarray(vector[:self._dimensions], dtype=np.float32)
+        norm = np.linalg.norm(head)
+        return (head / norm if norm else head).tolist()
+
+    def embed_query(self, text:str) -> List[float]:
+        return self._truncate(self._embeddings.embed_query(text))
+
+    def embed_documents(self, texts:List[str]) -> List[List[float]]:
+        return [self._truncate(v) for v in self._embeddings.embed_documents(texts)]
+
+    async def aembed_query(self, text:str) -> List[float]:
+        return self._truncate(await self._embeddings.aembed_query(text))
+
+    async def aembed_documents(self, texts:List[str]) -> List[List[float]]:
+        return [self._truncate(v) for v in await self._embeddings.aembed_documents(texts)]
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    埋め込み呼び出しを共有のレート制限器に通す。429の時のやり直しもレート制限器に任せる。
+    同期の呼び出し(CLIからの取り込みなど)も同じレート制限器を通すので、クォータの消費と429が非同期の呼び出しにも伝わる。
+    aembed_documentsはpriorityを受け取れる（省略時は取り込み用のBULK）。
+    """
+    def __init__(self, embeddings:Embeddings, limiter:RateLimiter | None = None):
+        self._embeddings = embeddings
+        self._limiter = limiter or get_rate_limiter("embedding")
+
+    def embed_query(self, text:str) -> List[float]:
+        return self._limiter.call_sync(
+            lambda: self._embeddings.embed_query(text),
+            tokens=estimate_tokens(text),
+            priority=Priority.INTERACTIVE,
+        )
+
+    def embed_documents(self, texts:List[str]) -> List[List[float]]:
+        return self._limiter.call_sync(
+            lambda: self._embeddings.embed_documents(texts),
+            tokens=sum(estimate_tokens(t) for t in texts),
+            priority=Priority.BULK,
+        )
+
+    async def aembed_query(self, text:str) -> List[float]:
+        return await self._limiter.call(
+            lambda: self._embeddings.aembed_query(text),
+            tokens=estimate_tokens(text),
+            priority=Priority.INTERACTIVE,
+        )
+
+    async def aembed_documents(self, texts:List[str], priority:Priority = Priority.BULK, **kwargs) -> List[List[float]]:
+        return await self._limiter.call(
+            lambda: self._embeddings.aembed_documents(texts, **kwargs),
+            tokens=sum(estimate_tokens(t) for t in texts),
+            priority=priority,
+        )
+
+
+class EmbeddingBatcher(Embeddings):
+    """
+    並行するコルーチンからのaembed_queryを貯めておき、
+    max_batch_size件たまるか、最初の1件からmax_wait_ms経った時点で
+    1回のaembed_documentsとしてまとめて送る。各呼び出し元には自分のベクトルが返る。
+    バッチの大きさと待ち時間はnameをラベルにPrometheusのヒストグラムにも記録する。
+    """
+    def __init__(self, embeddings:Embeddings, max_batch_size:int = config.EMBEDDING_BATCH_SIZE, max_wait_ms:float = config.EMBEDDING_BATCH_WAIT_MS, query_kwargs:dict | None = None, name:str = "default"):
+        self._embeddings = embeddings
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        # まとめて送る時もクエリ用の設定(task_type等)で埋め込むための引数
+        self._query_kwargs = query_kwargs or {}
+        self._queue = []
+        self._timer = None
+        self._tasks = set()
+        # 計測用
+        self.batch_sizes = Counter()
+        self.batches = 0
+        self.requests = 0
+        self.total_queue_delay = 0.0
+        self.max_queue_delay = 0.0
+        self._batch_size_metric = EMBEDDING_BATCH_SIZE.labels(model=name)
+        self._queue_delay_metric = EMBEDDING_QUEUE_DELAY_SECONDS.labels(model=name)
+
+    def embed_query(self, text:str) -> List[float]:
+        return self._embeddings.embed_query(text)
+
+    def embed_documents(self, texts:List[str]) -> List[List[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts:List[str]) -> List[List[float]]:
+        return await self._embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text:str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((text, future, time.perf_counter()))
+        if len(self._queue) >= self._max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        # 同じテキストが同じバッチに複数あれば1回だけ送る
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        sent_at = time.perf_counter()
+        for _, _, queued_at in batch:
+            delay = sent_at - queued_at
+            self.total_queue_delay += delay
+            self.max_queue_delay = max(self.max_queue_delay, delay)
+            self._queue_delay_metric.observe(delay)
+        self.batches += 1
+        self.requests += len(batch)
+        self.batch_sizes[len(texts)] += 1
+        self._batch_size_metric.observe(len(texts))
+        try:
+            vectors = await self._embeddings.aembed_documents(texts, **self._query_kwargs)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_text = dict(zip(texts, vectors))
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "mean_queue_delay_ms": self.total_queue_delay / self.requests * 1000 if self.requests else 0.0,
+            "max_queue_delay_ms": self.max_queue_delay * 1000,
+        }
+
+
+# モデルごとに1つだけ作り、VectorstoreとSemanticCacheで共有する
+_batchers: dict = {}
+
+def get_embedding_batcher(model:str, factory:Callable[[], Embeddings], **kwargs) -> EmbeddingBatcher:
+    batcher = _batchers.get(model)
+    if batcher is None:
+        batcher = EmbeddingBatcher(factory(), name=model, **kwargs)
+        _batchers[model] = batcher
+    return batcher
+
+
+def embedding_batcher_stats() -> dict:
+    """作られているバッチャーごとのstats()"""
+    return {model: batcher.stats() for model, batcher in _batchers.items()}
@@ -0,0 +1,22 @@
+# このファイルの設計思想：
+# 複数の検索結果（HyDEの仮想文書での検索・質問そのままでの検索など）を1つの順位にまとめる。
+# 距離の尺度は検索ごとに違うので、順位だけを使うReciprocal Rank Fusion(RRF)で混ぜる。
+#   score(d) = Σ 1 / (k + 順位)
+# 同じ文書はIDで（IDが無ければ本文で）同一とみなす。
+
+from langchain_core.documents import Document
+
+RRF_K = 60  # 元の論文の既定値。大きいほど下位の文書も効く
+
+
+def reciprocal_rank_fusion(result_lists:list[list[Document]], k:int = RRF_K, limit:int | None = None) -> list[Document]:
+    """先に渡した結果ほど、同点の時に前に来る"""
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    ordered = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [documents[key] for key in ordered[:limit]]
@@ -0,0 +1,87 @@
+# このファイルの設計思想：
+# HyDEは検索の前にLLMを1回呼ぶので遅くて高い。質問に文書中の言葉がそのまま出てくるような時は、
+# 質問そのままのベクトルでの検索で十分に良い文書が取れる。
+# そこでHyDEの前に質問のベクトルで一度検索し、上位の距離が次の両方を満たせばHyDEを飛ばす。
+#   - 1位の距離がmax_distance以下（十分に近い）
+#   - 2位以下の平均との差がmargin以上（1位がはっきり抜けている）
+# 閾値を調整できるように、判断・節約したLLM呼び出しの数をログに出し、
+# 飛ばした質問のaudit_every件に1件は裏でHyDEありの回答も作って、回答がどれだけ一致するかを記録する。
+
+import difflib
+import itertools
+import statistics
+from langchain_core.documents import Document
+from src import config
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class HydeGate:
+    def __init__(self, max_distance:float = config.HYDE_BYPASS_MAX_DISTANCE, margin:float = config.HYDE_BYPASS_MARGIN, audit_every:int = config.HYDE_BYPASS_AUDIT_EVERY):
+        self._max_distance = max_distance
+        self._margin = margin
+        self._audit_every = audit_every
+        self.probes = 0
+        self.bypassed = 0
+        # 確認するかを決めるための、飛ばした質問の通し番号。同時に来た質問もそれぞれ別の番号を1回で取る
+        self._audit_counter = itertools.count(1)
+        self._answer_agreements = []
+        self._context_overlaps = []
+
+    def decide(self, question:str, distances:list[float]) -> bool:
+        """距離(近い順)を見て、HyDEを飛ばしてよければTrue"""
+        self.probes += 1
+        if not distances:
+            return False
+        best = distances[0]
+        rest = distances[1:]
+        margin = statistics.mean(rest) - best if rest else 0.0
+        bypass = best <= self._max_distance and margin >= self._margin
+        if bypass:
+            self.bypassed += 1
+        logger.info(
+            f"🚦 HyDE {'skip' if bypass else 'use'}: best={best:.3f} (<= {self._max_distance}) "
+            f"margin={margin:.3f} (>= {self._margin}) | saved {self.bypassed}/{self.probes} LLM calls | {question[:30]}"
+        )
+        return bypass
+
+    def should_audit(self) -> bool:
+        """飛ばした質問のaudit_every件に1件だけ、HyDEありの回答と比べる（飛ばした質問ごとに1回だけ呼ぶ）"""
+        return bool(self._audit_every) and next(self._audit_counter) % self._audit_every == 0
+
+    def record_audit(self, bypass_answer:str, hyde_answer:str, bypass_docs:list[Document], hyde_docs:list[Document]):
+        agreement = answer_agreement(bypass_answer, hyde_answer)
+        overlap = context_overlap(bypass_docs, hyde_docs)
+        self._answer_agreements.append(agreement)
+        self._context_overlaps.append(overlap)
+        stats = self.stats()
+        logger.info(
+            f"🔍 HyDE bypass audit: answer agreement={agreement:.2f}, context overlap={overlap:.2f} "
+            f"(mean over {stats['audits']}: {stats['mean_answer_agreement']:.2f} / {stats['mean_context_overlap']:.2f})"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "probes": self.probes,
+            "bypassed": self.bypassed,
+            "llm_calls_saved": self.bypassed,
+            "bypass_ratio": self.bypassed / self.probes if self.probes else 0.0,
+            "audits": len(self._answer_agreements),
+            "mean_answer_agreement": statistics.mean(self._answer_agreements) if self._answer_agreements else 0.0,
+            "mean_context_overlap": statistics.mean(self._context_overlaps) if self._context_overlaps else 0.0,
+        }
+
+
+def answer_agreement(a:str, b:str) -> float:
+    """2つの回答の文字列としての近さ(0〜1)"""
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def context_overlap(a:list[Document], b:list[Document]) -> float:
+    """2つの検索結果に共通する文書の割合(Jaccard係数)"""
+    keys_a = {doc.id or doc.page_content for doc in a}
+    keys_b = {doc.id or doc.page_content for doc in b}
+    if not keys_a and not keys_b:
+        return 1.0
+    return len(keys_a & keys_b) / len(keys_a | keys_b)
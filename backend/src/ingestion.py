@@ -0,0 +1,170 @@
+# このファイルの設計思想：
+# 取り込みのたびに全チャンクを埋め込み直さないようにする。
+# 各チャンクに「正規化した本文 + 埋め込みモデル」のハッシュ(content_hash)を付けてベクトルと一緒に保存し、
+# 取り込み時は
+#   - 既に同じハッシュのベクトルがあるチャンク → そのベクトルを使い回す
+#   - 新しいチャンク → 埋め込む
+#   - 同じsource_fileから消えたチャンク → 削除する
+# という差分だけを反映する。
+# チャンクはファイルを読みながらINGESTION_READ_SIZE件ずつ差分を調べ、新しいものはそのまま埋め込みに流す（全チャンクをメモリに溜めない）。
+
+import asyncio
+import hashlib
+import itertools
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+from langchain_core.documents import Document
+from pydantic import BaseModel
+from src import config
+from src.vector_store import IngestionPipeline
+from src.cache_tiers import get_corpus_version
+
+
+def fingerprint(text:str, model:str) -> str:
+    normalized = unicodedata.normalize("NFKC", text)
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def chunk_id(source_file:str, content_hash:str) -> str:
+    # 同じファイルの同じ内容のチャンクは常に同じIDになる（書き直してもupsertで重複しない）
+    return hashlib.sha256(f"{source_file}\n{content_hash}".encode("utf-8")).hexdigest()
+
+
+class IngestionReport(BaseModel):
+    new: int = 0  # 埋め込んだチャンク数
+    reused: int = 0  # 既存のベクトルを使い回したチャンク数
+    deleted: int = 0  # 再アップロードで消えたため削除したチャンク数
+    embedding_seconds: float = 0.0  # 埋め込みにかかった時間
+    seconds_saved: float = 0.0  # 使い回しで節約できたと見積もった時間
+    failed: int = 0  # 埋め込み・書き込みに失敗したチャンク数
+    errors: list[str] = []  # 失敗したバッチごとのエラー
+
+
+@dataclass
+class IngestionPlan:
+    to_embed: list = field(default_factory=list)  # 埋め込みが必要なDocument
+    to_write: list = field(default_factory=list)  # 既存のベクトルで書き込むだけの (Document, ベクトル)
+    to_delete: list = field(default_factory=list)  # 削除するID
+    reused: int = 0
+
+
+class IncrementalIndexer:
+    def __init__(self, vector_store):
+        self._vector_store = vector_store
+
+    async def _existing(self, source_file:str) -> dict:
+        """
+        このファイルで既に保存されているチャンク（ID → メタデータ）。
+        ベクトルはここでは読まない（大きなファイルの再アップロードで、全てのベクトルをメモリに載せないため）。
+        """
+        return await self._vector_store.aget_metadata("source_file", [source_file])
+
+    async def _classify(self, documents, source_file:str, existing:dict, seen:set, plan:IngestionPlan):
+        """documentsのうち、まだ見ていないチャンクを「埋め込む / ベクトルを使って書き込む / そのまま」に分けてplanに足す"""
+        model = self._vector_store.embedding_model
+        chunks = {}
+        for doc in documents:
+            content_hash = fingerprint(doc.page_content, model)
+            doc.metadata["content_hash"] = content_hash
+            doc.id = chunk_id(source_file, content_hash)
+            # 同じファイル内で全く同じ内容のチャンクは1つにまとめる
+            if doc.id not in seen:
+                chunks.setdefault(doc.id, doc)
+        seen.update(chunks)
+
+        # このファイルに無い内容でも、他のファイルに同じ内容があればベクトルを借りる
+        missing_hashes = [d.metadata["content_hash"] for d in chunks.values() if d.id not in existing]
+        by_hash = {}
+        if missing_hashes:
+            by_hash = {
+                d.metadata.get("content_hash"): v
+                for d, v in await self._vector_store.aget_by_metadata("content_hash", missing_hashes)
+            }
+
+        # タイトルやページが変わった時だけ、ベクトルはそのままで書き直す。ベクトルはその分だけ読む
+        changed = [d.id for d in chunks.values() if d.id in existing and existing[d.id] != d.metadata]
+        vectors = await self._vector_store.aget_vectors(changed) if changed else {}
+
+        for doc in chunks.values():
+            if doc.id in existing:
+                plan.reused += 1
+                if doc.id in vectors:
+                    plan.to_write.append((doc, vectors[doc.id]))
+            elif doc.metadata["content_hash"] in by_hash:
+                plan.reused += 1
+                plan.to_write.append((doc, by_hash[doc.metadata["content_hash"]]))
+            else:
+                plan.to_embed.append(doc)
+
+    async def plan(self, documents:list[Document], source_file:str) -> IngestionPlan:
+        existing = await self._existing(source_file)
+        seen = set()
+        plan = IngestionPlan()
+        await self._classify(documents, source_file, existing, seen, plan)
+        plan.to_delete = [i for i in existing if i not in seen]
+        return plan
+
+    async def index(self, documents:Iterable[Document], source_file:str, batch_size:int, on_progress=None, read_size:int = config.INGESTION_READ_SIZE) -> IngestionReport:
+        """
+        差分を調べて反映する。documentsはファイルを読みながらチャンクを返すイテレータでよい。
+        read_size件ずつ読んでは差分を調べ、新しいチャンクはそのまま埋め込みのパイプラインに流すので、
+        全チャンクをメモリに溜めない（読むのはPDFの解析を含む同期処理なので、イベントループの外(スレッド)で行う）。
+        on_progress(done_batches, total_batches)は読み始める時と、埋め込みのバッチが1つ終わる（書き込みまたは失敗）たびに呼ばれる。
+        total_batchesは読み終わるまで増えていく。
+        失敗したバッチがあっても他のバッチは反映し、失敗はレポートのfailed/errorsに残す。
+        """
+        existing = await self._existing(source_file)
+        seen = set()
+        # 件数だけを数える。埋め込む・書き込むチャンクはバッチごとに流して捨てる
+        new = reused = rewritten = 0
+        if on_progress:
+            await on_progress(0, 0)
+
+        async def _to_embed():
+            nonlocal new, reused, rewritten
+            chunks = iter(documents)
+            size = max(read_size, batch_size)
+            # 既にメモリにあるlistは読むのに時間がかからないので、スレッドを使わない
+            in_memory = isinstance(documents, list)
+            while batch := (_take(chunks, size) if in_memory else await asyncio.to_thread(_take, chunks, size)):
+                plan = IngestionPlan()
+                await self._classify(batch, source_file, existing, seen, plan)
+                reused += plan.reused
+                for i in range(0, len(plan.to_write), batch_size):
+                    written = plan.to_write[i:i + batch_size]
+                    await self._vector_store.aadd_with_vectors([d for d, _ in written], [v for _, v in written])
+                rewritten += len(plan.to_write)
+                new += len(plan.to_embed)
+                for doc in plan.to_embed:
+                    yield doc
+
+        # 新しいチャンクは、埋め込みと書き込みを並行させるパイプラインに流す。失敗はバッチ単位で記録される
+        pipeline = IngestionPipeline(self._vector_store.aembed_documents, self._vector_store.aadd_with_vectors, batch_size=batch_size)
+        result = await pipeline.run(_to_embed(), on_batch=on_progress)
+        embedding_seconds = result.embedding_seconds
+
+        # 消えたチャンクは、ファイルを全て読み終えてからでないと分からない
+        to_delete = [i for i in existing if i not in seen]
+        await self._vector_store.adelete(to_delete)
+        if to_delete or rewritten or result.written:
+            # 検索結果が変わりうるので、キャッシュした回答・検索結果は次に使う時に確かめ直させる
+            await get_corpus_version().abump(f"({source_file}: +{result.written} ~{rewritten} -{len(to_delete)})")
+
+        # 使い回したチャンクを埋め込んでいたらかかったはずの時間を見積もる
+        per_chunk = embedding_seconds / new if new else config.EMBEDDING_SECONDS_PER_CHUNK
+        return IngestionReport(
+            new=new,
+            reused=reused,
+            deleted=len(to_delete),
+            embedding_seconds=embedding_seconds,
+            seconds_saved=per_chunk * reused,
+            failed=result.failed,
+            errors=[f"batch {f.index + 1} ({f.stage}): {f.error}" for f in result.failures],
+        )
+
+
+def _take(chunks:Iterator[Document], n:int) -> list[Document]:
+    return list(itertools.islice(chunks, n))
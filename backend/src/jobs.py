@@ -0,0 +1,196 @@
+# このファイルの設計思想：
+# /uploadで受け取ったファイルの取り込み(解析 → チャンク分割 → 埋め込み・保存)を
+# リクエストの外、裏で動くワーカーに任せる。
+# ジョブの状態はJSONファイルとして保存し、再起動後も途中のバッチから再開できるようにする。
+# 埋め込むのは新しいチャンクだけ(IncrementalIndexer)なので、再開時は保存済みのバッチが自然に使い回される。
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from enum import Enum
+from pathlib import Path
+from pydantic import BaseModel
+from src import config
+from src.ingestion import IncrementalIndexer, IngestionReport
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class IngestionJob(BaseModel):
+    id: str
+    title: str
+    filename: str
+    file_path: str
+    status: JobStatus = JobStatus.QUEUED
+    total_chunks: int = 0
+    total_batches: int = 0
+    done_batches: int = 0
+    error: str | None = None
+    report: IngestionReport | None = None
+    created_at: float
+    updated_at: float
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+
+class JobStore:
+    """ジョブを1件1ファイルのJSONとして保存する"""
+    def __init__(self, directory:str = config.INGESTION_JOB_DIR):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, job_id:str) -> Path:
+        return self._directory / f"{job_id}.json"
+
+    def save(self, job:IngestionJob):
+        job.updated_at = time.time()
+        # 書き込み途中で落ちても壊れたファイルが残らないよう、一時ファイルから置き換える
+        # （進み具合の保存は複数のスレッドから同時に来るので、一時ファイルは書き込みごとに分ける）
+        tmp_path = self._path(job.id).with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp_path.write_text(job.model_dump_json(), encoding="utf-8")
+        os.replace(tmp_path, self._path(job.id))
+
+    def get(self, job_id:str) -> IngestionJob | None:
+        path = self._path(job_id)
+        if not path.exists():
+            return None
+        return IngestionJob.model_validate(json.loads(path.read_text(encoding="utf-8")))
+
+    def all(self) -> list[IngestionJob]:
+        return [
+            IngestionJob.model_validate(json.loads(p.read_text(encoding="utf-8")))
+            for p in sorted(self._directory.glob("*.json"))
+        ]
+
+
+class IngestionQueue:
+    def __init__(self, vector_store, processor, store:JobStore, workers:int = config.INGESTION_WORKERS, max_queued:int = config.INGESTION_MAX_QUEUED, batch_size:int = config.INGESTION_BATCH_SIZE):
+        self._vector_store = vector_store
+        self._indexer = IncrementalIndexer(vector_store)
+        self._processor = processor
+        self._store = store
+        self._workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._batch_size = batch_size
+        self._tasks = []
+        self._resuming = None  # 再開するジョブを積み直しているタスク
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+        # 前回の起動で終わらなかったジョブを積み直す。max_queued件より多く残っていても起動を止めないよう、
+        # 空きを待ちながら裏で積む
+        unfinished = [job for job in self._store.all() if not job.finished]
+        if unfinished:
+            self._resuming = asyncio.create_task(self._resume(unfinished))
+            self._tasks.append(self._resuming)
+
+    async def _resume(self, jobs:list[IngestionJob]):
+        for job in jobs:
+            logger.info(f"🔁 Resuming ingestion job {job.id} ({job.status.value}, {job.done_batches}/{job.total_batches})")
+            await self._queue.put(job.id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._resuming = None
+
+    async def submit(self, file_path:Path, filename:str, title:str) -> IngestionJob:
+        """ジョブを登録してすぐに返す。キューが一杯ならasyncio.QueueFullを投げる"""
+        now = time.time()
+        job = IngestionJob(
+            id=uuid.uuid4().hex,
+            title=title,
+            filename=filename,
+            file_path=str(file_path),
+            created_at=now,
+            updated_at=now,
+        )
+        if self._queue.full():
+            raise asyncio.QueueFull()
+        # ワーカーが読み込めるよう、先に保存してから積む
+        await asyncio.to_thread(self._store.save, job)
+        self._queue.put_nowait(job.id)
+        return job
+
+    def get(self, job_id:str) -> IngestionJob | None:
+        return self._store.get(job_id)
+
+    async def join(self):
+        """積まれているジョブ（再開するジョブを含む）が全て終わるまで待つ"""
+        if self._resuming is not None:
+            await self._resuming
+        await self._queue.join()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await asyncio.to_thread(self._store.get, job_id)
+                if job is not None and not job.finished:
+                    await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _save(self, job:IngestionJob):
+        await asyncio.to_thread(self._store.save, job)
+
+    async def _run(self, job:IngestionJob):
+        try:
+            job.status = JobStatus.PARSING
+            job.total_chunks = 0
+            await self._save(job)
+            # PDFは読みながら分割したチャンクを1つずつ渡す（解析はindexerがイベントループの外(スレッド)で進める）
+            documents = self._processor.load(Path(job.file_path), job.title, job.filename)
+
+            def _count(documents):
+                for doc in documents:
+                    job.total_chunks += 1
+                    yield doc
+
+            # 差分を調べ、新しいチャンクだけを埋め込む。解析と埋め込みは並行して進む
+            async def _on_progress(done:int, total:int):
+                if done:
+                    job.status = JobStatus.EMBEDDING
+                job.done_batches = done
+                job.total_batches = total
+                await self._save(job)
+                if done:
+                    logger.info(f"💾 Job {job.id}: embedding {done}/{total}")
+
+            job.report = await self._indexer.index(
+                _count(documents), job.filename,
+                batch_size=self._batch_size,
+                on_progress=_on_progress,
+            )
+            if job.report.failed:
+                # 失敗したバッチ以外は反映済み。同じファイルを上げ直せば、差分の取り込みで残りだけが埋め込まれる
+                raise RuntimeError(f"{job.report.failed}/{job.report.new} chunks failed to index: " + "; ".join(job.report.errors))
+            job.status = JobStatus.DONE
+            await self._save(job)
+            Path(job.file_path).unlink(missing_ok=True)
+            logger.info(f"✅ Job {job.id}: {job.filename} indexed (new={job.report.new}, reused={job.report.reused}, deleted={job.report.deleted}, saved≈{job.report.seconds_saved:.1f}s)")
+        except asyncio.CancelledError:
+            # シャットダウン。状態はそのまま残し、次の起動で再開する
+            raise
+        except Exception as e:
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+            await self._save(job)
+            # 失敗したジョブは再開しないので、アップロードされたファイルも残さない（やり直す時は上げ直す）
+            Path(job.file_path).unlink(missing_ok=True)
+            logger.error(f"❌ Job {job.id} failed: {e}")
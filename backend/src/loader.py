@@ -2,13 +2,16 @@
 
 #===　1.モジュール等の事前準備の段階 ===#
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
+import threading
 import bs4
 from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.document_loaders import PDFPlumberLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from src import config
-from logger import get_logger
+from logger import get_logger, init_worker_logging, worker_log_queue
 
 
 class BaseLoader(ABC):
@@ -28,14 +31,23 @@ class BaseLoader(ABC):
     @abstractmethod
     def _extract(self):
         pass
+
+    def _iter_extract(self):
+        # 1ページ(1ドキュメント)ずつ返す。逐次読み込みできるローダーはこれを上書きする
+        yield from self._extract()
     
     def _transform(self, docs):
         return self.text_splitter.split_documents(docs)
+
+    def iter_chunks(self):
+        # ページを読んだそばから分割して渡すので、全ページをメモリに溜めない
+        # (split_documentsはドキュメントごとに独立して分割するので、まとめて分割した時と結果は同じ)
+        for doc in self._iter_extract():
+            yield from self._transform([doc])
         
     
     def load(self):
-        raw_docs = self._extract()
-        return self._transform(raw_docs)
+        return list(self.iter_chunks())
 
 # このクラス分けは、まず__init__で変数の隠蔽を行う。
 # @poertyでinitの中身を外部から参照できるようにすると同時に、のちにurlという変数の変更や、textsplitteのモジュールの変更の際に、ここを変更すればよいようにする。
@@ -57,22 +69,91 @@ class AozoraLoader(BaseLoader):
             self._logger.error(f"ドキュメントの抽出中にエラーが発生しました: {e}")
             raise ValueError(f"ドキュメントの抽出中にエラーが発生しました: {e}") from e
 
+def _extract_page_range(file_path:str, start:int, end:int):
+    """
+    プロセスプールの中で動く関数。[start, end)ページのテキストを取り出す。
+    メタデータはPDFPlumberLoaderと同じ形にする。
+    """
+    import pdfplumber
+    from langchain_core.documents import Document
+
+    with pdfplumber.open(file_path) as pdf:
+        pdf_metadata = {k: v for k, v in pdf.metadata.items() if type(v) in [str, int]}
+        total_pages = len(pdf.pages)
+        docs = []
+        for page in pdf.pages[start:end]:
+            docs.append(Document(
+                page_content=page.extract_text() + "\n",
+                metadata=dict(
+                    {"source": file_path, "file_path": file_path, "page": page.page_number - 1, "total_pages": total_pages},
+                    **pdf_metadata,
+                ),
+            ))
+            page.close()  # ページごとの解析結果を捨ててメモリを抑える
+        return docs
+
+
+def _count_pages(file_path:str) -> int:
+    import pdfplumber
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+# プロセスの起動は重いので、プールは1つだけ作って使い回す
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0
+# 取り込みのワーカーはasyncio.to_threadで別々のスレッドから呼ぶので、プールを作る・作り直すのは1スレッドずつにする
+_pool_lock = threading.Lock()
+
+def _get_pool(workers:int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # スレッドから呼ばれても安全なようにspawnで起動する
+            # 子プロセスはログファイルを開かず、親プロセスのキューに送るだけにする（ファイルの切り替えは親だけが行う）
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker_logging,
+                initargs=(worker_log_queue(),),
+            )
+            _pool_workers = workers
+        return _pool
+
+
 class PDFLoader(BaseLoader):
+    def __init__(self, source:str, workers:int = config.PDF_WORKERS, pages_per_task:int = config.PDF_PAGES_PER_TASK):
+        super().__init__(source)
+        self._workers = workers
+        self._pages_per_task = pages_per_task
+
     def _extract(self):
+        return list(self._iter_extract())
+
+    def _iter_extract(self):
+        # ページ範囲ごとにプロセスプールで並列に解析し、ページ順を保ったまま1ページずつ返す
         try:
             if not os.path.exists(self.source):
                 raise FileNotFoundError(f"The file at {self.source} was not found.")
-            
-            loader = PDFPlumberLoader(file_path=self.source)
-            return loader.load()# メゾットとしてのload。関数としてのloadではないことに注意.
+
+            total_pages = _count_pages(self.source)
+            ranges = [(start, min(start + self._pages_per_task, total_pages)) for start in range(0, total_pages, self._pages_per_task)]
+            if self._workers <= 1:
+                for start, end in ranges:
+                    yield from _extract_page_range(self.source, start, end)
+                return
+
+            pool = _get_pool(self._workers)
+            # 先読みはワーカー数の2倍までにして、メモリに載るページ数を抑える
+            pending = deque()
+            for start, end in ranges:
+                pending.append(pool.submit(_extract_page_range, self.source, start, end))
+                if len(pending) >= self._workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
         except Exception as e:
             self._logger.error(f"ドキュメントの抽出中にエラーが発生しました: {e}")
             raise ValueError(f"ドキュメントの抽出中にエラーが発生しました: {e}") from e
-
-
-
-
-
-
-
-
@@ -0,0 +1,174 @@
+# このファイルの設計思想：
+# 計測値(Prometheusのメトリクス)をここに集めて定義する。
+# 各モジュールはここから必要なメトリクスをインポートして記録するだけにする。
+# 本番でも常に有効にしておけるよう、リクエストの途中で行うのはカウンタ・ヒストグラムへの足し算だけにする。
+#   - 時間・同時実行数: track()で包む（ラベルは包む時に1回だけ解決しておく）
+#   - キャッシュのヒット数などの累計は、既に各段が数えているので、/metricsが読まれた時にStatsCollectorで写す
+
+import functools
+import inspect
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# ストリーミング時の体感レイテンシ（質問ごと）
+STREAM_TIME_TO_SOURCES = Histogram(
+    "chat_stream_time_to_sources_seconds",
+    "ストリーミングで参照元が送られるまでの時間",
+)
+STREAM_TIME_TO_FIRST_TOKEN = Histogram(
+    "chat_stream_time_to_first_token_seconds",
+    "ストリーミングで最初の回答トークン(またはキャッシュヒットの回答)が送られるまでの時間",
+)
+STREAM_TOTAL = Histogram(
+    "chat_stream_total_seconds",
+    "ストリーミングで1つの質問の回答が完了するまでの時間",
+)
+
+# 数ミリ秒のキャッシュの問い合わせから数十秒のLLMの呼び出しまで同じ区切りで見る
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ChatBotのグラフのノードごと（hyde / retrieve / generate）
+GRAPH_NODE_SECONDS = Histogram("chat_graph_node_seconds", "LangGraphのノード1回の所要時間", ["node"], buckets=_LATENCY_BUCKETS)
+GRAPH_NODE_IN_FLIGHT = Gauge("chat_graph_node_in_flight", "実行中のLangGraphのノードの数", ["node"])
+CHAT_RUN_SECONDS = Histogram("chat_run_seconds", "ChatBot.runの所要時間（キャッシュに当たった質問も含む）", buckets=_LATENCY_BUCKETS)
+
+# SemanticCache
+CACHE_OPERATION_SECONDS = Histogram("semantic_cache_operation_seconds", "SemanticCacheの問い合わせ(check)・登録(add)の所要時間", ["operation"], buckets=_LATENCY_BUCKETS)
+
+# Vectorstore（検索1回・書き込み1バッチごと）
+VECTOR_STORE_SECONDS = Histogram("vector_store_operation_seconds", "ベクトルストアの検索・書き込み1回の所要時間", ["operation"], buckets=_LATENCY_BUCKETS)
+VECTOR_STORE_IN_FLIGHT = Gauge("vector_store_in_flight", "実行中のベクトルストアの検索・書き込みの数", ["operation"])
+VECTOR_STORE_ROWS = Counter("vector_store_rows_written_total", "ベクトルストアに書き込んだ行数")
+
+# 同時に来た埋め込みをまとめるバッチャー(src/embeddings.py)。modelは埋め込みモデル名
+EMBEDDING_BATCH_SIZE = Histogram("embedding_batch_size", "1回のaembed_documentsにまとめて送ったテキストの数", ["model"], buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+EMBEDDING_QUEUE_DELAY_SECONDS = Histogram("embedding_batch_queue_delay_seconds", "埋め込みの呼び出しがバッチにまとめられて送られるまで待った時間", ["model"], buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+# 外部API(llm / embedding)の呼び出し。全ての呼び出しが通るレート制限器で記録する
+API_CALL_SECONDS = Histogram("api_call_seconds", "外部APIの呼び出し1回の所要時間（レート制限器の待ちを除く）", ["api"], buckets=_LATENCY_BUCKETS)
+API_WAIT_SECONDS = Histogram("api_wait_seconds", "外部APIの呼び出しがレート制限器で待たされた時間", ["api", "priority"], buckets=_LATENCY_BUCKETS)
+API_IN_FLIGHT = Gauge("api_in_flight", "実行中の外部APIの呼び出しの数", ["api"])
+API_ERRORS = Counter("api_errors_total", "外部APIの呼び出しの失敗数（429を含む）", ["api"])
+API_RATE_LIMITED = Counter("api_rate_limited_total", "外部APIが429(クォータ超過)を返した回数", ["api"])
+API_RETRIES = Counter("api_retries_total", "429の後にやり直した回数", ["api"])
+API_TOKENS = Counter("api_tokens_total", "外部APIに送ったトークン数（文字数からの見積もり）", ["api"])
+
+# LLMの呼び出しの順番待ち(src/scheduler.py)。poolはhyde / generate
+SCHEDULER_QUEUE_LENGTH = Gauge("llm_scheduler_queue_length", "LLMの呼び出しの枠を待っている数", ["pool"])
+SCHEDULER_IN_FLIGHT = Gauge("llm_scheduler_in_flight", "LLMの呼び出しの枠を使っている数", ["pool"])
+SCHEDULER_WAIT_SECONDS = Histogram("llm_scheduler_wait_seconds", "LLMの呼び出しの枠をもらうまで待った時間", ["pool"], buckets=_LATENCY_BUCKETS)
+SCHEDULER_REJECTED = Counter("llm_scheduler_rejected_total", "混んでいたので断った呼び出しの数", ["pool", "reason"])
+HYDE_SHED = Counter("chat_hyde_shed_total", "HyDEの枠が一杯で断られたので、質問そのままでの検索結果だけで答えた数（並列モード）")
+
+# DBの接続プール(src/db.py)。engineはsync / async
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "接続プールから接続を借りるまでの時間（新しく接続した時はその時間も含む）", ["engine"], buckets=_LATENCY_BUCKETS)
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "接続プールから接続を貸し出した回数", ["engine"])
+DB_POOL_CONNECTS = Counter("db_pool_connects_total", "DBへ新しく接続した回数（recycleでの作り直しを含む）", ["engine"])
+
+
+def track(histogram:Histogram, in_flight:Gauge | None = None, **labels):
+    """
+    関数（同期でもasyncでも）を包み、1回ごとの所要時間をhistogramに、実行中の数をin_flightに記録するデコレータ。
+    例外で終わった呼び出しも時間は記録する。
+    """
+    observe = (histogram.labels(**labels) if labels else histogram).observe
+    gauge = (in_flight.labels(**labels) if labels else in_flight) if in_flight is not None else None
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if gauge is not None:
+                    gauge.inc()
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(time.perf_counter() - started)
+                    if gauge is not None:
+                        gauge.dec()
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if gauge is not None:
+                gauge.inc()
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - started)
+                if gauge is not None:
+                    gauge.dec()
+        return wrapper
+    return decorator
+
+
+class StatsCollector:
+    """
+    各部品が既に数えている累計（stats()の辞書）を、/metricsが読まれた時にだけPrometheusの形に写す。
+    sourceは {"cache": {段の名前: {"hits", "misses", "stale", "revalidated", "size"}}, "limiters": {API名: RateLimiter.stats()},
+    "db_pools": EngineRegistry.stats(), "singleflight": SingleFlight.stats(), "embedding_batchers": {モデル名: EmbeddingBatcher.stats()}}
+    を返す関数（まだ準備ができていなければNone）。
+    """
+    def __init__(self, source):
+        self._source = source
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        try:
+            stats = self._source()
+        except Exception:
+            stats = None
+        if not stats:
+            return
+        requests = CounterMetricFamily("chat_cache_requests", "キャッシュの段ごとの問い合わせ数", labels=["tier", "result"])
+        entries = GaugeMetricFamily("chat_cache_entries", "キャッシュの段ごとの件数", labels=["tier"])
+        for tier, tier_stats in (stats.get("cache") or {}).items():
+            if not isinstance(tier_stats, dict):
+                continue
+            for result in ("hits", "misses", "stale", "revalidated"):
+                if result in tier_stats:
+                    requests.add_metric([tier, result], tier_stats[result])
+            if "size" in tier_stats:
+                entries.add_metric([tier], tier_stats["size"])
+        yield requests
+        yield entries
+
+        concurrency = GaugeMetricFamily("api_concurrency_limit", "レート制限器が今許している同時実行数", labels=["api"])
+        waiting = GaugeMetricFamily("api_waiting", "レート制限器で待っている呼び出しの数", labels=["api"])
+        for api, limiter_stats in (stats.get("limiters") or {}).items():
+            concurrency.add_metric([api], limiter_stats["concurrency_limit"])
+            waiting.add_metric([api], limiter_stats["waiting"])
+        yield concurrency
+        yield waiting
+
+        flights = stats.get("singleflight")
+        if flights:
+            runs = CounterMetricFamily("chat_singleflight_runs", "同じ質問の同時実行の扱い（executions: パイプラインを走らせた / collapsed: 他の実行に相乗りした）", labels=["result"])
+            runs.add_metric(["executions"], flights["executions"])
+            runs.add_metric(["collapsed"], flights["collapsed"])
+            yield runs
+            in_flight = GaugeMetricFamily("chat_singleflight_in_flight", "実行中で相乗りできる質問の数")
+            in_flight.add_metric([], flights["in_flight"])
+            yield in_flight
+
+        # バッチの大きさ・待ち時間の分布はバッチャーがヒストグラムに記録しているので、ここでは最大の待ち時間だけを写す
+        max_delay = GaugeMetricFamily("embedding_batch_max_queue_delay_seconds", "埋め込みの呼び出しがバッチに入って待った時間の最大", labels=["model"])
+        for model, batcher_stats in (stats.get("embedding_batchers") or {}).items():
+            max_delay.add_metric([model], batcher_stats["max_queue_delay_ms"] / 1000)
+        yield max_delay
+
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "接続プールから貸し出し中の接続の数", labels=["engine"])
+        pool_size = GaugeMetricFamily("db_pool_size", "接続プールが常に開いておく接続の数", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "接続プールが混んで一時的に追加で開いている接続の数", labels=["engine"])
+        for engine, pool_stats in (stats.get("db_pools") or {}).items():
+            checked_out.add_metric([engine], pool_stats["checked_out"])
+            pool_size.add_metric([engine], pool_stats["size"])
+            overflow.add_metric([engine], pool_stats["overflow"])
+        yield checked_out
+        yield pool_size
+        yield overflow
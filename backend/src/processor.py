@@ -1,6 +1,8 @@
 import shutil
 import os
+import uuid
 from pathlib import Path
+from typing import Iterator
 from fastapi import UploadFile
 from langchain_core.documents import Document
 # あなたが定義したPDFLoaderをインポート
@@ -14,23 +16,31 @@ class DocumentProcessor:
         
     
     async def process(self, file: UploadFile, user_title: str) -> list[Document]:
-        file_path = self._upload_dir / file.filename
+        file_path = await self.save(file)
         try:
-            # 1. 一時保存
-            await self._save_temp_file(file, file_path)
-            
-            # 2. 読み込み (PDFPlumberLoader使用)
-            loader = Factories.choiseloader(source=str(file_path))
-            documents = loader.load()
-            
-            # 3. メタデータ正規化 (ページ付与・タイトル注入)
-            return self._enrich_metadata(documents, user_title, file.filename)
-            
-
+            return list(self.load(file_path, user_title, file.filename))
         finally:
-            # 4. 後片付け (必ず実行される)
+            # 後片付け (必ず実行される)
             self._cleanup(file_path)
 
+    async def save(self, file: UploadFile) -> Path:
+        """アップロードされたファイルを一時保存し、そのパスを返す"""
+        # 同じ名前のファイルが同時にアップロードされても上書きしないよう、先頭にIDを付ける
+        file_path = self._upload_dir / f"{uuid.uuid4().hex}_{file.filename}"
+        await self._save_temp_file(file, file_path)
+        return file_path
+
+    def load(self, file_path: Path, user_title: str, filename: str) -> Iterator[Document]:
+        """
+        保存済みのファイルを読み込み、メタデータを付けたチャンクを1つずつ返す（同期処理）。
+        ページを読んだそばから分割して渡すので、大きなPDFでも全チャンクをメモリに溜めない。
+        """
+        # 読み込み (PDFPlumberLoader使用)
+        loader = Factories.choiseloader(source=str(file_path))
+        for doc in loader.iter_chunks():
+            # メタデータ正規化 (ページ付与・タイトル注入)
+            yield from self._enrich_metadata([doc], user_title, filename)
+
     async def _save_temp_file(self, file: UploadFile, path: Path):
         with open(path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
@@ -48,4 +58,4 @@ class DocumentProcessor:
     def _cleanup(self, path: Path):
         if path.exists():
             os.remove(path)
-            
\ No newline at end of file
+            
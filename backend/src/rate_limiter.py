@@ -0,0 +1,262 @@
+# このファイルの設計思想：
+# 埋め込み・LLMのAPI呼び出しを、プロセス全体で1つのレート制限器に通す。
+#   - リクエスト数/分 と トークン数/分 の2つのトークンバケットで、クォータを超えないように待たせる
+#   - 同時実行数はAIMDで調整する（成功が続けば少しずつ増やし、429が来たら半分にして少し休む）
+#   - 待っている呼び出しは優先度順に通す。対話(/chat)の呼び出しは、取り込み(bulk)より常に先に通し、
+#     取り込みだけで同時実行数を使い切らないよう、対話用に枠を残しておく
+#   - 同期の呼び出し(CLIからの取り込みなど)も同じバケットを通す(call_sync)。イベントループが動いていれば
+#     そのループで順番待ちし、呼び出し自体は別スレッドで行う。動いていなければその場でループを回す
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from src import config
+from src.metrics import API_CALL_SECONDS, API_ERRORS, API_IN_FLIGHT, API_RATE_LIMITED, API_RETRIES, API_TOKENS, API_WAIT_SECONDS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 1
+
+
+def is_rate_limit_error(error:BaseException) -> bool:
+    """例外(とその原因の連鎖)が429/クォータ超過を表しているか。エラーメッセージの文字列は見ない"""
+    seen = 0
+    while error is not None and seen < 5:
+        if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+            return True
+        if getattr(error, "status", None) in (429, "RESOURCE_EXHAUSTED"):
+            return True
+        if type(error).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests"):
+            return True
+        error = error.__cause__ or error.__context__
+        seen += 1
+    return False
+
+
+def estimate_tokens(text:str) -> int:
+    return max(1, len(text) // config.CHARS_PER_TOKEN)
+
+
+class _TokenBucket:
+    def __init__(self, per_minute:float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._rate = per_minute / 60
+        self._updated = time.monotonic()
+
+    def _refill(self, now:float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount:float, now:float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self._rate
+
+    def take(self, amount:float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, name:str, requests_per_minute:float, tokens_per_minute:float, max_concurrency:int, min_concurrency:int = 1, initial_concurrency:int | None = None, latency_target:float = 5.0, interactive_reserve:int = 1, min_backoff:float = 1.0, max_backoff:float = 60.0):
+        self._name = name
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._max_concurrency = max_concurrency
+        self._min_concurrency = min_concurrency
+        self._limit = float(initial_concurrency or max_concurrency)
+        self._latency_target = latency_target
+        self._interactive_reserve = interactive_reserve
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._backoff = min_backoff
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._in_flight_bulk = 0
+        self._waiters = []  # (優先度, 到着順, トークン数, future) のヒープ
+        self._seq = itertools.count()
+        self._timer = None
+        # 最後に使われたイベントループ（同期の呼び出しの順番待ちをここで行う）。ループの中で作られたらそのループ
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        # 計測用
+        self.granted = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        # Prometheusのメトリクス（ラベルは呼び出しのたびに解決しないよう、ここで1回だけ）
+        self._call_seconds = API_CALL_SECONDS.labels(api=name)
+        self._in_flight_gauge = API_IN_FLIGHT.labels(api=name)
+        self._errors = API_ERRORS.labels(api=name)
+        self._rate_limited_counter = API_RATE_LIMITED.labels(api=name)
+        self._retries_counter = API_RETRIES.labels(api=name)
+        self._tokens_counter = API_TOKENS.labels(api=name)
+        self._wait_seconds = {p: API_WAIT_SECONDS.labels(api=name, priority=p.name.lower()) for p in Priority}
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(self._min_concurrency, int(self._limit))
+
+    @asynccontextmanager
+    async def acquire(self, tokens:int = 1, priority:Priority = Priority.INTERACTIVE):
+        """枠が空くまで待ってから中の処理を実行する。429で失敗したら同時実行数を絞る"""
+        self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        queued_at = time.monotonic()
+        self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 枠をもらった直後にキャンセルされた場合は返しておく
+            if future.done() and not future.cancelled():
+                self._release(priority)
+            raise
+        waited = time.monotonic() - queued_at
+        self.total_wait += waited
+        self._wait_seconds[priority].observe(waited)
+        self._tokens_counter.inc(tokens)
+
+        self._in_flight_gauge.inc()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._errors.inc()
+            if is_rate_limit_error(e):
+                self._on_rate_limited()
+            raise
+        else:
+            self._on_success(time.monotonic() - started)
+        finally:
+            self._call_seconds.observe(time.monotonic() - started)
+            self._in_flight_gauge.dec()
+            self._release(priority)
+
+    async def call(self, factory, tokens:int = 1, priority:Priority = Priority.INTERACTIVE, max_retries:int = config.RATE_LIMIT_MAX_RETRIES):
+        """factory()の結果を返す。429ならレート制限器の指示に従って待ってからやり直す"""
+        for attempt in range(max_retries + 1):
+            try:
+                async with self.acquire(tokens, priority):
+                    return await factory()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == max_retries:
+                    raise
+                self.retries += 1
+                self._retries_counter.inc()
+                logger.warning(f"⚠️ [{self._name}] Rate limit hit. Retrying {attempt + 1}/{max_retries} (concurrency={self.concurrency_limit})")
+
+    def call_sync(self, fn, tokens:int = 1, priority:Priority = Priority.INTERACTIVE, max_retries:int = config.RATE_LIMIT_MAX_RETRIES):
+        """
+        callの同期版。fn()の結果を返す。非同期の呼び出しと同じバケット・同時実行数・429の後の休みを使う。
+        イベントループのスレッドから呼ばれた時は、待つとループが止まるので順番待ちはせず、429を伝えるだけにする
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            try:
+                return fn()
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    self._errors.inc()
+                    self._on_rate_limited()
+                raise
+
+        async def _call():
+            return await self.call(lambda: asyncio.to_thread(fn), tokens, priority, max_retries)
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            return asyncio.run_coroutine_threadsafe(_call(), loop).result()
+        return asyncio.run(_call())
+
+    def _pump(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)  # キャンセルされた呼び出し
+                continue
+            if now < self._paused_until:
+                self._schedule(self._paused_until - now)
+                return
+            limit = self.concurrency_limit
+            if self._in_flight >= limit:
+                return  # 誰かが終わった時に_releaseから呼ばれる
+            if priority == Priority.BULK and self._in_flight_bulk >= max(1, limit - self._interactive_reserve):
+                return
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._waiters)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            self._in_flight += 1
+            if priority == Priority.BULK:
+                self._in_flight_bulk += 1
+            self.granted += 1
+            future.set_result(None)
+
+    def _schedule(self, delay:float):
+        self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+
+    def _release(self, priority:Priority):
+        self._in_flight -= 1
+        if priority == Priority.BULK:
+            self._in_flight_bulk -= 1
+        self._pump()
+
+    def _on_rate_limited(self):
+        # 乗算的に減らし、しばらく新しい呼び出しを止める
+        self.rate_limited += 1
+        self._rate_limited_counter.inc()
+        self._limit = max(self._min_concurrency, self._limit / 2)
+        self._paused_until = max(self._paused_until, time.monotonic() + self._backoff)
+        self._backoff = min(self._max_backoff, self._backoff * 2)
+
+    def _on_success(self, latency:float):
+        # 加算的に増やす（応答が遅くなっている時は増やさない）
+        self._backoff = self._min_backoff
+        if latency <= self._latency_target:
+            self._limit = min(self._max_concurrency, self._limit + 1 / self._limit)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": self.concurrency_limit,
+            "in_flight": self._in_flight,
+            "waiting": sum(1 for w in self._waiters if not w[3].done()),
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "mean_wait_ms": self.total_wait / self.granted * 1000 if self.granted else 0.0,
+        }
+
+
+# API(embedding / llm)ごとにプロセス全体で1つだけ作る
+_limiters: dict = {}
+
+def get_rate_limiter(name:str) -> RateLimiter:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = RateLimiter(name, **config.RATE_LIMITS[name])
+        _limiters[name] = limiter
+    return limiter
+
+
+def rate_limiter_stats() -> dict:
+    """作られているレート制限器ごとのstats()"""
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
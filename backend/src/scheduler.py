@@ -0,0 +1,171 @@
+# このファイルの設計思想：
+# /chatの質問はどれもHyDEと回答の生成でLLMを呼ぶ。リクエストごとに同時実行数を絞っても、
+# リクエストが200件同時に来ればLLMの呼び出しも数百件同時に走り、429で全員が一緒に遅くなる。
+# そこでプロセス全体で1つのLLMSchedulerが、HyDEと回答の生成の同時実行数をそれぞれ別に絞る。
+#   - 空きが無ければ待たせる。待っている呼び出しはリクエストごとに順番に通す（1つのリクエストの10個の質問が他のリクエストを待たせない）
+#   - 待ち行列の長さには上限があり、一杯ならすぐに429で断る（Retry-Afterに空きそうな秒数を入れる）
+#   - 待ち時間にも上限があり、超えたら503で断る（待ち続けてタイムアウトするより早く諦めてもらう）
+# リクエストの区別はcontextvarsで行う（request_scopeの中で作ったタスクは同じリクエストとして扱われる）。
+
+import asyncio
+import contextvars
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from src import config
+from src.metrics import SCHEDULER_IN_FLIGHT, SCHEDULER_QUEUE_LENGTH, SCHEDULER_REJECTED, SCHEDULER_WAIT_SECONDS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_current_request = contextvars.ContextVar("llm_scheduler_request", default=None)
+
+
+class Overloaded(Exception):
+    """混んでいるので断った。status_code(429/503)とretry_after(秒)をHTTPのレスポンスにそのまま使う"""
+    def __init__(self, message:str, status_code:int, retry_after:int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@contextmanager
+def request_scope(request_id:str | None = None):
+    """この中で行うLLMの呼び出しを、1つのリクエストのものとして順番待ちさせる"""
+    token = _current_request.set(request_id or uuid.uuid4().hex)
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+class FairScheduler:
+    """同時実行数をmax_concurrencyに絞り、待っている呼び出しをリクエストごとの順番(ラウンドロビン)で通す"""
+    def __init__(self, name:str, max_concurrency:int, max_queue:int, max_wait:float):
+        self._name = name
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._max_wait = max_wait
+        self._waiters: "OrderedDict[str | None, deque]" = OrderedDict()  # リクエスト → 待っているfuture
+        self._queued = 0
+        self._in_flight = 0
+        self._service_time = 1.0  # 1回の呼び出しにかかる時間の指数移動平均（Retry-Afterの見積もり用）
+        # 計測用
+        self.granted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self._queue_gauge = SCHEDULER_QUEUE_LENGTH.labels(pool=name)
+        self._in_flight_gauge = SCHEDULER_IN_FLIGHT.labels(pool=name)
+        self._wait_seconds = SCHEDULER_WAIT_SECONDS.labels(pool=name)
+
+    def retry_after(self) -> int:
+        """今の待ち行列が捌けるまでの見積もり(秒、1以上)"""
+        return max(1, math.ceil((self._queued + 1) / self._max_concurrency * self._service_time))
+
+    def _reject(self, reason:str, status_code:int):
+        self.rejected[reason] += 1
+        SCHEDULER_REJECTED.labels(pool=self._name, reason=reason).inc()
+        retry_after = self.retry_after()
+        logger.warning(f"🚦 [{self._name}] rejected ({reason}): in_flight={self._in_flight}, queued={self._queued}, retry after {retry_after}s")
+        raise Overloaded(f"{self._name} is overloaded ({reason})", status_code, retry_after)
+
+    def check_capacity(self):
+        """待ち行列が一杯なら、LLMを呼ぶ前の段階で断る"""
+        if self._queued >= self._max_queue:
+            self._reject("queue_full", 429)
+
+    @asynccontextmanager
+    async def slot(self):
+        queued_at = time.monotonic()
+        if self._in_flight < self._max_concurrency and not self._queued:
+            self._in_flight += 1
+        else:
+            self.check_capacity()
+            await self._wait()
+        self.granted += 1
+        self._wait_seconds.observe(time.monotonic() - queued_at)
+        self._in_flight_gauge.set(self._in_flight)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._in_flight -= 1
+            self._grant()
+
+    async def _wait(self):
+        request = _current_request.get()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(request, deque()).append(future)
+        self._queued += 1
+        self._queue_gauge.set(self._queued)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self._max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # 枠をもらう前なら順番待ちから抜ける。同時に枠をもらっていたら、待ち時間切れの時はそのまま使う
+            if future.cancel():
+                self._queued -= 1
+                self._queue_gauge.set(self._queued)
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject("timeout", 503)
+                raise
+            if isinstance(e, asyncio.CancelledError):
+                self._in_flight -= 1
+                self._grant()
+                raise
+
+    def _grant(self):
+        while self._in_flight < self._max_concurrency and self._waiters:
+            request, futures = next(iter(self._waiters.items()))
+            future = futures.popleft()
+            if futures:
+                self._waiters.move_to_end(request)  # 次は別のリクエストの番
+            else:
+                del self._waiters[request]
+            if future.done():
+                continue  # 待ち時間切れ・キャンセルで抜けた呼び出し（数え直し済み）
+            self._queued -= 1
+            self._in_flight += 1
+            future.set_result(None)
+        self._queue_gauge.set(self._queued)
+        self._in_flight_gauge.set(self._in_flight)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self._max_concurrency,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "requests_waiting": len(self._waiters),
+            "granted": self.granted,
+            "rejected": dict(self.rejected),
+            "service_time_ms": self._service_time * 1000,
+        }
+
+
+class LLMScheduler:
+    """HyDE(hyde)と回答の生成(generate)の呼び出しを、それぞれの枠で順番待ちさせる"""
+    def __init__(self, limits:dict | None = None):
+        limits = limits or config.LLM_SCHEDULER_LIMITS
+        self._pools = {name: FairScheduler(name, **spec) for name, spec in limits.items()}
+
+    def slot(self, pool:str):
+        return self._pools[pool].slot()
+
+    def admit(self):
+        """どれかの待ち行列が一杯なら、質問を受け付ける前に断る（埋め込みや検索も無駄にしない）"""
+        for pool in self._pools.values():
+            pool.check_capacity()
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+
+# アプリ全体で1つだけ作る
+_scheduler: LLMScheduler | None = None
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
@@ -0,0 +1,40 @@
+# このファイルの設計思想：
+# 同じ質問が同時に複数来た時、パイプライン(HyDE → 検索 → 生成)を1回だけ走らせ、
+# 後から来た呼び出しはその結果を待って同じ答えを受け取る（single-flight）。
+
+import asyncio
+import re
+import unicodedata
+
+
+def normalize_question(question:str) -> str:
+    """全角・半角や大文字・小文字、空白の違いを吸収したキーを作る"""
+    normalized = unicodedata.normalize("NFKC", question)
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return normalized.lower()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._in_flight: dict = {}
+        self.executions = 0  # 実際にパイプラインを走らせた回数
+        self.collapsed = 0  # 他の実行に相乗りした回数
+
+    async def do(self, key:str, factory):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.collapsed += 1
+        # 1人の呼び出し元がキャンセルされても、相乗りしている他の呼び出し元の実行は止めない
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+        }
@@ -0,0 +1,125 @@
+# このファイルの設計思想：
+# 起動のたびに元の文書を解析し直さないよう、チャンクとベクトルをスナップショットとして保存しておく。
+# スナップショットは1つのディレクトリで、
+#   - manifest.json : 元の文書の指紋・件数・次元など
+#   - chunks.jsonl  : 1行1チャンク（ID・本文・メタデータ）
+#   - vectors.npy   : float32の行列（メモリマップで読み込むので、件数が多くても一瞬で開ける）
+# 起動時は元の文書の指紋がmanifestと一致するかを確かめ、一致すればそのまま使う。
+# ただしDBが作り直された・消された場合に空のコレクションで答えないよう、DBの行をスナップショットと照合し、
+# 足りない行はスナップショットのベクトルのまま書き戻す（埋め込みAPIは呼ばない）。
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+import requests
+from langchain_core.documents import Document
+from src import config
+
+_MANIFEST = "manifest.json"
+_CHUNKS = "chunks.jsonl"
+_VECTORS = "vectors.npy"
+
+
+def source_fingerprint(source:str, embedding_model:str) -> str:
+    """
+    元の文書・埋め込みモデル・チャンク分割の設定から指紋を作る。
+    どれか1つでも変われば、スナップショットは使えない。
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{embedding_model}\n{config.CHUNK_SIZE}\n{config.CHUNK_OVERLAP}\n{source}\n".encode("utf-8"))
+    if os.path.exists(source):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    elif source.startswith(("http://", "https://")):
+        digest.update(_remote_version(source))
+    return digest.hexdigest()
+
+
+def _remote_version(url:str) -> bytes:
+    """
+    Webの文書の版を表すバイト列。ETag・Last-Modifiedがあればそれを使い（本文は取りに行かない）、
+    無ければ本文を取ってきてそのまま使う。
+    """
+    response = requests.head(url, allow_redirects=True, timeout=30)
+    response.raise_for_status()
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    if validator:
+        return validator.encode("utf-8")
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+@dataclass
+class Snapshot:
+    manifest: dict
+    documents: list
+    vectors: np.ndarray
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def save_snapshot(directory:str, documents:list[Document], vectors, fingerprint:str):
+    target = Path(directory)
+    # 書き込み途中で落ちても壊れたスナップショットを読まないよう、別の場所に書いてから置き換える
+    tmp = target.with_name(target.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    np.save(tmp / _VECTORS, matrix)
+    with open(tmp / _CHUNKS, "w", encoding="utf-8") as f:
+        for doc in documents:
+            f.write(json.dumps({"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False) + "\n")
+    manifest = {
+        "fingerprint": fingerprint,
+        "count": len(documents),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "created_at": time.time(),
+    }
+    (tmp / _MANIFEST).write_text(json.dumps(manifest), encoding="utf-8")
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+
+
+def load_snapshot(directory:str, fingerprint:str) -> Snapshot | None:
+    """指紋が一致するスナップショットを返す。無い・古い・壊れている場合はNone"""
+    target = Path(directory)
+    try:
+        manifest = json.loads((target / _MANIFEST).read_text(encoding="utf-8"))
+        if manifest.get("fingerprint") != fingerprint:
+            return None
+        vectors = np.load(target / _VECTORS, mmap_mode="r")
+        with open(target / _CHUNKS, encoding="utf-8") as f:
+            documents = [Document(**json.loads(line)) for line in f]
+    except (OSError, ValueError):
+        return None
+    if len(documents) != manifest.get("count") or len(vectors) != len(documents):
+        return None
+    return Snapshot(manifest=manifest, documents=documents, vectors=vectors)
+
+
+async def arestore_snapshot(vector_store, snapshot:Snapshot, source_file:str, batch_size:int = config.INGESTION_BATCH_SIZE) -> tuple[int, int]:
+    """
+    DBにあるsource_fileの行をスナップショットに合わせる。(書き戻した行数, 削除した行数)を返す。
+    件数だけでなくIDも比べるので、途中まで消えた・別の版の行が残っている場合も直る。
+    """
+    stored = set(await vector_store.aget_ids_by_metadata("source_file", [source_file]))
+    expected = {doc.id for doc in snapshot.documents}
+    if len(stored) == snapshot.manifest.get("count") and stored == expected:
+        return 0, 0
+    extra = list(stored - expected)
+    await vector_store.adelete(extra)
+    missing = [i for i, doc in enumerate(snapshot.documents) if doc.id not in stored]
+    for start in range(0, len(missing), batch_size):
+        rows = missing[start:start + batch_size]
+        await vector_store.aadd_with_vectors([snapshot.documents[i] for i in rows], snapshot.vectors[rows])
+    return len(missing), len(extra)
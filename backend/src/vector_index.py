@@ -0,0 +1,103 @@
+# このファイルの設計思想：
+# プロセス内に持つ小さなベクトル索引。
+# ベクトルは正規化してfloat32の連続した行列に詰めておき、
+# 検索は行列とベクトルの積1回でコサイン距離をまとめて計算する。
+# 距離はPGVector(COSINE)と同じ「1 - コサイン類似度」なので、閾値の意味は変わらない。
+
+import numpy as np
+
+
+class VectorIndex:
+    def __init__(self, initial_capacity:int = 1024):
+        self._initial_capacity = initial_capacity
+        self._matrix = None  # (capacity, dim) のfloat32行列。先頭self._size行だけが有効
+        self._size = 0
+        self._payloads = []
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _reserve(self, dim:int, extra:int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, extra)
+            self._matrix = np.empty((capacity, dim), dtype=np.float32)
+            return
+        if dim != self.dim:
+            raise ValueError(f"ベクトルの次元が一致しません: {dim} != {self.dim}")
+        needed = self._size + extra
+        if needed <= self._matrix.shape[0]:
+            return
+        # 容量は倍々で増やし、コピーの回数を抑える
+        capacity = self._matrix.shape[0]
+        while capacity < needed:
+            capacity *= 2
+        grown = np.empty((capacity, dim), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def add(self, vector, payload):
+        self.add_many([vector], [payload])
+
+    def add_many(self, vectors, payloads):
+        if len(vectors) != len(payloads):
+            raise ValueError("vectorsとpayloadsの数が一致しません")
+        if len(vectors) == 0:
+            return
+        normalized = self._normalize(vectors)
+        self._reserve(normalized.shape[1], len(normalized))
+        self._matrix[self._size:self._size + len(normalized)] = normalized
+        self._payloads.extend(payloads)
+        self._size += len(normalized)
+
+    def search(self, vector, k:int = 1):
+        """(payload, コサイン距離) を距離の小さい順にk件返す"""
+        if self._size == 0:
+            return []
+        query = self._normalize(vector)
+        if query.shape[-1] != self.dim:
+            raise ValueError(f"ベクトルの次元が一致しません: {query.shape[-1]} != {self.dim}")
+        distances = 1.0 - self._matrix[:self._size] @ query
+        k = min(k, self._size)
+        if k == 1:
+            top = [int(np.argmin(distances))]
+        else:
+            candidates = np.argpartition(distances, k - 1)[:k]
+            top = candidates[np.argsort(distances[candidates])]
+        return [(self._payloads[i], float(distances[i])) for i in top]
+
+    def payloads(self):
+        return list(self._payloads)
+
+    def retain(self, keep) -> list:
+        """keep(payload)がFalseの行をまとめて取り除き、行列を詰め直す。取り除いたpayloadを返す"""
+        mask = np.fromiter((bool(keep(p)) for p in self._payloads), dtype=bool, count=self._size)
+        if mask.all():
+            return []
+        removed = [p for p, k in zip(self._payloads, mask) if not k]
+        kept = int(mask.sum())
+        rows = self._matrix[:self._size][mask]  # 真偽値での取り出しはコピーになる
+        # 大きく減った時は容量も縮めてメモリを返す
+        capacity = self._matrix.shape[0]
+        if capacity > 4 * max(kept, self._initial_capacity):
+            capacity = max(self._initial_capacity, 2 * kept)
+            self._matrix = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+        self._matrix[:kept] = rows
+        self._payloads = [p for p, k in zip(self._payloads, mask) if k]
+        self._size = kept
+        return removed
+
+    def clear(self):
+        self._matrix = None
+        self._size = 0
+        self._payloads = []
@@ -2,67 +2,573 @@
 # 埋め込みモデルでembeddingを作成する。
 # ベクトルストアを定義する。
 # ドキュメントをロードし、ベクトルストアに追加する。
+# 大量のチャンクを追加する時は、IngestionPipelineで埋め込みとDBへの書き込みを並行させる。
+# 埋め込み済みのチャンクは、1行ずつのINSERTではなくCOPY(バイナリ)でまとめて書き込む。
+# 非同期の検索は、コレクションごとのANN索引(HNSW / IVFFlat)が使えるSQLで行う（src/ann_index.py）。
+# DBへの接続プールとコレクションのUUIDは、全てのインスタンスで共有する（src/db.py）。
 
 #===　1.モジュール等の事前準備の段階 ===#
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_postgres import PGVector  # 新しい主役！
+from langchain_core.documents import Document
+from pgvector.sqlalchemy import Vector
+from pgvector.psycopg.vector import register_vector_info
+from psycopg.types import TypeInfo
+from psycopg.types.json import Jsonb
+from sqlalchemy import Float, String, text
+from sqlalchemy.dialects.postgresql import JSONB
 from src import config
+from src.db import get_engine_registry
+from src.ann_index import IndexSpec, VectorLayout, create_index_sql, drop_index_sql, index_name, knn_params, knn_sql, tuning_sql
+from src.embeddings import CachedEmbeddings, RateLimitedEmbeddings, TruncatedEmbeddings, get_embedding_batcher
+from src.rate_limiter import Priority, is_rate_limit_error
+from src.metrics import VECTOR_STORE_IN_FLIGHT, VECTOR_STORE_ROWS, VECTOR_STORE_SECONDS, track
 from time import sleep
 from logger import get_logger
+from dataclasses import dataclass, field
+import asyncio
+import json
 import time
+import uuid
+import weakref
+import numpy as np
 
 logger = get_logger(__name__)
+
+# COPYで一旦流し込む一時テーブル。コミットのたびに空になるので、接続を使い回しても残らない
+_COPY_TABLE = "langchain_pg_embedding_copy"
+_COPY_COLUMNS = "id, collection_id, embedding, document, cmetadata"
+
+
+@dataclass
+class BatchFailure:
+    index: int  # 何番目のバッチか
+    ids: list  # バッチに含まれていたチャンクのID
+    stage: str  # "embed" か "write"
+    error: str
+
+
+@dataclass
+class PipelineResult:
+    total: int = 0  # 渡されたチャンク数
+    written: int = 0  # 書き込めたチャンク数
+    failures: list = field(default_factory=list)  # BatchFailureのリスト
+    embedding_seconds: float = 0.0  # 埋め込み呼び出しの時間の合計（並行分も足し合わせる）
+    seconds: float = 0.0  # 全体にかかった時間
+
+    @property
+    def failed(self) -> int:
+        return sum(len(f.ids) for f in self.failures)
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.written / self.seconds if self.seconds else 0.0
+
+
+async def _batched(documents, size:int):
+    """listまたはasyncのイテレータのDocumentを、size件ずつのリストにして返す"""
+    if not hasattr(documents, "__aiter__"):
+        for i in range(0, len(documents), size):
+            yield documents[i:i + size]
+        return
+    batch = []
+    async for doc in documents:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestionPipeline:
+    """
+    チャンクをバッチに分け、
+      埋め込み(embed_workers本が並行) → キュー → 書き込み(1本)
+    の流れで処理する。埋め込みAPIとDBが同時に働くので、1バッチずつ順番に処理するより速い。
+    ステージの間のキューは上限付きで、書き込みが遅ければ埋め込みも待つ（メモリを使い過ぎない）。
+    失敗はバッチ単位で記録し、他のバッチの処理は続ける。
+    """
+    def __init__(self, embed, write, batch_size:int = config.INGESTION_BATCH_SIZE, embed_workers:int = config.INGESTION_EMBED_WORKERS, queue_size:int = config.INGESTION_QUEUE_SIZE):
+        self._embed = embed  # async (texts) -> vectors
+        self._write = write  # async (documents, vectors) -> None
+        self._batch_size = batch_size
+        self._embed_workers = embed_workers
+        self._queue_size = queue_size
+
+    async def run(self, documents, on_batch=None) -> PipelineResult:
+        """
+        documentsはDocumentのlistかasyncのイテレータ。イテレータは読んだそばからバッチにして流すので、全チャンクをメモリに溜めない。
+        on_batch(done_batches, total_batches)は、バッチが1つ書き込まれる（または失敗する）たびに呼ばれる
+        （イテレータを読み終わるまでは、total_batchesはそれまでに作ったバッチの数）。
+        """
+        started = time.perf_counter()
+        result = PipelineResult()
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        write_queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        finished = 0
+        produced = 0
+
+        async def _finish(index:int, batch, stage:str = "", error:Exception | None = None):
+            nonlocal finished
+            finished += 1
+            if error is not None:
+                result.failures.append(BatchFailure(index, [d.id for d in batch], stage, str(error)))
+                logger.error(f"❌ Batch {index + 1}/{produced} failed to {stage}: {error}")
+            if on_batch:
+                await on_batch(finished, produced)
+
+        async def _produce():
+            nonlocal produced
+            async for batch in _batched(documents, self._batch_size):
+                result.total += len(batch)
+                produced += 1
+                await embed_queue.put((produced - 1, batch))
+            for _ in range(self._embed_workers):
+                await embed_queue.put(None)
+
+        async def _embed_worker():
+            while (item := await embed_queue.get()) is not None:
+                index, batch = item
+                embed_started = time.perf_counter()
+                try:
+                    vectors = await self._embed([d.page_content for d in batch])
+                except Exception as e:
+                    await _finish(index, batch, "embed", e)
+                    continue
+                finally:
+                    result.embedding_seconds += time.perf_counter() - embed_started
+                await write_queue.put((index, batch, vectors))
+
+        async def _writer():
+            while (item := await write_queue.get()) is not None:
+                index, batch, vectors = item
+                try:
+                    await self._write(batch, vectors)
+                except Exception as e:
+                    await _finish(index, batch, "write", e)
+                    continue
+                result.written += len(batch)
+                await _finish(index, batch)
+
+        writer = asyncio.create_task(_writer())
+        stages = [asyncio.create_task(_produce())] + [asyncio.create_task(_embed_worker()) for _ in range(self._embed_workers)]
+
+        async def _close():
+            await asyncio.gather(*stages)
+            await write_queue.put(None)
+
+        try:
+            # どこかのステージが予期せず落ちたら、残りも止める
+            await asyncio.gather(_close(), writer)
+        finally:
+            for task in stages + [writer]:
+                task.cancel()
+        result.seconds = time.perf_counter() - started
+        return result
+
+
 class Vectorstore:
-    def __init__(self, embedding_model:str, collection_name:str = "RaAG_docs"):
-        self._embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model)
-        self._connection_url = f"postgresql+psycopg2://{config.USER}:{config.PASSWORD}@{config.HOST}:{config.PORT}/{config.DBNAME}"
-        self._store = PGVector(
-            embeddings=self._embeddings,
-            collection_name=collection_name, # テーブル名のようなもの
-            connection=self._connection_url,
-            use_jsonb=True,
+    def __init__(self, embedding_model:str, collection_name:str = "RaAG_docs", bulk_insert:bool = config.VECTOR_BULK_INSERT, dimensions:int = config.EMBEDDING_DIMENSIONS, index_spec:IndexSpec | None = None, layout:VectorLayout | None = None):
+        # 同時に来た埋め込みはモデルごとに共有のバッチャーでまとめて送り、
+        # 同じテキストを二度APIに送らないよう、プロセス共通のメモを通す。
+        # APIの呼び出しは全て、プロセス共通のレート制限器を通る
+        batcher = get_embedding_batcher(
+            embedding_model,
+            lambda: RateLimitedEmbeddings(GoogleGenerativeAIEmbeddings(model=embedding_model)),
+            # 質問の埋め込みは対話中のユーザーを待たせているので、取り込みより先に通す
+            query_kwargs={"task_type": "RETRIEVAL_QUERY", "priority": Priority.INTERACTIVE},
         )
-        
-    
-    def add(self, chunks, batch_size:int, sleep_time:int):
+        # 次元を減らす時はモデル名に次元を付けて区別する（メモ・チャンクの指紋・スナップショットが別物になる）
+        embedding_id = embedding_model if dimensions == config.EMBEDDING_FULL_DIMENSIONS else f"{embedding_model}@{dimensions}"
+        self._embeddings = CachedEmbeddings(TruncatedEmbeddings(batcher, dimensions), model=embedding_id)
+        self._collection_name = collection_name
+        # エンジン(接続プール)は自分では作らず、プロセス共通のものを使う。
+        # 非同期用はpsycopg(v3)のドライバを使う。イベントループを止めずにDBへ問い合わせるため。
+        self._engines = get_engine_registry()
+        # PGVectorは生成時にDBへ接続しに行くので、実際に使う時まで作らない
+        self._sync_store = None
+        self._async_store = None
+        # Trueなら埋め込み済みのチャンクはCOPYで書き込む（1件ずつ書くSemanticCacheはFalse）
+        self._bulk_insert = bulk_insert
+        self._vector_type = None  # vector型のTypeInfo（DBごとに1回だけ問い合わせる）
+        self._registered_connections = weakref.WeakSet()
+        # ANN索引の設定。検索時のef_search/probesの既定値も持つ
+        self._layout = layout or VectorLayout(
+            dim=dimensions,
+            precision=config.VECTOR_PRECISION,
+            quantization=config.VECTOR_QUANTIZATION,
+            rerank_candidates=config.RERANK_CANDIDATES,
+        )
+        self._index_spec = index_spec or IndexSpec(**config.VECTOR_INDEX)
+        self._ef_search = config.HNSW_EF_SEARCH
+        self._probes = config.IVFFLAT_PROBES
+        self._collection_id = None
+
+    @property
+    def _store(self):
+        if self._sync_store is None:
+            self._sync_store = PGVector(
+                embeddings=self._embeddings,
+                collection_name=self._collection_name, # テーブル名のようなもの
+                connection=self._engines.engine(),
+                use_jsonb=True,
+            )
+        return self._sync_store
+
+    @property
+    def _astore(self):
+        if self._async_store is None:
+            self._async_store = PGVector(
+                embeddings=self._embeddings,
+                collection_name=self._collection_name,
+                connection=self._engines.async_engine(),
+                use_jsonb=True,
+                async_mode=True,
+            )
+        return self._async_store
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    @property
+    def embedding_model(self) -> str:
+        return self._embeddings.model
+
+    @property
+    def dimensions(self) -> int:
+        return self._layout.dim
+
+    async def aembed_query(self, text:str):
+        return await self._embeddings.aembed_query(text)
+
+    async def aembed_documents(self, texts:list[str]):
+        return await self._embeddings.aembed_documents(texts)
+
+    def add(self, chunks, batch_size:int = config.INGESTION_BATCH_SIZE):
+        # 同期版（CLI用）。ペース配分は固定の待機ではなく、429が返った時だけ指数バックオフで待つ
         try:
             logger.info(f"Adding {len(chunks)} chunks to vector store in batches of {batch_size}")
             for i in range(0, len(chunks), batch_size):
                 batch = chunks[i:i+batch_size]
                 logger.info(f"Processing batch {i//batch_size + 1}: {len(batch)} documents")
-                
-                # リトライロジック（API制限対策）
-                max_retries = 3
-                retry_delay = 30  # 30秒待機
-                
-                for attempt in range(max_retries):
+
+                retry_delay = 1
+                for attempt in range(config.RATE_LIMIT_MAX_RETRIES + 1):
                     try:
-                        self._store.add_documents(documents=batch)
+                        with VECTOR_STORE_SECONDS.labels(operation="write").time():
+                            self._store.add_documents(documents=batch)
+                        VECTOR_STORE_ROWS.inc(len(batch))
                         logger.info(f"Batch {i//batch_size + 1} added successfully")
                         break
                     except Exception as e:
-                        error_msg = str(e)
-                        if "429" in error_msg or "quota" in error_msg.lower():
-                            if attempt < max_retries - 1:
-                                logger.warning(f"⚠️ Rate limit hit. Waiting {retry_delay} seconds before retry {attempt + 1}/{max_retries}...")
-                                time.sleep(retry_delay)
-                                retry_delay *= 2  # 指数バックオフ
-                            else:
-                                logger.error(f"❌ Rate limit exceeded after {max_retries} retries")
-                                raise
-                        else:
+                        if not is_rate_limit_error(e) or attempt == config.RATE_LIMIT_MAX_RETRIES:
                             raise
-                
-                if i + batch_size < len(chunks):
-                    logger.info(f"Sleeping for {sleep_time} seconds...")
-                    sleep(sleep_time)
+                        logger.warning(f"⚠️ Rate limit hit. Waiting {retry_delay} seconds before retry {attempt + 1}/{config.RATE_LIMIT_MAX_RETRIES}...")
+                        sleep(retry_delay)
+                        retry_delay = min(retry_delay * 2, 60)
             logger.info(f"✅ All {len(chunks)} chunks added to vector store")
         except Exception as e:
             logger.error(f"❌ Error adding documents to vector store: {e}")
             raise
 
+    async def aadd(self, chunks, batch_size:int = config.INGESTION_BATCH_SIZE) -> PipelineResult:
+        # addの非同期版。埋め込みと書き込みをパイプラインで並行させる。
+        # 埋め込みAPIの呼び出しは共有のレート制限器が、クォータの許す限り速く通す
+        logger.info(f"Adding {len(chunks)} chunks to vector store in batches of {batch_size}")
+        result = await IngestionPipeline(self.aembed_documents, self.aadd_with_vectors, batch_size=batch_size).run(chunks)
+        if result.failures:
+            logger.error(f"❌ {result.failed}/{result.total} chunks failed to be added ({len(result.failures)} batches)")
+        else:
+            logger.info(f"✅ All {result.written} chunks added to vector store ({result.chunks_per_second:.1f} chunks/s)")
+        return result
+
+    @track(VECTOR_STORE_SECONDS, VECTOR_STORE_IN_FLIGHT, operation="write")
+    async def aadd_with_vectors(self, chunks, vectors):
+        # 埋め込み済みのベクトルをそのまま保存する（APIは呼ばない）
+        try:
+            if self._bulk_insert:
+                ids = await self.acopy_with_vectors(chunks, vectors)
+            else:
+                ids = await self._astore.aadd_embeddings(
+                    texts=[doc.page_content for doc in chunks],
+                    embeddings=vectors,
+                    metadatas=[doc.metadata for doc in chunks],
+                    ids=[doc.id for doc in chunks],
+                )
+            VECTOR_STORE_ROWS.inc(len(chunks))
+            return ids
+        except Exception as e:
+            logger.error(f"❌ Error adding documents to vector store: {e}")
+            raise
+
+    async def acopy_with_vectors(self, chunks, vectors):
+        """
+        COPY(バイナリ)で一時テーブルに流し込み、そこからupsertする。1バッチ = 1トランザクション。
+        書き込む列はPGVectorと同じなので、search/search_scoreからはそのまま読める。
+        """
+        await self._astore.__apost_init__()  # コレクションが無ければ作る
+        rows = _copy_rows(chunks, vectors)
+        async with self._astore.session_maker() as session:
+            collection = await self._astore.aget_collection(session)
+            if not collection:
+                raise ValueError("Collection not found")
+            raw = (await (await session.connection()).get_raw_connection()).driver_connection
+            await self._register_vector(raw)
+            async with raw.cursor() as cur:
+                await cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {_COPY_TABLE} (LIKE langchain_pg_embedding) ON COMMIT DELETE ROWS")
+                async with cur.copy(f"COPY {_COPY_TABLE} ({_COPY_COLUMNS}) FROM STDIN (FORMAT BINARY)") as copy:
+                    copy.set_types(["varchar", "uuid", "vector", "varchar", "jsonb"])
+                    for row_id, embedding, document, metadata in rows:
+                        await copy.write_row((row_id, collection.uuid, embedding, document, metadata))
+                await cur.execute(
+                    f"INSERT INTO langchain_pg_embedding ({_COPY_COLUMNS}) SELECT {_COPY_COLUMNS} FROM {_COPY_TABLE} "
+                    "ON CONFLICT (id) DO UPDATE SET embedding = EXCLUDED.embedding, document = EXCLUDED.document, cmetadata = EXCLUDED.cmetadata"
+                )
+            await session.commit()
+        return [row[0] for row in rows]
+
+    async def _register_vector(self, raw):
+        # COPYでvector型をバイナリのまま送れるよう、接続にpgvectorの型を登録する
+        if raw in self._registered_connections:
+            return
+        if self._vector_type is None:
+            self._vector_type = await TypeInfo.fetch(raw, "vector")
+        register_vector_info(raw, self._vector_type)
+        self._registered_connections.add(raw)
+
+    @track(VECTOR_STORE_SECONDS, VECTOR_STORE_IN_FLIGHT, operation="search")
     def search(self, query:str, k:int):
         return self._store.similarity_search(query=query, k=k)
 
+    @track(VECTOR_STORE_SECONDS, VECTOR_STORE_IN_FLIGHT, operation="search")
     def search_score(self, query:str, k:int):
-        return self._store.similarity_search_with_score(query=query, k=k)
\ No newline at end of file
+        return self._store.similarity_search_with_score(query=query, k=k)
+
+    async def asearch(self, query:str, k:int, ef_search:int | None = None, probes:int | None = None):
+        return [doc for doc, _ in await self.asearch_score(query, k, ef_search=ef_search, probes=probes)]
+
+    async def asearch_score(self, query:str, k:int, ef_search:int | None = None, probes:int | None = None):
+        vector = await self.aembed_query(query)
+        return await self.asearch_score_by_vector(vector, k, ef_search=ef_search, probes=probes)
+
+    async def asearch_by_vector(self, vector, k:int, ef_search:int | None = None, probes:int | None = None):
+        return [doc for doc, _ in await self.asearch_score_by_vector(vector, k, ef_search=ef_search, probes=probes)]
+
+    @track(VECTOR_STORE_SECONDS, VECTOR_STORE_IN_FLIGHT, operation="search")
+    async def asearch_score_by_vector(self, vector, k:int, ef_search:int | None = None, probes:int | None = None):
+        """
+        (Document, コサイン距離)を近い順にk件。ef_search(HNSW)/probes(IVFFlat)を大きくすると
+        再現率が上がり、遅くなる。省略時はconfigの値を使う。索引が無ければ全件を正確に比べる。
+        """
+        rows = await self._aknn(vector, k, ef_search, probes, with_vectors=False)
+        return [
+            (Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {}), row.distance)
+            for row in rows
+        ]
+
+    @track(VECTOR_STORE_SECONDS, VECTOR_STORE_IN_FLIGHT, operation="search")
+    async def asearch_with_vectors(self, vector, k:int, ef_search:int | None = None, probes:int | None = None):
+        """
+        asearch_score_by_vectorと同じ検索で、(Document, コサイン距離, ベクトル)を返す。
+        検索結果の重複を落とすのにベクトルが要る時は、aget_vectorsで同じ行を読み直さずにこちらを使う。
+        """
+        rows = await self._aknn(vector, k, ef_search, probes, with_vectors=True)
+        return [
+            (Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {}), row.distance, row.embedding)
+            for row in rows
+        ]
+
+    async def _aknn(self, vector, k:int, ef_search:int | None, probes:int | None, with_vectors:bool):
+        collection_id = await self._acollection_id()
+        columns = dict(id=String(), document=String(), cmetadata=JSONB(), distance=Float())
+        if with_vectors:
+            columns["embedding"] = Vector()
+        stmt = text(knn_sql(collection_id, self._layout, with_vectors=with_vectors)).columns(**columns)
+        async with self._astore.session_maker() as session:
+            for statement in tuning_sql(ef_search or self._ef_search, probes or self._probes):
+                await session.execute(text(statement))
+            return (await session.execute(stmt, knn_params(vector, k, self._layout))).all()
+
+    async def _acollection_id(self):
+        # コレクションのUUIDは変わらないので、プロセスで最初の1回だけ問い合わせる（同じコレクションの他のインスタンスとも共有）
+        if self._collection_id is None:
+            engine = self._astore._async_engine
+            self._collection_id = await self._engines.collection_id(engine.url, self._collection_name, self._aload_collection_id)
+        return self._collection_id
+
+    async def _aload_collection_id(self):
+        await self._astore.__apost_init__()
+        async with self._astore.session_maker() as session:
+            collection = await self._astore.aget_collection(session)
+        if not collection:
+            raise ValueError("Collection not found")
+        return collection.uuid
+
+    async def _aexecute_autocommit(self, sql:str):
+        # CREATE/DROP INDEX CONCURRENTLYはトランザクションの外でしか実行できない
+        async with self._astore._async_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(sql))
+
+    async def aensure_index(self, spec:IndexSpec | None = None):
+        """
+        このコレクションのANN索引が無ければ作る。CONCURRENTLYで作るので、作っている間も読み書きできる。
+        HNSWは追加された行も自動で索引に入る。IVFFlatはクラスタが行数に合わなくなったらarebuild_indexで作り直す。
+        """
+        spec = spec or self._index_spec
+        collection_id = await self._acollection_id()
+        rows = 0
+        if spec.method == "ivfflat" and spec.lists is None:
+            async with self._astore.session_maker() as session:
+                rows = (await session.execute(
+                    text("SELECT count(*) FROM langchain_pg_embedding WHERE collection_id = :cid"), {"cid": collection_id}
+                )).scalar_one()
+        started = time.perf_counter()
+        logger.info(f"🔨 Building {spec.method} index for {self._collection_name}...")
+        await self._aexecute_autocommit(create_index_sql(collection_id, self._layout, spec, rows=rows))
+        logger.info(f"✅ {spec.method} index for {self._collection_name} is ready ({time.perf_counter() - started:.1f}s)")
+
+    async def arebuild_index(self, spec:IndexSpec | None = None):
+        spec = spec or self._index_spec
+        collection_id = await self._acollection_id()
+        await self._aexecute_autocommit(drop_index_sql(collection_id, spec.method, self._layout))
+        await self.aensure_index(spec)
+
+    async def aindex_status(self, method:str | None = None) -> dict:
+        """索引の有無・使えるか・作成中なら進み具合を返す"""
+        method = method or self._index_spec.method
+        name = index_name(await self._acollection_id(), method, self._layout)
+        status = {"name": name, "method": method, "exists": False, "valid": False, "building": False, "phase": None, "progress": None}
+        async with self._astore.session_maker() as session:
+            row = (await session.execute(text(
+                "SELECT i.indisvalid, i.indisready, p.phase, p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total "
+                "FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "LEFT JOIN pg_stat_progress_create_index p ON p.index_relid = c.oid "
+                "WHERE c.relname = :name"
+            ), {"name": name})).first()
+        if row is None:
+            return status
+        status.update(exists=True, valid=bool(row.indisvalid), building=row.phase is not None, phase=row.phase)
+        if row.phase is not None:
+            done, total = (row.tuples_done, row.tuples_total) if row.tuples_total else (row.blocks_done, row.blocks_total)
+            status["progress"] = done / total if total else None
+        return status
+
+    async def _aselect_with_vectors(self, where:str = "", params:dict | None = None):
+        stmt = text(
+            "SELECT e.id, e.document, e.cmetadata, e.embedding "
+            "FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+            "WHERE c.name = :name" + where
+        ).columns(id=String(), document=String(), cmetadata=JSONB(), embedding=Vector())
+        async with self._astore.session_maker() as session:
+            rows = (await session.execute(stmt, {"name": self._collection_name, **(params or {})})).all()
+        return [
+            (Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {}), row.embedding)
+            for row in rows
+        ]
+
+    async def aget_all_with_vectors(self):
+        # コレクション内の全ての行を (Document, ベクトル) で取り出す（起動時の読み込み用）
+        return await self._aselect_with_vectors()
+
+    async def aget_by_metadata(self, key:str, values:list):
+        # メタデータのkeyがvaluesのどれかに一致する行を (Document, ベクトル) で取り出す
+        if not values:
+            return []
+        return await self._aselect_with_vectors(
+            " AND e.cmetadata ->> :key = ANY(:values)",
+            {"key": key, "values": [str(v) for v in values]},
+        )
+
+    async def aget_ids_by_metadata(self, key:str, values:list) -> list[str]:
+        # メタデータのkeyがvaluesのどれかに一致する行のIDだけを取り出す（ベクトルは読まない。スナップショットとの照合用）
+        if not values:
+            return []
+        stmt = text(
+            "SELECT e.id FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+            "WHERE c.name = :name AND e.cmetadata ->> :key = ANY(:values)"
+        )
+        async with self._astore.session_maker() as session:
+            rows = (await session.execute(stmt, {"name": self._collection_name, "key": key, "values": [str(v) for v in values]})).all()
+        return [row.id for row in rows]
+
+    async def aget_metadata(self, key:str, values:list) -> dict:
+        # メタデータのkeyがvaluesのどれかに一致する行を{ID: メタデータ}で取り出す（ベクトルは読まない。取り込みの差分を調べる用）
+        if not values:
+            return {}
+        stmt = text(
+            "SELECT e.id, e.cmetadata FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+            "WHERE c.name = :name AND e.cmetadata ->> :key = ANY(:values)"
+        ).columns(id=String(), cmetadata=JSONB())
+        async with self._astore.session_maker() as session:
+            rows = (await session.execute(stmt, {"name": self._collection_name, "key": key, "values": [str(v) for v in values]})).all()
+        return {row.id: row.cmetadata or {} for row in rows}
+
+    async def aget_collection_counter(self, key:str) -> int:
+        """コレクションのメタデータに保存した数(コーパスの版など)。無ければ0"""
+        await self._astore.__apost_init__()  # コレクションが無ければ作る
+        async with self._astore.session_maker() as session:
+            value = (await session.execute(
+                text("SELECT (cmetadata ->> :key)::bigint FROM langchain_pg_collection WHERE name = :name"),
+                {"key": key, "name": self._collection_name},
+            )).scalar_one_or_none()
+        return int(value or 0)
+
+    async def aincrement_collection_counter(self, key:str) -> int:
+        """コレクションのメタデータに保存した数を1つ上げ、上げた後の値を返す（1回のUPDATEなので同時に上げても数え漏れない）"""
+        await self._astore.__apost_init__()
+        async with self._astore.session_maker() as session:
+            value = (await session.execute(
+                text(
+                    "UPDATE langchain_pg_collection "
+                    "SET cmetadata = (coalesce(cmetadata::jsonb, '{}'::jsonb) "
+                    "|| jsonb_build_object(CAST(:key AS text), coalesce((cmetadata ->> :key)::bigint, 0) + 1))::json "
+                    "WHERE name = :name RETURNING (cmetadata ->> :key)::bigint"
+                ),
+                {"key": key, "name": self._collection_name},
+            )).scalar_one()
+            await session.commit()
+        return int(value)
+
+    async def aget_vectors(self, ids:list[str]) -> dict:
+        # 検索で取れた文書のベクトルを{ID: ベクトル}で取り出す（検索結果の重複を落とす時用）
+        if not ids:
+            return {}
+        rows = await self._aselect_with_vectors(" AND e.id = ANY(:ids)", {"ids": list(ids)})
+        return {doc.id: vector for doc, vector in rows}
+
+    async def adelete(self, ids:list[str]):
+        if ids:
+            await self._astore.adelete(ids=ids)
+
+    async def aupdate_metadata(self, patches:dict):
+        """{ID: 上書きするメタデータ}を1回のUPDATEでまとめて反映する（キー単位で上書きし、他のキーは残す）"""
+        if not patches:
+            return
+        stmt = text(
+            "UPDATE langchain_pg_embedding AS e SET cmetadata = coalesce(e.cmetadata, '{}'::jsonb) || v.patch::jsonb "
+            "FROM unnest(CAST(:ids AS varchar[]), CAST(:patches AS text[])) AS v(id, patch) "
+            "WHERE e.id = v.id"
+        )
+        async with self._astore.session_maker() as session:
+            await session.execute(stmt, {"ids": list(patches), "patches": [json.dumps(p) for p in patches.values()]})
+            await session.commit()
+
+    async def avacuum(self):
+        """まとめて削除した後に、空いた領域を再利用できるようにし、統計を取り直す"""
+        await self._aexecute_autocommit("VACUUM (ANALYZE) langchain_pg_embedding")
+
+
+def _copy_rows(chunks, vectors):
+    """COPYで送る (id, ベクトル, 本文, メタデータ) の行を作る。IDが無いチャンクにはPGVectorと同じくuuid4を振る"""
+    if len(chunks) != len(vectors):
+        raise ValueError("chunksとvectorsの数が一致しません")
+    return [
+        (doc.id or str(uuid.uuid4()), np.asarray(vector, dtype=np.float32), doc.page_content, Jsonb(doc.metadata or {}))
+        for doc, vector in zip(chunks, vectors)
+    ]
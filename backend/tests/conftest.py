@@ -25,10 +25,27 @@ def mock_vector_db():
         Document(page_content="これはテスト用のドキュメントAです。"),
         Document(page_content="これはテスト用のドキュメントBです。")
     ]
+    # 非同期版の検索も同じダミーデータを返す
+    db.asearch = AsyncMock(return_value=db.search.return_value)
+    db.asearch_by_vector = AsyncMock(return_value=db.search.return_value)
+    # 距離が遠いので、HyDEを飛ばす判断にはならない
+    db.asearch_score_by_vector = AsyncMock(return_value=[(doc, 0.5) for doc in db.search.return_value])
+    # 検索と一緒にベクトルも返す版（ChatBotはこちらを使う）
+    db.asearch_with_vectors = AsyncMock(return_value=[(doc, 0.5, [0.0]) for doc in db.search.return_value])
+    db.aembed_query = AsyncMock(return_value=[0.1, 0.2, 0.3])
+    db.aget_vectors = AsyncMock(return_value={})
     return db
 
+# 偽のSemanticCache（常にキャッシュミスする）
 @pytest.fixture
-def mock_chatbot(mock_vector_db):
+def mock_cache():
+    cache = AsyncMock()
+    cache._check.return_value = None
+    cache.stats = MagicMock(return_value={})
+    return cache
+
+@pytest.fixture
+def mock_chatbot(mock_vector_db, mock_cache):
     """正常系のテスト: ChatBot.runが期待通りに動作するか"""
     # 準備
     with patch("src.bot.init_chat_model") as mock_init_chat_model,\
@@ -44,10 +61,11 @@ def mock_chatbot(mock_vector_db):
             template = template,
             hyde_template = hyde_template,
             vector_db = mock_vector_db,
+            cache = mock_cache,
         )
 
-        bot._hyde_chain = MagicMock()
-        bot._hyde_chain.invoke.return_value = "事前生成のクエリ。"
+        bot._hyde_chain = AsyncMock()
+        bot._hyde_chain.ainvoke.return_value = "事前生成のクエリ。"
 
         bot._graph = AsyncMock()
         bot._graph.ainvoke.return_value = {"answer": "テスト成功です！"}
@@ -0,0 +1,142 @@
+# ここでテストしたいこと
+# コレクションごとの部分索引を、次元を固定した式(2000次元を超えたらhalfvec)に張ること
+# 検索のSQLが索引と同じ式で並べ替えること（そうでないと索引が使われない）
+# ef_search/probesを指定した時だけ、そのトランザクション内で設定を変えること
+# Vectorstoreの検索が設定→検索の順にSQLを流し、(Document, 距離)を返すこと
+# ベクトルも要る時は、同じ検索のSQLで行のベクトルも一緒に返すこと
+# halfvecを選べば2000次元以下でもhalfvecの索引にすること
+# 二値化の時は、ビット列の索引で候補を拾ってから元の精度で並べ直すこと
+# 次元が違う行は索引にも検索にも入らないこと
+
+import uuid
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.ann_index import IndexSpec, VectorLayout, create_index_sql, index_name, knn_params, knn_sql, tuning_sql, vector_literal, vector_type
+from src.vector_store import Vectorstore
+
+COLLECTION = uuid.UUID("12345678-1234-5678-1234-567812345678")
+
+
+@pytest.mark.parametrize("dim, expected", [(768, "vector"), (2000, "vector"), (3072, "halfvec")])
+def test_次元に応じてvectorかhalfvecを使うこと(dim, expected):
+    assert vector_type(dim) == expected
+
+
+def test_4000次元を超えると索引を張れないこと():
+    with pytest.raises(ValueError):
+        vector_type(4001)
+
+
+def test_HNSWの部分索引を作るSQL():
+    sql = create_index_sql(COLLECTION, VectorLayout(dim=3072), IndexSpec(method="hnsw", m=24, ef_construction=100))
+
+    assert sql.startswith(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(COLLECTION, 'hnsw')} ")
+    assert "USING hnsw ((embedding::halfvec(3072)) halfvec_cosine_ops)" in sql
+    assert "WITH (m = 24, ef_construction = 100)" in sql
+    assert sql.endswith(f"WHERE collection_id = '{COLLECTION}'::uuid AND vector_dims(embedding) = 3072")
+
+
+def test_IVFFlatのクラスタ数は指定が無ければ行数から決めること():
+    assert "WITH (lists = 50)" in create_index_sql(COLLECTION, VectorLayout(dim=768), IndexSpec(method="ivfflat"), rows=50_000)
+    assert "WITH (lists = 1)" in create_index_sql(COLLECTION, VectorLayout(dim=768), IndexSpec(method="ivfflat"), rows=10)
+    assert "WITH (lists = 7)" in create_index_sql(COLLECTION, VectorLayout(dim=768), IndexSpec(method="ivfflat", lists=7), rows=50_000)
+
+
+def test_未対応の索引はエラーになること():
+    with pytest.raises(ValueError):
+        IndexSpec(method="diskann")
+
+
+def test_検索のSQLは索引と同じ式で並べ替えること():
+    sql = knn_sql(COLLECTION, VectorLayout(dim=3072))
+    assert "ORDER BY (embedding::halfvec(3072)) <=> CAST(:query AS halfvec(3072)) LIMIT :k" in sql
+    assert f"WHERE collection_id = '{COLLECTION}'::uuid AND vector_dims(embedding) = 3072" in sql
+
+
+def test_halfvecを選べば2000次元以下でもhalfvecの索引にすること():
+    layout = VectorLayout(dim=768, precision="halfvec")
+    assert "USING hnsw ((embedding::halfvec(768)) halfvec_cosine_ops)" in create_index_sql(COLLECTION, layout, IndexSpec())
+    assert "CAST(:query AS halfvec(768))" in knn_sql(COLLECTION, layout)
+    with pytest.raises(ValueError):
+        VectorLayout(dim=3072, precision="vector").type
+
+
+def test_二値化の時はビット列の索引で候補を拾ってから並べ直すこと():
+    layout = VectorLayout(dim=3072, quantization="binary", rerank_candidates=50)
+
+    index = create_index_sql(COLLECTION, layout, IndexSpec())
+    assert "USING hnsw ((binary_quantize(embedding)::bit(3072)) bit_hamming_ops)" in index
+    assert index_name(COLLECTION, "hnsw", layout) != index_name(COLLECTION, "hnsw")
+
+    sql = knn_sql(COLLECTION, layout)
+    assert "ORDER BY (binary_quantize(embedding)::bit(3072)) <~> binary_quantize(CAST(:query AS halfvec(3072))) LIMIT :candidates" in sql
+    assert sql.endswith(") candidates ORDER BY distance LIMIT :k")
+    assert knn_params([1.0], k=5, layout=layout)["candidates"] == 50
+    assert knn_params([1.0], k=80, layout=layout)["candidates"] == 80
+
+
+def test_ef_searchとprobesは指定した時だけ設定すること():
+    assert tuning_sql() == []
+    assert tuning_sql(ef_search=100) == ["SET LOCAL hnsw.ef_search = 100"]
+    assert tuning_sql(probes=5) == ["SET LOCAL ivfflat.probes = 5"]
+
+
+def test_ベクトルを文字列にすること():
+    assert vector_literal([1, 0.5]) == "[1.0,0.5]"
+
+
+@pytest.mark.asyncio
+async def test_検索は設定してから索引を使うSQLを流すこと():
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), patch("src.vector_store.PGVector") as MockVectorStore:
+        session = MagicMock()
+        result = MagicMock()
+        result.all.return_value = [SimpleNamespace(id="a", document="本文", cmetadata={"page": 1}, distance=0.1)]
+        session.execute = AsyncMock(return_value=result)
+        session_cm = MagicMock()
+        session_cm.__aenter__ = AsyncMock(return_value=session)
+        session_cm.__aexit__ = AsyncMock(return_value=False)
+        MockVectorStore.return_value.session_maker = MagicMock(return_value=session_cm)
+
+        db = Vectorstore(embedding_model="dummy-model", dimensions=4)
+        assert db.embedding_model == "dummy-model@4"
+        db._collection_id = COLLECTION
+        found = await db.asearch_score_by_vector([0.1, 0.2, 0.3, 0.4], k=3, ef_search=80, probes=3)
+
+    statements = [str(call.args[0]) for call in session.execute.await_args_list]
+    assert statements[:2] == ["SET LOCAL hnsw.ef_search = 80", "SET LOCAL ivfflat.probes = 3"]
+    assert "ORDER BY (embedding::vector(4)) <=>" in statements[2]
+    assert session.execute.await_args_list[2].args[1] == {"query": "[0.1,0.2,0.3,0.4]", "k": 3}
+    doc, distance = found[0]
+    assert (doc.id, doc.page_content, doc.metadata, distance) == ("a", "本文", {"page": 1}, 0.1)
+
+
+def test_ベクトルも要る時は検索のSQLで一緒に返すこと():
+    assert "SELECT id, document, cmetadata, embedding, " in knn_sql(COLLECTION, VectorLayout(dim=768), with_vectors=True)
+    assert "embedding, " not in knn_sql(COLLECTION, VectorLayout(dim=768)).split("FROM")[0]
+    binary = knn_sql(COLLECTION, VectorLayout(dim=3072, quantization="binary"), with_vectors=True)
+    assert binary.startswith("SELECT id, document, cmetadata, embedding, ")
+
+
+@pytest.mark.asyncio
+async def test_ベクトル付きの検索は1回のSQLで行のベクトルも返すこと():
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), patch("src.vector_store.PGVector") as MockVectorStore:
+        session = MagicMock()
+        result = MagicMock()
+        result.all.return_value = [SimpleNamespace(id="a", document="本文", cmetadata={"page": 1}, distance=0.1, embedding=[0.5, 0.5, 0.5, 0.5])]
+        session.execute = AsyncMock(return_value=result)
+        session_cm = MagicMock()
+        session_cm.__aenter__ = AsyncMock(return_value=session)
+        session_cm.__aexit__ = AsyncMock(return_value=False)
+        MockVectorStore.return_value.session_maker = MagicMock(return_value=session_cm)
+
+        db = Vectorstore(embedding_model="dummy-model", dimensions=4)
+        db._collection_id = COLLECTION
+        found = await db.asearch_with_vectors([0.1, 0.2, 0.3, 0.4], k=3)
+
+    searches = [str(call.args[0]) for call in session.execute.await_args_list if "langchain_pg_embedding" in str(call.args[0])]
+    assert len(searches) == 1
+    assert "SELECT id, document, cmetadata, embedding, " in searches[0]
+    doc, distance, vector = found[0]
+    assert (doc.id, distance, vector) == ("a", 0.1, [0.5, 0.5, 0.5, 0.5])
+
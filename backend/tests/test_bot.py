@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 
 # ここでは @pytest.mark.asyncio が必要
@@ -6,7 +7,7 @@ async def test_bot_run_flow(mock_chatbot): # 工場の名前(mock_chatbot)を指
     # 準備は完了しているので、いきなり実行できる
     answer = await mock_chatbot.run("こんにちは")
     
-    assert answer == "テスト成功です！"
+    assert answer.answer == "テスト成功です！"
 
 
 
@@ -15,3 +16,286 @@ async def test_bot_run_flow(mock_chatbot): # 工場の名前(mock_chatbot)を指
 
         
     
+@pytest.mark.asyncio
+async def test_グラフ全体が非同期で実行されること(mock_chatbot, mock_vector_db):
+    # 準備: モック化されたグラフを本物に戻す
+    from langchain_core.messages import AIMessage
+    mock_chatbot._llm.ainvoke.return_value = AIMessage(content="グラフの回答です。")
+    mock_chatbot._graph = mock_chatbot._graph_builder()
+
+    # 実行
+    answer = await mock_chatbot.run("こんにちは")
+
+    # 検証: HyDEと検索がどちらも非同期版で呼ばれていること
+    assert answer.answer == "グラフの回答です。"
+    mock_chatbot._hyde_chain.ainvoke.assert_awaited_once()
+    mock_vector_db.aembed_query.assert_any_await("事前生成のクエリ。")  # HyDEの文書を埋め込んで検索する
+    mock_vector_db.search.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_質問の埋め込みがキャッシュの検索と登録で使い回されること(mock_chatbot, mock_vector_db, mock_cache):
+    # 実行
+    await mock_chatbot.run("こんにちは")
+
+    # 検証: 埋め込みは1回だけで、同じベクトルが検索と登録の両方に渡されること
+    mock_vector_db.aembed_query.assert_awaited_once_with("こんにちは")
+    assert mock_cache._check.await_args.kwargs["vector"] == [0.1, 0.2, 0.3]
+    assert mock_cache.add_question_answer.await_args.kwargs["vector"] == [0.1, 0.2, 0.3]
+
+@pytest.mark.asyncio
+async def test_同じ質問が同時に来たらパイプラインは1回だけ走ること(mock_chatbot):
+    import asyncio
+
+    answers = await asyncio.gather(
+        mock_chatbot.run("ともちゃんは誰？"),
+        mock_chatbot.run("ともちゃんは誰？ "),
+    )
+
+    assert answers[0] is answers[1]
+    mock_chatbot._graph.ainvoke.assert_awaited_once()
+    # 相乗りの回数は/health/cacheと/metricsから見える
+    assert mock_chatbot.cache_stats()["singleflight"] == {"in_flight": 0, "executions": 1, "collapsed": 1}
+
+@pytest.mark.asyncio
+async def test_並列モードではHyDEと質問そのままでの検索の結果が混ざること(mock_chatbot, mock_vector_db):
+    from langchain_core.documents import Document
+    hyde_results = [(Document(page_content="HyDE1"), 0.5, [0.0]), (Document(page_content="共通"), 0.6, [0.0])]
+    raw_results = [(Document(page_content="共通"), 0.5, [0.0]), (Document(page_content="質問1"), 0.6, [0.0])]
+    mock_vector_db.aembed_query.side_effect = lambda text: [0.9, 0.1]  # HyDEの文書のベクトル
+    mock_vector_db.asearch_with_vectors.side_effect = lambda vector, k: hyde_results if vector == [0.9, 0.1] else raw_results
+
+    result = await mock_chatbot._speculative_retrieve({"question": "こんにちは", "question_vector": [0.1, 0.2, 0.3]})
+
+    # 両方に出てきた文書が先頭に来て、重複はしない
+    assert [d.page_content for d in result["context"]] == ["共通", "HyDE1", "質問1"]
+    assert result["pre_query"] == "事前生成のクエリ。"
+    mock_vector_db.asearch_with_vectors.assert_any_await([0.1, 0.2, 0.3], k=5)
+    assert {"hyde_ms", "raw_retrieve_ms", "hyde_retrieve_ms", "retrieve_ms"} <= result["timings"].keys()
+
+@pytest.mark.asyncio
+async def test_HyDEが期限に間に合わなければ質問そのままでの検索結果だけを使うこと(mock_chatbot, mock_vector_db):
+    import asyncio
+    from langchain_core.documents import Document
+
+    async def slow_hyde(_):
+        await asyncio.sleep(5)
+        return "間に合わないクエリ"
+    mock_chatbot._hyde_chain.ainvoke.side_effect = slow_hyde
+    mock_chatbot._hyde_deadline = 0.05
+    mock_vector_db.asearch_with_vectors.return_value = [(Document(page_content="質問1"), 0.5, [0.0])]
+
+    result = await asyncio.wait_for(
+        mock_chatbot._speculative_retrieve({"question": "こんにちは", "question_vector": [0.1]}), timeout=1
+    )
+
+    assert [d.page_content for d in result["context"]] == ["質問1"]
+    assert result["timings"]["hyde_timed_out"] is True
+    mock_vector_db.aembed_query.assert_not_awaited()  # HyDEの文書の検索までたどり着かない
+
+@pytest.mark.asyncio
+async def test_HyDEの枠が一杯で断られたら質問そのままでの検索結果だけを使うこと(mock_chatbot, mock_vector_db):
+    from contextlib import asynccontextmanager
+    from unittest.mock import MagicMock
+    from langchain_core.documents import Document
+    from src.scheduler import Overloaded
+
+    class FullScheduler:
+        @asynccontextmanager
+        async def slot(self, pool):
+            raise Overloaded(f"{pool} is overloaded (queue_full)", 429, 1)
+            yield
+    mock_chatbot._scheduler = FullScheduler()
+    mock_chatbot._logger = MagicMock()
+    mock_vector_db.asearch_with_vectors.return_value = [(Document(page_content="質問1"), 0.9, [0.0])]
+
+    result = await mock_chatbot._speculative_retrieve({"question": "こんにちは", "question_vector": [0.1]})
+
+    # エラーではなく、わざと落としたものとして記録する
+    assert [d.page_content for d in result["context"]] == ["質問1"]
+    assert result["timings"]["hyde_shed"] is True
+    mock_chatbot._logger.error.assert_not_called()
+
+    # 質問そのままでの検索も失敗していたら、答えずに429で断る
+    mock_vector_db.asearch_with_vectors.side_effect = RuntimeError("DBが落ちた")
+    with pytest.raises(Overloaded):
+        await mock_chatbot._speculative_retrieve({"question": "こんにちは", "question_vector": [0.2]})
+
+@pytest.mark.asyncio
+async def test_LLMが429を返したらレート制限器に伝えてやり直すこと(mock_chatbot):
+    from langchain_core.documents import Document
+    from langchain_core.messages import AIMessage
+    from src.rate_limiter import RateLimiter
+
+    class ResourceExhausted(Exception):
+        code = 429
+    limiter = RateLimiter("llm-test", requests_per_minute=6000, tokens_per_minute=1_000_000, max_concurrency=2, min_backoff=0.0)
+    mock_chatbot._llm_limiter = limiter
+    mock_chatbot._llm.ainvoke.side_effect = [ResourceExhausted("quota"), AIMessage(content="やり直した回答です。")]
+
+    answer = await mock_chatbot._answer("こんにちは", [Document(page_content="本文")])
+
+    assert answer == "やり直した回答です。"
+    assert limiter.rate_limited == 1
+    assert limiter.retries == 1
+
+@pytest.mark.asyncio
+async def test_HyDEを飛ばすかの判断を待たずにHyDEを始めること(mock_chatbot, mock_vector_db):
+    import asyncio
+    from langchain_core.documents import Document
+    hyde_started = asyncio.Event()
+
+    async def hyde(_):
+        hyde_started.set()
+        return "事前生成のクエリ。"
+
+    async def search(vector, k):
+        if vector == [0.1]:
+            # 質問そのままでの検索は、HyDEが始まるまで終わらない（順番に走らせていたら止まる）
+            await hyde_started.wait()
+        return [(Document(page_content="質問1"), 0.5, [0.0])]
+    mock_chatbot._hyde_chain.ainvoke.side_effect = hyde
+    mock_vector_db.asearch_with_vectors.side_effect = search
+    assert mock_chatbot._gate is not None
+
+    result = await asyncio.wait_for(mock_chatbot._speculative_retrieve({"question": "こんにちは", "question_vector": [0.1]}), timeout=1)
+
+    assert result["hyde_bypassed"] is False
+    assert result["pre_query"] == "事前生成のクエリ。"
+
+@pytest.mark.asyncio
+async def test_検索で一緒に取ったベクトルで詰めるのでDBへ読み直しに行かないこと(mock_chatbot, mock_vector_db):
+    from langchain_core.documents import Document
+    docs = [Document(id="1", page_content="A"), Document(id="2", page_content="B")]
+    mock_vector_db.asearch_with_vectors.return_value = [(docs[0], 0.5, [1.0, 0.0]), (docs[1], 0.6, [0.0, 1.0])]
+
+    state = await mock_chatbot._speculative_retrieve({"question": "こんにちは", "question_vector": [0.1]})
+    assert state["context_vectors"] == {"1": [1.0, 0.0], "2": [0.0, 1.0]}
+    await mock_chatbot._pack(state["context"], state["context_vectors"])
+    mock_vector_db.aget_vectors.assert_not_awaited()
+
+    # 検索で取れていない文書の分だけDBから読む
+    await mock_chatbot._pack(state["context"] + [Document(id="3", page_content="C")], state["context_vectors"])
+    mock_vector_db.aget_vectors.assert_awaited_once_with(["3"])
+
+@pytest.mark.asyncio
+async def test_順番モードではHyDEの後に検索すること(mock_vector_db, mock_cache):
+    from unittest.mock import AsyncMock, patch
+    from langchain_core.messages import AIMessage
+    from src.bot import ChatBot
+    with patch("src.bot.init_chat_model") as mock_init_chat_model, patch("src.bot.PromptTemplate"):
+        mock_init_chat_model.return_value = AsyncMock()
+        bot = ChatBot(template="{question}", hyde_template="{question}", vector_db=mock_vector_db, cache=mock_cache, retrieval_mode="sequential")
+    bot._hyde_chain = AsyncMock()
+    bot._hyde_chain.ainvoke.return_value = "事前生成のクエリ。"
+    bot._llm.ainvoke.return_value = AIMessage(content="順番の回答です。")
+
+    answer = await bot.run("こんにちは")
+
+    assert answer.answer == "順番の回答です。"
+    mock_vector_db.aembed_query.assert_any_await("事前生成のクエリ。")
+    # HyDEを飛ばすかの判断と、HyDEの文書での検索。同じベクトルなので2回目は検索結果の段に当たる
+    mock_vector_db.asearch_with_vectors.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_順番モードでHyDEを飛ばす判断をしなくても確かめ直し用の検索結果は記録すること(mock_vector_db, mock_cache, monkeypatch):
+    from unittest.mock import AsyncMock, patch
+    from langchain_core.documents import Document
+    from langchain_core.messages import AIMessage
+    from src import config
+    from src.bot import ChatBot
+    monkeypatch.setattr(config, "HYDE_BYPASS", False)
+    mock_vector_db.asearch_with_vectors.return_value = [(Document(id="1", page_content="質問1"), 0.5, [0.0])]
+    with patch("src.bot.init_chat_model") as mock_init_chat_model, patch("src.bot.PromptTemplate"):
+        mock_init_chat_model.return_value = AsyncMock()
+        bot = ChatBot(template="{question}", hyde_template="{question}", vector_db=mock_vector_db, cache=mock_cache, retrieval_mode="sequential")
+    assert bot._gate is None
+    bot._hyde_chain = AsyncMock()
+    bot._hyde_chain.ainvoke.return_value = "事前生成のクエリ。"
+    bot._llm.ainvoke.return_value = AIMessage(content="回答です。")
+
+    await bot.run("こんにちは")
+
+    # probe_idsが空だと、コーパスが変わった時に確かめ直せずに捨てられてしまう
+    assert mock_cache.add_question_answer.await_args.kwargs["probe_ids"] == ["1"]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["parallel", "sequential"])
+async def test_質問そのままで十分に近い文書が取れたらHyDEを飛ばすこと(mock_vector_db, mock_cache, mode):
+    from unittest.mock import AsyncMock, patch
+    from langchain_core.documents import Document
+    from langchain_core.messages import AIMessage
+    from src.bot import ChatBot
+    from src.hyde_gate import HydeGate
+    mock_vector_db.asearch_with_vectors.return_value = [
+        (Document(page_content="ぴったりの文書"), 0.05, [0.0]), (Document(page_content="遠い文書"), 0.4, [0.0]),
+    ]
+    gate = HydeGate(max_distance=0.2, margin=0.1, audit_every=1)
+    with patch("src.bot.init_chat_model") as mock_init_chat_model, patch("src.bot.PromptTemplate"):
+        mock_init_chat_model.return_value = AsyncMock()
+        bot = ChatBot(template="{question}", hyde_template="{question}", vector_db=mock_vector_db, cache=mock_cache, retrieval_mode=mode, hyde_gate=gate)
+    finished = []
+
+    async def hyde(_):
+        await asyncio.sleep(0.01)
+        finished.append(True)
+        return "事前生成のクエリ。"
+    bot._hyde_chain = AsyncMock()
+    bot._hyde_chain.ainvoke.side_effect = hyde
+    bot._llm.ainvoke.return_value = AIMessage(content="回答です。")
+
+    answer = await bot.run("ぴったりの言葉")
+
+    # 回答にはHyDEを使わず（並列モードで先に始めたHyDEは取り消される）、質問そのままでの検索結果が参照元になる
+    assert answer.answer == "回答です。"
+    assert len(answer.sources) == 2
+    assert gate.stats()["llm_calls_saved"] == 1
+    assert finished == []
+    # 裏の一致度の確認でだけHyDEが最後まで走る
+    await asyncio.gather(*bot._audits)
+    assert finished == [True]
+    assert gate.stats()["audits"] == 1
+    assert gate.stats()["mean_answer_agreement"] == 1.0
+
+@pytest.mark.asyncio
+async def test_完全一致の質問は埋め込みもせずに回答を返すこと(mock_chatbot, mock_vector_db):
+    first = await mock_chatbot.run("ともちゃんは誰？")
+    second = await mock_chatbot.run("ともちゃんは誰？ ")
+
+    assert second is first
+    mock_vector_db.aembed_query.assert_awaited_once()
+    assert mock_chatbot.cache_stats()["exact"]["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_取り込みの後は検索結果が変わった回答だけ作り直すこと(mock_chatbot, mock_vector_db):
+    from langchain_core.documents import Document
+    from src.cache_tiers import get_corpus_version
+    mock_vector_db.asearch_with_vectors.return_value = [(Document(id="1", page_content="A"), 0.5, [0.0])]
+    mock_chatbot._graph.ainvoke.return_value = {"answer": "古い回答", "probe_ids": ["1"]}
+    await mock_chatbot.run("変わらない質問")
+    await mock_chatbot.run("変わる質問")
+
+    # 取り込みで版が上がり、「変わる質問」の検索結果にだけ新しい文書が入る
+    await get_corpus_version().abump()
+    new_results = [(Document(id="2", page_content="B"), 0.1, [0.0]), (Document(id="1", page_content="A"), 0.5, [0.0])]
+    old_results = [(Document(id="1", page_content="A"), 0.5, [0.0])]
+    mock_vector_db.aembed_query.side_effect = lambda text: [1.0] if text == "変わる質問" else [0.0]
+    mock_vector_db.asearch_with_vectors.side_effect = lambda vector, k: new_results if vector == [1.0] else old_results
+    mock_chatbot._graph.ainvoke.return_value = {"answer": "新しい回答", "probe_ids": ["2", "1"]}
+
+    assert (await mock_chatbot.run("変わらない質問")).answer == "古い回答"
+    assert (await mock_chatbot.run("変わる質問")).answer == "新しい回答"
+    stats = mock_chatbot.cache_stats()["exact"]
+    assert stats["stale"] == 2
+    assert stats["revalidated"] == 1
+
+def test_空のキャッシュを渡してもそのまま使うこと(mock_vector_db):
+    # SemanticCacheは__len__を持つので、空だと偽とみなされる
+    from unittest.mock import AsyncMock, MagicMock, patch
+    from src.bot import ChatBot
+    empty_cache = MagicMock()
+    empty_cache.__len__.return_value = 0
+    with patch("src.bot.init_chat_model") as mock_init_chat_model, patch("src.bot.SemanticCache") as mock_semantic_cache:
+        mock_init_chat_model.return_value = AsyncMock()
+        bot = ChatBot(template="{question}", hyde_template="{question}", vector_db=mock_vector_db, cache=empty_cache)
+    assert bot._cache is empty_cache
+    mock_semantic_cache.assert_not_called()
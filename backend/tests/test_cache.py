@@ -0,0 +1,173 @@
+# ここでテストしたいこと
+# SemanticCacheがPostgresに問い合わせずメモリ上の索引で判定すること
+# 閾値の意味（距離が閾値未満ならヒット）が変わっていないこと
+# 追加した回答が裏でPostgresに書き戻されること
+# 次元が違う（EMBEDDING_DIMENSIONSを変える前の）行は読み込まないこと
+# 件数・古さの上限を超えた回答を、整理(compact)でまとめて追い出すこと（LRU / LFU / 期限 / 古いと分かったもの）
+# 当たりの記録は当たるたびには書き込まず、整理の時に1回のUPDATEでまとめて書き戻すこと
+# 再起動の後も、保存した回答の版と保存したコーパスの版を比べること（版の無い行は確かめ直す）
+
+import pytest
+from unittest.mock import AsyncMock, patch
+from langchain_core.documents import Document
+from src.cache import CachedAnswer, SemanticCache, select_evictions
+from src.cache_tiers import CorpusVersion
+
+
+@pytest.fixture
+def cache():
+    with patch("src.cache.Vectorstore") as MockVectorstore, patch("src.cache.get_corpus_version", return_value=CorpusVersion()):
+        store = MockVectorstore.return_value
+        store.aget_all_with_vectors = AsyncMock(return_value=[
+            (Document(page_content="ともちゃんは誰？", metadata={"answer": "ともよのこと", "corpus_version": 0}), [1.0, 0.0]),
+        ])
+        store.aadd_with_vectors = AsyncMock()
+        store.adelete = AsyncMock()
+        store.aupdate_metadata = AsyncMock()
+        store.avacuum = AsyncMock()
+        store.aembed_query = AsyncMock(return_value=[0.0, 1.0])
+        store.dimensions = 2
+        yield SemanticCache(embedding_model="dummy-model", threshold=0.2, max_entries=2, compact_interval=0)
+
+
+@pytest.mark.asyncio
+async def test_起動時にPostgresから読み込んだ回答がヒットすること(cache):
+    await cache.load()
+
+    assert await cache._check("ともちゃんって誰？", vector=[1.0, 0.05]) == "ともよのこと"
+    cache._vector_store.asearch_score_by_vector.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_距離が閾値以上ならヒットしないこと(cache):
+    assert await cache._check("全然違う質問", vector=[0.0, 1.0]) is None
+
+
+@pytest.mark.asyncio
+async def test_追加した回答がすぐにヒットし裏で書き戻されること(cache):
+    await cache.add_question_answer("新しい質問", "新しい回答", vector=[0.0, 1.0])
+    await cache.flush()
+
+    assert await cache._check("新しい質問", vector=[0.0, 1.0]) == "新しい回答"
+    cache._vector_store.aadd_with_vectors.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_次元が違う行は読み込まないこと(cache):
+    cache._vector_store.aget_all_with_vectors.return_value.append(
+        (Document(page_content="古い質問", metadata={"answer": "古い回答"}), [1.0, 0.0, 0.0]),
+    )
+    await cache.load()
+
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_コーパスの版が上がった後は確かめ直して使えるものだけ返すこと(cache):
+    await cache.add_question_answer("質問", "回答", vector=[0.0, 1.0], probe_ids=["1"])
+    await cache._versions.abump()
+
+    async def unchanged(entry):
+        return entry.probe_ids == frozenset({"1"})
+
+    async def changed(entry):
+        return False
+
+    assert await cache._check("質問", vector=[0.0, 1.0], revalidate=unchanged) == "回答"
+    await cache._versions.abump()
+    assert await cache._check("質問", vector=[0.0, 1.0], revalidate=changed) is None
+    # 古いと分かった回答は、確かめ直さずに外れる
+    assert await cache._check("質問", vector=[0.0, 1.0], revalidate=unchanged) is None
+    assert cache.stats()["revalidated"] == 1
+
+
+
+@pytest.mark.asyncio
+async def test_再起動の後は保存した版と比べて古い回答だけ確かめ直すこと(cache):
+    cache._vector_store.aget_all_with_vectors.return_value = [
+        (Document(id="old", page_content="取り込み前の質問", metadata={"answer": "古い回答", "corpus_version": 1, "probe_ids": ["1"]}), [1.0, 0.0]),
+        (Document(id="new", page_content="取り込み後の質問", metadata={"answer": "新しい回答", "corpus_version": 2}), [0.0, 1.0]),
+        (Document(id="legacy", page_content="版の無い質問", metadata={"answer": "版の無い回答"}), [-1.0, 0.0]),
+    ]
+    store = AsyncMock()
+    store.aget_collection_counter.return_value = 2
+    cache._versions.attach(store)
+    await cache._versions.aload()
+    calls = []
+
+    async def changed(entry):
+        calls.append(entry.id)
+        return False
+
+    assert await cache._check("取り込み後の質問", vector=[0.0, 1.0], revalidate=changed) == "新しい回答"
+    assert await cache._check("取り込み前の質問", vector=[1.0, 0.0], revalidate=changed) is None
+    assert await cache._check("版の無い質問", vector=[-1.0, 0.0], revalidate=changed) is None
+    assert calls == ["old", "legacy"]
+
+
+@pytest.mark.asyncio
+async def test_確かめ直して付け直した版を書き戻すこと(cache):
+    cache._vector_store.aget_all_with_vectors.return_value = [
+        (Document(id="tomo", page_content="ともちゃんは誰？", metadata={"answer": "ともよのこと", "corpus_version": 0}), [1.0, 0.0]),
+    ]
+    await cache.load()
+    await cache._versions.abump()
+
+    async def unchanged(entry):
+        return True
+
+    assert await cache._check("ともちゃんは誰？", vector=[1.0, 0.0], revalidate=unchanged) == "ともよのこと"
+    await cache.compact()
+
+    (patches,), _ = cache._vector_store.aupdate_metadata.await_args
+    assert [patch["corpus_version"] for patch in patches.values()] == [1]
+
+
+def _answer(name, created_at=0.0, last_hit=0.0, hits=0, invalid=False):
+    return CachedAnswer(name, 0, id=name, created_at=created_at, last_hit=last_hit, hits=hits, invalid=invalid)
+
+
+def test_件数を超えたらLRUでは最後に当たったのが古いものから追い出すこと():
+    entries = [_answer("a", created_at=1, last_hit=50), _answer("b", created_at=2), _answer("c", created_at=3, last_hit=10)]
+
+    evictions = select_evictions(entries, now=100, max_entries=2, max_age=None, policy="lru", low_watermark=0.5)
+
+    assert [e.id for e in evictions["capacity"]] == ["b", "c"]
+
+
+def test_件数を超えたらLFUでは当たった回数が少ないものから追い出すこと():
+    entries = [_answer("a", hits=5), _answer("b", hits=1, last_hit=90), _answer("c", hits=9)]
+
+    evictions = select_evictions(entries, now=100, max_entries=2, max_age=None, policy="lfu", low_watermark=1.0)
+
+    assert [e.id for e in evictions["capacity"]] == ["b"]
+
+
+def test_期限切れと古いと分かった回答は件数に関係なく追い出すこと():
+    entries = [_answer("old", created_at=0), _answer("stale", created_at=90, invalid=True), _answer("new", created_at=95)]
+
+    evictions = select_evictions(entries, now=100, max_entries=10, max_age=50)
+
+    assert [e.id for e in evictions["expired"]] == ["old"]
+    assert [e.id for e in evictions["invalid"]] == ["stale"]
+    assert evictions["capacity"] == []
+
+
+@pytest.mark.asyncio
+async def test_整理でまとめて追い出し当たりの記録をまとめて書き戻すこと(cache):
+    await cache.load()  # Postgresから1件
+    for i in range(3):
+        await cache.add_question_answer(f"質問{i}", f"回答{i}", vector=[0.0, 1.0 + i])
+    # 何度当たっても、その場では書き込まない
+    for _ in range(3):
+        assert await cache._check("質問2", vector=[0.0, 3.0]) is not None
+    cache._vector_store.aupdate_metadata.assert_not_awaited()
+
+    counts = await cache.compact()
+
+    assert len(cache) == 1  # 上限2件の9割(1件)まで減らす
+    assert counts["capacity"] == 3
+    cache._vector_store.adelete.assert_awaited_once()
+    assert len(cache._vector_store.adelete.await_args.args[0]) == 2  # IDの無い読み込み分は消せない
+    patches = cache._vector_store.aupdate_metadata.await_args.args[0]
+    assert [p["hits"] for p in patches.values()] == [3]
@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import AsyncMock
+from src.cache_tiers import CorpusVersion, LRUTier, vector_key
+
+# ここでテストしたいこと
+# 1. 版が同じ間はそのまま当たり、ヒット率が数えられること
+# 2. 取り込みで版が上がったら、使う時に確かめ直し、使えれば今の版を付け直すこと（2回目は確かめ直さない）
+# 3. 確かめ直しで古いと分かったエントリは消えること
+# 4. 版を見ない段(HyDE)は取り込みの後もそのまま当たること
+# 5. 件数の上限を超えたら古いものから消えること
+# 6. Vectorstoreを付けた版は、保存した値から始まり、上げるたびに保存されること
+
+
+@pytest.mark.asyncio
+async def test_版が同じ間はそのまま当たること():
+    tier = LRUTier(maxsize=10, versions=CorpusVersion())
+    tier.put("q", "答え")
+
+    assert (await tier.aget("q")).value == "答え"
+    assert await tier.aget("別の質問") is None
+    assert tier.stats.to_dict()["hit_ratio"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_版が上がったら使う時に確かめ直すこと():
+    versions = CorpusVersion()
+    tier = LRUTier(maxsize=10, versions=versions)
+    tier.put("q", "答え", probe_ids=["a", "b"])
+    await versions.abump()
+    calls = []
+
+    async def revalidate(entry):
+        calls.append(entry.probe_ids)
+        return True
+
+    assert (await tier.aget("q", revalidate=revalidate)).value == "答え"
+    assert (await tier.aget("q", revalidate=revalidate)).value == "答え"
+    assert calls == [frozenset({"a", "b"})]  # 付け直したので2回目は確かめない
+    assert tier.stats.revalidated == 1
+
+
+@pytest.mark.asyncio
+async def test_確かめ直しで古いと分かったら消えること():
+    versions = CorpusVersion()
+    tier = LRUTier(maxsize=10, versions=versions)
+    tier.put("q", "答え")
+    await versions.abump()
+
+    async def revalidate(entry):
+        return False
+
+    assert await tier.aget("q", revalidate=revalidate) is None
+    assert len(tier) == 0
+    assert tier.stats.stale == 1
+
+
+@pytest.mark.asyncio
+async def test_版を見ない段は取り込みの後も当たること():
+    versions = CorpusVersion()
+    tier = LRUTier(maxsize=10, versioned=False, versions=versions)
+    tier.put("q", "仮想文書")
+    await versions.abump()
+
+    assert (await tier.aget("q")).value == "仮想文書"
+
+
+@pytest.mark.asyncio
+async def test_上限を超えたら古いものから消えること():
+    tier = LRUTier(maxsize=2, versions=CorpusVersion())
+    tier.put("a", 1)
+    tier.put("b", 2)
+    await tier.aget("a")  # aを最近使ったことにする
+    tier.put("c", 3)
+
+    assert await tier.aget("b") is None
+    assert (await tier.aget("a")).value == 1
+
+
+def test_同じベクトルと件数なら同じキーになること():
+    assert vector_key([0.1, 0.2], 5) == vector_key([0.1, 0.2], 5)
+    assert vector_key([0.1, 0.2], 5) != vector_key([0.1, 0.2], 3)
+    assert vector_key([0.1, 0.2], 5) != vector_key([0.2, 0.1], 5)
+
+
+@pytest.mark.asyncio
+async def test_版は保存した値から始まり上げるたびに保存されること():
+    store = AsyncMock()
+    store.aget_collection_counter.return_value = 7
+    store.aincrement_collection_counter.return_value = 8
+    versions = CorpusVersion()
+    versions.attach(store)
+
+    assert await versions.aload() == 7
+    assert await versions.abump("(取り込み)") == 8
+    assert versions.current == 8
+    store.aincrement_collection_counter.assert_awaited_once_with("corpus_version")
@@ -0,0 +1,82 @@
+# ここでテストしたいこと
+# ChatBot.astreamが「参照元 → 回答トークン → 完成した回答」の順にイベントを返すこと
+# /chat/stream が複数の質問のイベントをSSEで返し、最後にendを送ること
+
+import json
+import pytest
+from unittest.mock import AsyncMock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from src.bot import ChatBot
+
+
+@pytest.fixture
+def streaming_bot(mock_vector_db, mock_cache):
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content="ともよ の ことです")]))
+    bot = ChatBot(
+        template="質問: {question}\nコンテキスト: {context}",
+        hyde_template="仮想ドキュメント: {question}",
+        vector_db=mock_vector_db,
+        llm=llm,
+        cache=mock_cache,
+    )
+    bot._hyde_chain = AsyncMock()
+    bot._hyde_chain.ainvoke.return_value = "事前生成のクエリ。"
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_参照元の後に回答トークンが流れること(streaming_bot, mock_cache):
+    events = [e async for e in streaming_bot.astream("ともちゃんは誰？")]
+
+    types = [e["type"] for e in events]
+    assert types[0] == "sources"
+    assert types[-1] == "done"
+    assert set(types[1:-1]) == {"token"}
+    assert "".join(e["text"] for e in events if e["type"] == "token") == "ともよ の ことです"
+    assert events[-1]["answer"] == "ともよ の ことです"
+    mock_cache.add_question_answer.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_キャッシュヒットはすぐに返ること(streaming_bot, mock_cache):
+    mock_cache._check.return_value = "キャッシュの回答"
+
+    events = [e async for e in streaming_bot.astream("ともちゃんは誰？")]
+
+    assert events == [{"type": "cache_hit", "answer": "キャッシュの回答"}]
+
+
+def _parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        data = [line[len("data: "):] for line in block.split("\n") if line.startswith("data: ")]
+        events.append(json.loads(data[0]))
+    return events
+
+
+def test_streamエンドポイントが質問ごとのイベントを返すこと():
+    from src.app.main import app
+    from src.app.dependencies import get_bot
+
+    class _FakeBot:
+        async def astream(self, question):
+            yield {"type": "sources", "sources": []}
+            yield {"type": "token", "text": f"{question}の"}
+            yield {"type": "done", "answer": f"{question}の回答"}
+
+    app.dependency_overrides[get_bot] = lambda: _FakeBot()
+    try:
+        client = TestClient(app)
+        response = client.post("/chat/stream", json={"questions": ["質問1", "質問2"]})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_sse(response.text)
+    assert events[-1] == {"type": "end"}
+    for index in (0, 1):
+        per_question = [e["type"] for e in events if e.get("index") == index]
+        assert per_question == ["sources", "token", "done"]
@@ -0,0 +1,62 @@
+from langchain_core.documents import Document
+from src.context_packer import ContextPacker
+
+# ここでテストしたいこと
+# 1. 同じページで文字が重なるチャンクが1つにつながること（関連度の高い方の位置に入る）
+# 2. ベクトルがほぼ同じチャンクは落ちること（別ページ・別ファイルでも）
+# 3. トークンの予算に入る分だけ、関連度の高い順に詰めること
+# 4. 節約できたトークン数が分かること
+
+_OVERLAP = "ここは隣り合うチャンクで重なっている部分の文章です。"
+
+def _doc(id, text, source="a.pdf", page=1):
+    return Document(id=id, page_content=text, metadata={"source_file": source, "page_info": page})
+
+def test_同じページで重なるチャンクがつながること():
+    first = _doc("1", "前半の文章です。" + _OVERLAP)
+    other = _doc("2", "別のページの文章です。", page=2)
+    second = _doc("3", _OVERLAP + "後半の文章です。")
+
+    result = ContextPacker(token_budget=1000).pack([second, other, first])
+
+    assert [d.page_content for d in result.documents] == [
+        "前半の文章です。" + _OVERLAP + "後半の文章です。",
+        "別のページの文章です。",
+    ]
+    assert result.documents[0].id == "3"  # 関連度の高い方の位置・メタデータを使う
+    assert result.merged == 1
+    assert result.tokens_saved > 0
+
+def test_違うページなら重なっていてもつなげないこと():
+    result = ContextPacker(token_budget=1000).pack([
+        _doc("1", "前半" + _OVERLAP, page=1),
+        _doc("2", _OVERLAP + "後半", page=2),
+    ])
+
+    assert len(result.documents) == 2
+    assert result.merged == 0
+
+def test_ベクトルがほぼ同じチャンクは落ちること():
+    docs = [_doc("1", "元の文書の文章。"), _doc("2", "再アップロードされた文書の文章。", source="b.pdf"), _doc("3", "関係ない文章。")]
+    vectors = {"1": [1.0, 0.0], "2": [0.99, 0.01], "3": [0.0, 1.0]}
+
+    result = ContextPacker(token_budget=1000, duplicate_similarity=0.95).pack(docs, vectors)
+
+    assert [d.id for d in result.documents] == ["1", "3"]
+    assert result.duplicates == 1
+
+def test_予算に入る分だけ関連度の高い順に詰めること():
+    docs = [_doc("1", "あ" * 100, page=1), _doc("2", "い" * 300, page=2), _doc("3", "う" * 100, page=3)]
+
+    # 1トークン=2文字の見積もりで、予算100トークン=200文字
+    result = ContextPacker(token_budget=100).pack(docs)
+
+    assert [d.id for d in result.documents] == ["1", "3"]  # 入らない2を飛ばして3を入れる
+    assert result.dropped == 1
+    assert result.tokens_after <= 100
+
+def test_最初のチャンクだけで予算を超える時は切り詰めること():
+    result = ContextPacker(token_budget=10).pack([_doc("1", "あ" * 100)])
+
+    assert result.truncated is True
+    assert result.documents[0].page_content == "あ" * 20
@@ -0,0 +1,110 @@
+# ここでテストしたいこと
+# 同じ接続先には同じエンジンを返し、プールの設定(大きさ・溢れ・pre-ping・recycle)が反映されること
+# コレクションが違っても、全てのVectorstoreが同じエンジン(接続プール)を使うこと
+# コレクションのUUIDは、同時に問い合わせても、インスタンスが違っても1回だけ問い合わせること
+# 問い合わせに失敗したUUIDは覚えず、次の呼び出しでやり直すこと
+# 接続を借りた回数・待った時間が記録され、貸し出し中の数がstatsに出ること
+
+import asyncio
+import uuid
+from unittest.mock import patch
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from src import config, db
+from src.db import EngineRegistry, database_url
+from src.vector_store import Vectorstore
+
+URL = database_url("psycopg").set(host="db.example", port=5432, database="rag")
+
+
+def test_同じ接続先には同じエンジンを返しプールの設定が反映されること():
+    registry = EngineRegistry()
+    engine = registry.async_engine(URL)
+
+    assert registry.async_engine(URL) is engine
+    pool = engine.sync_engine.pool
+    assert pool.size() == config.DB_POOL_SIZE
+    assert pool._max_overflow == config.DB_MAX_OVERFLOW
+    assert pool._pre_ping is config.DB_POOL_PRE_PING
+    assert pool._recycle == config.DB_POOL_RECYCLE
+    assert pool._timeout == config.DB_POOL_TIMEOUT
+
+
+def test_全てのVectorstoreが同じエンジンを使うこと(monkeypatch):
+    registry = EngineRegistry()
+    monkeypatch.setattr(db, "_registry", registry)
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"):
+        docs = Vectorstore(embedding_model="dummy-model", collection_name="RAG_docs")
+        cache = Vectorstore(embedding_model="dummy-model", collection_name="SemanticCache", bulk_insert=False)
+
+    assert docs._astore._async_engine is cache._astore._async_engine
+    assert list(registry._async_engines) == [database_url("psycopg")]
+
+
+@pytest.mark.asyncio
+async def test_UUIDは同時に問い合わせても1回だけ問い合わせること():
+    registry = EngineRegistry()
+    collection = uuid.uuid4()
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return collection
+
+    found = await asyncio.gather(*(registry.collection_id(URL, "RAG_docs", load) for _ in range(5)))
+    assert found == [collection] * 5
+    assert await registry.collection_id(URL, "RAG_docs", load) == collection
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_UUIDは別のインスタンスとも共有すること(monkeypatch):
+    registry = EngineRegistry()
+    monkeypatch.setattr(db, "_registry", registry)
+    collection = uuid.uuid4()
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), patch("src.vector_store.PGVector") as MockVectorStore:
+        MockVectorStore.return_value._async_engine.url = URL
+        first = Vectorstore(embedding_model="dummy-model", collection_name="SemanticCache")
+        second = Vectorstore(embedding_model="dummy-model", collection_name="SemanticCache")
+        with patch.object(Vectorstore, "_aload_collection_id", autospec=True, return_value=collection) as load:
+            assert await first._acollection_id() == collection
+            assert await second._acollection_id() == collection
+
+    assert load.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_失敗したUUIDの問い合わせは覚えないこと():
+    registry = EngineRegistry()
+    collection = uuid.uuid4()
+
+    async def broken():
+        raise ValueError("Collection not found")
+
+    async def load():
+        return collection
+
+    with pytest.raises(ValueError):
+        await registry.collection_id(URL, "RAG_docs", broken)
+    assert await registry.collection_id(URL, "RAG_docs", load) == collection
+
+
+def test_接続を借りた回数と時間が記録されること(tmp_path):
+    registry = EngineRegistry()
+    engine = registry.engine(database_url("psycopg2").set(drivername="sqlite", database=str(tmp_path / "pool.db")))
+    checkouts = REGISTRY.get_sample_value("db_pool_checkouts_total", {"engine": "sync"}) or 0
+    waits = REGISTRY.get_sample_value("db_pool_wait_seconds_count", {"engine": "sync"}) or 0
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        assert registry.stats()["sync"]["checked_out"] == 1
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    assert registry.stats()["sync"]["checked_out"] == 0
+    assert REGISTRY.get_sample_value("db_pool_checkouts_total", {"engine": "sync"}) == checkouts + 2
+    assert REGISTRY.get_sample_value("db_pool_wait_seconds_count", {"engine": "sync"}) == waits + 2
+    engine.dispose()
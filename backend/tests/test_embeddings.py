@@ -0,0 +1,199 @@
+# ここでテストしたいこと
+# 同じテキストの埋め込みがメモから返され、APIが二度呼ばれないこと
+# メモがLRUで古いものから捨てられること
+# 同時に来たクエリが1回のバッチにまとめられ、バッチの大きさと待ち時間がヒストグラムに記録されること
+# 次元を減らす時は先頭だけを残し、長さ1に正規化し直すこと
+# 同期の呼び出しも非同期の呼び出しと同じレート制限器を通り、429で非同期の呼び出しも一緒に休むこと
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from src.embeddings import CachedEmbeddings, EmbeddingMemo
+
+
+@pytest.fixture
+def fake_embeddings():
+    model = MagicMock()
+    model.embed_query.side_effect = lambda text: [float(len(text))]
+    model.embed_documents.side_effect = lambda texts: [[float(len(t))] for t in texts]
+    model.aembed_query = AsyncMock(side_effect=lambda text: [float(len(text))])
+    return model
+
+
+def test_同じテキストは一度しか埋め込まれないこと(fake_embeddings):
+    memo = EmbeddingMemo(maxsize=10)
+    embeddings = CachedEmbeddings(fake_embeddings, model="dummy", memo=memo)
+
+    first = embeddings.embed_query("こんにちは")
+    second = embeddings.embed_query("こんにちは")
+
+    assert first == second
+    assert fake_embeddings.embed_query.call_count == 1
+    assert memo.stats()["hits"] == 1
+    assert memo.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_非同期でもメモが共有されること(fake_embeddings):
+    memo = EmbeddingMemo(maxsize=10)
+    embeddings = CachedEmbeddings(fake_embeddings, model="dummy", memo=memo)
+
+    embeddings.embed_query("質問")
+    await embeddings.aembed_query("質問")
+
+    fake_embeddings.aembed_query.assert_not_awaited()
+
+
+def test_documentsはメモに無いものだけ埋め込まれること(fake_embeddings):
+    memo = EmbeddingMemo(maxsize=10)
+    embeddings = CachedEmbeddings(fake_embeddings, model="dummy", memo=memo)
+    embeddings.embed_documents(["a"])
+
+    vectors = embeddings.embed_documents(["a", "bb", "ccc"])
+
+    assert vectors == [[1.0], [2.0], [3.0]]
+    fake_embeddings.embed_documents.assert_called_with(["bb", "ccc"])
+
+
+def test_クエリ用と文書用のベクトルは別々にメモされること(fake_embeddings):
+    memo = EmbeddingMemo(maxsize=10)
+    embeddings = CachedEmbeddings(fake_embeddings, model="dummy", memo=memo)
+    embeddings.embed_query("a")
+
+    embeddings.embed_documents(["a"])
+
+    fake_embeddings.embed_documents.assert_called_once_with(["a"])
+
+
+def test_モデルが違えば別のキーになること():
+    memo = EmbeddingMemo(maxsize=10)
+    memo.put("model-a", "text", [1.0])
+
+    assert memo.get("model-b", "text") is None
+    assert memo.get("model-a", "text") == [1.0]
+
+
+def test_上限を超えたら最も古いものから捨てられること():
+    memo = EmbeddingMemo(maxsize=2)
+    memo.put("m", "a", [1.0])
+    memo.put("m", "b", [2.0])
+    memo.get("m", "a")  # aを最近使ったことにする
+    memo.put("m", "c", [3.0])
+
+    assert memo.get("m", "b") is None
+    assert memo.get("m", "a") == [1.0]
+    assert memo.get("m", "c") == [3.0]
+
+
+@pytest.mark.asyncio
+async def test_同時に来たクエリが1回のバッチにまとめられること(fake_embeddings):
+    import asyncio
+    from src.embeddings import EmbeddingBatcher
+    fake_embeddings.aembed_documents = AsyncMock(side_effect=lambda texts, **kwargs: [[float(len(t))] for t in texts])
+    batcher = EmbeddingBatcher(fake_embeddings, max_batch_size=100, max_wait_ms=5, query_kwargs={"task_type": "RETRIEVAL_QUERY"})
+
+    vectors = await asyncio.gather(*[batcher.aembed_query("a" * i) for i in range(1, 6)])
+
+    # 各呼び出し元には自分のベクトルが返ること
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    fake_embeddings.aembed_documents.assert_awaited_once_with(["a", "aa", "aaa", "aaaa", "aaaaa"], task_type="RETRIEVAL_QUERY")
+    assert batcher.stats()["batch_sizes"] == {5: 1}
+
+
+@pytest.mark.asyncio
+async def test_最大件数に達したらすぐに送られること(fake_embeddings):
+    import asyncio
+    from src.embeddings import EmbeddingBatcher
+    fake_embeddings.aembed_documents = AsyncMock(side_effect=lambda texts, **kwargs: [[0.0] for _ in texts])
+    batcher = EmbeddingBatcher(fake_embeddings, max_batch_size=2, max_wait_ms=10_000)
+
+    await asyncio.wait_for(asyncio.gather(*[batcher.aembed_query(str(i)) for i in range(4)]), timeout=1)
+
+    assert batcher.stats()["batch_sizes"] == {2: 2}
+
+
+@pytest.mark.asyncio
+async def test_バッチの大きさと待ち時間がヒストグラムに記録されること(fake_embeddings):
+    import asyncio
+    from prometheus_client import REGISTRY
+    from src.embeddings import EmbeddingBatcher
+    fake_embeddings.aembed_documents = AsyncMock(side_effect=lambda texts, **kwargs: [[0.0] for _ in texts])
+    batcher = EmbeddingBatcher(fake_embeddings, max_batch_size=3, max_wait_ms=10_000, name="histogram-test")
+    labels = {"model": "histogram-test"}
+
+    await asyncio.wait_for(asyncio.gather(*[batcher.aembed_query(str(i)) for i in range(3)]), timeout=1)
+
+    assert REGISTRY.get_sample_value("embedding_batch_size_count", labels) == 1
+    assert REGISTRY.get_sample_value("embedding_batch_size_sum", labels) == 3
+    assert REGISTRY.get_sample_value("embedding_batch_queue_delay_seconds_count", labels) == 3
+
+
+@pytest.mark.asyncio
+async def test_バッチが失敗したら全員に例外が伝わること(fake_embeddings):
+    import asyncio
+    from src.embeddings import EmbeddingBatcher
+    fake_embeddings.aembed_documents = AsyncMock(side_effect=RuntimeError("boom"))
+    batcher = EmbeddingBatcher(fake_embeddings, max_batch_size=10, max_wait_ms=1)
+
+    results = await asyncio.gather(batcher.aembed_query("a"), batcher.aembed_query("b"), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_次元を減らす時は先頭だけを残して正規化し直すこと():
+    from src.embeddings import TruncatedEmbeddings
+    model = MagicMock()
+    model.aembed_documents = AsyncMock(return_value=[[3.0, 4.0, 100.0], [0.0, 0.0, 1.0]])
+    model.aembed_query = AsyncMock(return_value=[1.0, 2.0])
+
+    vectors = await TruncatedEmbeddings(model, dimensions=2).aembed_documents(["a", "b"])
+
+    assert vectors[0] == pytest.approx([0.6, 0.8])
+    assert vectors[1] == [0.0, 0.0]  # 先頭が全て0なら正規化しない
+    assert await TruncatedEmbeddings(model, dimensions=2).aembed_query("q") == [1.0, 2.0]  # 既に短ければそのまま
+
+
+class _ResourceExhausted(Exception):
+    code = 429
+
+
+@pytest.mark.asyncio
+async def test_同期の呼び出しも非同期の呼び出しと同じレート制限器を通ること(fake_embeddings):
+    import asyncio
+    import threading
+    import time
+    from src.embeddings import RateLimitedEmbeddings
+    from src.rate_limiter import RateLimiter
+    limiter = RateLimiter("shared-test", requests_per_minute=6000, tokens_per_minute=1_000_000, max_concurrency=2, min_backoff=0.2)
+    embeddings = RateLimitedEmbeddings(fake_embeddings, limiter)
+    rejected = threading.Event()
+
+    def embed_documents(texts):
+        if not rejected.is_set():
+            rejected.set()
+            raise _ResourceExhausted("quota")
+        return [[float(len(t))] for t in texts]
+    fake_embeddings.embed_documents.side_effect = embed_documents
+
+    # CLIの取り込みと同じく、同期の呼び出しを別スレッドから行う
+    sync_call = asyncio.create_task(asyncio.to_thread(embeddings.embed_documents, ["abc"]))
+    while not rejected.is_set():
+        await asyncio.sleep(0.005)
+    started = time.monotonic()
+    assert await embeddings.aembed_query("ab") == [2.0]
+    # 同期の呼び出しの429で、非同期の呼び出しも休まされる
+    assert time.monotonic() - started >= 0.1
+
+    assert await sync_call == [[3.0]]
+    assert limiter.rate_limited == 1
+    assert limiter.retries == 1
+    assert limiter.granted == 3  # 同期の2回(429とやり直し) + 非同期の1回
+
+
+def test_イベントループが無くても同期の呼び出しはレート制限器を通ること(fake_embeddings):
+    from src.embeddings import RateLimitedEmbeddings
+    from src.rate_limiter import RateLimiter
+    limiter = RateLimiter("sync-test", requests_per_minute=6000, tokens_per_minute=1_000_000, max_concurrency=2, min_backoff=0.0)
+
+    assert RateLimitedEmbeddings(fake_embeddings, limiter).embed_query("abcd") == [4.0]
+    assert limiter.granted == 1
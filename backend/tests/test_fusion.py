@@ -0,0 +1,26 @@
+from langchain_core.documents import Document
+from src.fusion import reciprocal_rank_fusion
+
+# ここでテストしたいこと
+# 1. 複数の検索結果に出てくる文書ほど上に来ること
+# 2. 同じ文書（IDが同じ、IDが無ければ本文が同じ）は1つにまとまること
+# 3. 件数の上限が効くこと
+
+def test_複数の結果に出てくる文書ほど上に来ること():
+    a = [Document(page_content="A"), Document(page_content="B"), Document(page_content="C")]
+    b = [Document(page_content="C"), Document(page_content="D")]
+
+    fused = reciprocal_rank_fusion([a, b])
+
+    assert [d.page_content for d in fused] == ["C", "A", "B", "D"]  # BとDは同点なので先に出てきたBが前
+
+def test_IDが同じ文書は本文が違っても1つにまとまること():
+    a = [Document(id="1", page_content="古い本文")]
+    b = [Document(id="1", page_content="新しい本文"), Document(id="2", page_content="別")]
+
+    fused = reciprocal_rank_fusion([a, b], limit=1)
+
+    assert [(d.id, d.page_content) for d in fused] == [("1", "古い本文")]
+
+def test_空の結果しか無ければ空を返すこと():
+    assert reciprocal_rank_fusion([[], []]) == []
@@ -0,0 +1,57 @@
+# ここでテストしたいこと
+# liveは常に200、readyは裏での初期化が終わるまで503を返すこと
+# indexはANN索引の作成状況を返すこと
+# cacheはキャッシュの段ごとのヒット率を返すこと（Botの準備前は503）
+
+from unittest.mock import AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+from src.app.main import app
+
+
+def test_liveは常に200を返すこと():
+    client = TestClient(app)
+    assert client.get("/health/live").status_code == 200
+
+
+def test_readyは初期化が終わるまで503を返すこと():
+    client = TestClient(app)
+    app.state.ready = False
+    assert client.get("/health/ready").status_code == 503
+
+    app.state.ready = True
+    app.state.startup_seconds = 0.5
+    try:
+        response = client.get("/health/ready")
+    finally:
+        app.state.ready = False
+    assert response.status_code == 200
+    assert response.json()["startup_seconds"] == 0.5
+
+
+def test_indexは索引の状態を返すこと():
+    client = TestClient(app)
+    original = getattr(app.state, "vector_store", None)
+    app.state.vector_store = MagicMock()
+    app.state.vector_store.aindex_status = AsyncMock(return_value={"name": "ix", "exists": True, "valid": False, "building": True, "progress": 0.5})
+    try:
+        response = client.get("/health/index")
+    finally:
+        app.state.vector_store = original
+    assert response.status_code == 200
+    assert response.json()["progress"] == 0.5
+
+
+def test_cacheはキャッシュの段ごとのヒット率を返すこと():
+    client = TestClient(app)
+    original = getattr(app.state, "bot", None)
+    app.state.bot = None
+    assert client.get("/health/cache").status_code == 503
+
+    app.state.bot = MagicMock()
+    app.state.bot.cache_stats.return_value = {"corpus_version": 2, "exact": {"hit_ratio": 0.5}}
+    try:
+        response = client.get("/health/cache")
+    finally:
+        app.state.bot = original
+    assert response.status_code == 200
+    assert response.json()["exact"]["hit_ratio"] == 0.5
@@ -0,0 +1,43 @@
+from langchain_core.documents import Document
+from src.hyde_gate import HydeGate, context_overlap
+
+# ここでテストしたいこと
+# 1. 1位が十分に近く、2位以下とはっきり差がある時だけHyDEを飛ばすこと
+# 2. 飛ばした回数（節約したLLM呼び出し）とaudit_every件ごとの確認のタイミング
+# 3. 検索結果の重なりの計算
+
+def test_1位が近くて差がある時だけ飛ばすこと():
+    gate = HydeGate(max_distance=0.2, margin=0.1, audit_every=0)
+
+    assert gate.decide("q", [0.1, 0.3, 0.4]) is True
+    assert gate.decide("q", [0.1, 0.15, 0.2]) is False  # 差が小さい
+    assert gate.decide("q", [0.3, 0.6, 0.7]) is False  # 1位が遠い
+    assert gate.decide("q", []) is False
+
+    assert gate.stats()["probes"] == 4
+    assert gate.stats()["llm_calls_saved"] == 1
+
+def test_飛ばしたaudit_every件ごとに確認すること():
+    gate = HydeGate(max_distance=0.2, margin=0.1, audit_every=2)
+    audits = []
+    for _ in range(4):
+        gate.decide("q", [0.1, 0.5])
+        audits.append(gate.should_audit())
+
+    assert audits == [False, True, False, True]
+
+def test_同時に飛ばした質問でも確認の数がずれないこと():
+    gate = HydeGate(max_distance=0.2, margin=0.1, audit_every=2)
+    # 4件の判断が先に終わり、確認するかはその後でまとめて決まる（同時に来た質問）
+    for _ in range(4):
+        gate.decide("q", [0.1, 0.5])
+    audits = [gate.should_audit() for _ in range(4)]
+
+    assert audits == [False, True, False, True]
+
+def test_検索結果の重なり():
+    a = [Document(page_content="A"), Document(page_content="B")]
+    b = [Document(page_content="B"), Document(page_content="C")]
+
+    assert context_overlap(a, b) == 1 / 3
+    assert context_overlap([], []) == 1.0
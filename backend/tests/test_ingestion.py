@@ -0,0 +1,121 @@
+# ここでテストしたいこと
+# 再アップロード時に、変わっていないチャンクは埋め込み直さず、消えたチャンクは削除されること
+# 再アップロードでも、ベクトルはメタデータが変わって書き直すチャンクの分だけ読むこと
+# 他のファイルに同じ内容のチャンクがあれば、そのベクトルを使い回すこと
+# チャンクを全て読み終える前に埋め込みが始まり、消えたチャンクは読み終えてから削除されること
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from langchain_core.documents import Document
+from src.ingestion import IncrementalIndexer, chunk_id, fingerprint
+
+
+def _doc(text, source="a.pdf", page=1):
+    return Document(page_content=text, metadata={"source_file": source, "page": page})
+
+
+def _stored(text, source="a.pdf", page=1, vector=(0.1, 0.2)):
+    h = fingerprint(text, "dummy-model")
+    doc = Document(id=chunk_id(source, h), page_content=text, metadata={"source_file": source, "page": page, "content_hash": h})
+    return doc, list(vector)
+
+
+@pytest.fixture
+def vector_store():
+    store = MagicMock()
+    store.embedding_model = "dummy-model"
+    store.rows = []  # 保存済みの (Document, ベクトル)
+    store.aget_metadata = AsyncMock(side_effect=lambda key, values: {d.id: d.metadata for d, _ in store.rows if d.metadata.get(key) in values})
+    store.aget_by_metadata = AsyncMock(side_effect=lambda key, values: [(d, v) for d, v in store.rows if d.metadata.get(key) in values])
+    store.aget_vectors = AsyncMock(side_effect=lambda ids: {d.id: v for d, v in store.rows if d.id in ids})
+    return store
+
+
+def test_空白や全角半角の違いは同じ指紋になること():
+    assert fingerprint("ＡＢＣ  です\n", "m") == fingerprint("ABC です", "m")
+    assert fingerprint("ABC", "model-a") != fingerprint("ABC", "model-b")
+
+
+@pytest.mark.asyncio
+async def test_初めてのファイルは全て埋め込むこと(vector_store):
+    plan = await IncrementalIndexer(vector_store).plan([_doc("一"), _doc("二")], "a.pdf")
+
+    assert [d.page_content for d in plan.to_embed] == ["一", "二"]
+    assert plan.reused == 0
+    assert plan.to_delete == []
+
+
+@pytest.mark.asyncio
+async def test_再アップロードでは差分だけが反映されること(vector_store):
+    unchanged, removed = _stored("変わらない"), _stored("消えた")
+    vector_store.rows = [unchanged, removed]
+
+    plan = await IncrementalIndexer(vector_store).plan([_doc("変わらない"), _doc("新しい")], "a.pdf")
+
+    assert [d.page_content for d in plan.to_embed] == ["新しい"]
+    assert plan.reused == 1
+    assert plan.to_write == []  # メタデータも同じなので書き直さない
+    assert plan.to_delete == [removed[0].id]
+    # 変わっていないチャンクのベクトルは読まない
+    vector_store.aget_vectors.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_メタデータが変わったらベクトルはそのままで書き直すこと(vector_store):
+    stored, unchanged = _stored("本文", page=1), _stored("そのまま", page=1)
+    vector_store.rows = [stored, unchanged]
+
+    plan = await IncrementalIndexer(vector_store).plan([_doc("本文", page=2), _doc("そのまま", page=1)], "a.pdf")
+
+    assert plan.to_embed == []
+    assert len(plan.to_write) == 1
+    doc, vector = plan.to_write[0]
+    assert doc.metadata["page"] == 2
+    assert vector == stored[1]
+    # ベクトルは書き直すチャンクの分だけ読み、このファイルの全行のベクトルは読まない
+    vector_store.aget_vectors.assert_awaited_once_with([stored[0].id])
+    assert all(call.args[0] != "source_file" for call in vector_store.aget_by_metadata.await_args_list)
+
+
+@pytest.mark.asyncio
+async def test_他のファイルと同じ内容ならベクトルを借りること(vector_store):
+    other = _stored("共通の段落", source="b.pdf", vector=(0.9, 0.9))
+    vector_store.rows = [other]
+
+    plan = await IncrementalIndexer(vector_store).plan([_doc("共通の段落")], "a.pdf")
+
+    assert plan.to_embed == []
+    assert plan.reused == 1
+    doc, vector = plan.to_write[0]
+    assert doc.id == chunk_id("a.pdf", fingerprint("共通の段落", "dummy-model"))
+    assert vector == [0.9, 0.9]
+
+
+@pytest.mark.asyncio
+async def test_全てのチャンクを読み終える前に埋め込みが始まること(vector_store):
+    removed = _stored("消えた")
+    vector_store.rows = [removed]
+    read = 0
+    read_when_embedded = []
+
+    def chunks():
+        nonlocal read
+        for i in range(10):
+            read += 1
+            yield _doc(f"段落{i}")
+        yield _doc("段落0")  # 同じ内容は1つにまとめる
+
+    async def embed(texts):
+        read_when_embedded.append(read)
+        return [[0.0] for _ in texts]
+
+    vector_store.aembed_documents = embed
+    vector_store.aadd_with_vectors = AsyncMock()
+    vector_store.adelete = AsyncMock()
+
+    report = await IncrementalIndexer(vector_store).index(chunks(), "a.pdf", batch_size=2, read_size=4)
+
+    assert read_when_embedded[0] < 10
+    assert (report.new, report.reused, report.deleted) == (10, 0, 1)
+    vector_store.adelete.assert_awaited_once_with([removed[0].id])
+
@@ -0,0 +1,170 @@
+# ここでテストしたいこと
+# アップロードがジョブとして裏で処理され、状態が queued → ... → done と進むこと
+# 途中で止まったジョブが、再起動後に終わっていないバッチから再開されること
+# 失敗したジョブが failed になり、エラーが記録され、アップロードされたファイルが消されること
+# 再開するジョブがキューの上限より多く残っていても、起動が失敗せずに全て処理されること
+
+import asyncio
+import time
+import pytest
+from pathlib import Path
+from unittest.mock import MagicMock
+from langchain_core.documents import Document
+from src.jobs import IngestionJob, IngestionQueue, JobStatus, JobStore
+
+
+@pytest.fixture
+def processor():
+    processor = MagicMock()
+    processor.load.side_effect = lambda path, title, filename: [
+        Document(page_content=f"chunk{i}", metadata={"source_file": filename}) for i in range(25)
+    ]
+    return processor
+
+
+class _InMemoryVectorStore:
+    """テスト用のベクトルストア。行をdictに持つ"""
+    embedding_model = "dummy-model"
+
+    def __init__(self):
+        self.rows = {}
+        self.embedded = []
+        self.fail = None
+
+    async def aget_by_metadata(self, key, values):
+        return [(d, v) for d, v in self.rows.values() if d.metadata.get(key) in values]
+
+    async def aget_metadata(self, key, values):
+        return {i: d.metadata for i, (d, _) in self.rows.items() if d.metadata.get(key) in values}
+
+    async def aget_vectors(self, ids):
+        return {i: self.rows[i][1] for i in ids if i in self.rows}
+
+    async def adelete(self, ids):
+        for i in ids:
+            self.rows.pop(i, None)
+
+    async def aembed_documents(self, texts):
+        if self.fail:
+            raise self.fail
+        self.embedded.extend(texts)
+        return [[float(len(t))] for t in texts]
+
+    async def aadd_with_vectors(self, docs, vectors):
+        for d, v in zip(docs, vectors):
+            self.rows[d.id] = (d.model_copy(deep=True), v)
+
+
+@pytest.fixture
+def vector_store():
+    return _InMemoryVectorStore()
+
+
+def _queue(vector_store, processor, tmp_path):
+    return IngestionQueue(vector_store, processor, JobStore(str(tmp_path / "jobs")), workers=1, batch_size=10)
+
+
+@pytest.mark.asyncio
+async def test_ジョブが裏で処理されdoneになること(vector_store, processor, tmp_path):
+    queue = _queue(vector_store, processor, tmp_path)
+    await queue.start()
+    upload = tmp_path / "a.pdf"
+    upload.write_bytes(b"dummy")
+
+    job = await queue.submit(upload, "a.pdf", "タイトル")
+    assert job.status == JobStatus.QUEUED
+    await asyncio.wait_for(queue.join(), timeout=1)
+    await queue.stop()
+
+    done = queue.get(job.id)
+    assert done.status == JobStatus.DONE
+    assert (done.done_batches, done.total_batches, done.total_chunks) == (3, 3, 25)
+    assert (done.report.new, done.report.reused, done.report.deleted) == (25, 0, 0)
+    assert len(vector_store.rows) == 25
+    assert not upload.exists()
+
+
+@pytest.mark.asyncio
+async def test_中断したジョブは保存済みのチャンクを使い回して再開されること(vector_store, processor, tmp_path):
+    # 前回の起動で2バッチ(20件)まで保存済み
+    queue = _queue(vector_store, processor, tmp_path)
+    plan = await queue._indexer.plan(processor.load(None, "t", "a.pdf")[:20], "a.pdf")
+    await vector_store.aadd_with_vectors(plan.to_embed, [[0.0]] * len(plan.to_embed))
+    store = JobStore(str(tmp_path / "jobs"))
+    now = time.time()
+    store.save(IngestionJob(
+        id="interrupted", title="t", filename="a.pdf", file_path=str(tmp_path / "a.pdf"),
+        status=JobStatus.EMBEDDING, total_chunks=25, total_batches=3, done_batches=2,
+        created_at=now, updated_at=now,
+    ))
+
+    await queue.start()
+    await asyncio.wait_for(queue.join(), timeout=1)
+    await queue.stop()
+
+    job = queue.get("interrupted")
+    assert job.status == JobStatus.DONE
+    # 残りの5件だけが埋め込まれること
+    assert vector_store.embedded == [f"chunk{i}" for i in range(20, 25)]
+    assert (job.report.new, job.report.reused) == (5, 20)
+    assert len(vector_store.rows) == 25
+
+
+@pytest.mark.asyncio
+async def test_同じファイルの再アップロードは埋め込みを行わないこと(vector_store, processor, tmp_path):
+    queue = _queue(vector_store, processor, tmp_path)
+    await queue.start()
+
+    await queue.submit(tmp_path / "a.pdf", "a.pdf", "t")
+    await asyncio.wait_for(queue.join(), timeout=1)
+    vector_store.embedded.clear()
+    job = await queue.submit(tmp_path / "a.pdf", "a.pdf", "t")
+    await asyncio.wait_for(queue.join(), timeout=1)
+    await queue.stop()
+
+    report = queue.get(job.id).report
+    assert vector_store.embedded == []
+    assert (report.new, report.reused, report.deleted) == (0, 25, 0)
+    assert len(vector_store.rows) == 25
+
+
+@pytest.mark.asyncio
+async def test_失敗したジョブはfailedになること(vector_store, processor, tmp_path):
+    vector_store.fail = RuntimeError("DBに接続できません")
+    queue = _queue(vector_store, processor, tmp_path)
+    await queue.start()
+    upload = tmp_path / "a.pdf"
+    upload.write_bytes(b"dummy")
+
+    job = await queue.submit(upload, "a.pdf", "タイトル")
+    await asyncio.wait_for(queue.join(), timeout=1)
+    await queue.stop()
+
+    failed = queue.get(job.id)
+    assert failed.status == JobStatus.FAILED
+    assert "DBに接続できません" in failed.error
+    assert not upload.exists()
+
+
+@pytest.mark.asyncio
+async def test_再開するジョブがキューの上限より多くても全て処理されること(vector_store, processor, tmp_path):
+    store = JobStore(str(tmp_path / "jobs"))
+    now = time.time()
+    for i in range(3):
+        store.save(IngestionJob(id=f"job{i}", title="t", filename=f"{i}.pdf", file_path=str(tmp_path / f"{i}.pdf"), created_at=now, updated_at=now))
+    queue = IngestionQueue(vector_store, processor, store, workers=1, max_queued=1, batch_size=10)
+
+    await queue.start()
+    await asyncio.wait_for(queue.join(), timeout=1)
+    await queue.stop()
+
+    assert [queue.get(f"job{i}").status for i in range(3)] == [JobStatus.DONE] * 3
+
+
+@pytest.mark.asyncio
+async def test_キューが一杯ならQueueFullになること(vector_store, processor, tmp_path):
+    queue = IngestionQueue(vector_store, processor, JobStore(str(tmp_path / "jobs")), workers=1, max_queued=1)
+
+    await queue.submit(Path("a.pdf"), "a.pdf", "t")
+    with pytest.raises(asyncio.QueueFull):
+        await queue.submit(Path("b.pdf"), "b.pdf", "t")
@@ -4,36 +4,129 @@
 # 必要なこと
 # 大量のドキュメントの用意
 # 100個ずつに分割するロジック
-#　100個渡して少し待ってから次の100個を渡す動作確認
-# 1800個のドキュメントならば、18回追加され、17回の休憩が発生することを確認する
+# ペース配分はレート制限器に任せるので、バッチの間に固定の休憩は入れない
+# 1800個のドキュメントならば、18回追加され、休憩は発生しないことを確認する
+# 429が返った時だけ待ってからやり直すことを確認する
 
 # ====必要なモック====#
 # vectore_store.add メソッドをモック化して、呼び出し回数をカウントする
 # ___init__で使うことが確定している道具である埋め込みモデルとベクトルストアのモック化
 
+import pytest
 from unittest.mock import patch
 from src.vector_store import Vectorstore
 from langchain_core.documents import Document
+from langchain_community.document_loaders import PDFPlumberLoader
+from benchmarks.fakes import write_sample_pdf
+from src.loader import PDFLoader
+
+
+class _QuotaError(Exception):
+    code = 429
+
 
 def test_大量のデータが送られてきた時にバッチ処理を施す():
     # 準備
     large_number_docs = [Document(page_content="test")]*1800
     with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), \
-         patch("src.vector_store.InMemoryVectorStore") as MockVectorStore, \
+         patch("src.vector_store.PGVector") as MockVectorStore, \
          patch("src.vector_store.sleep", return_value=None) as mock_sleep:
 
     # 実行
         mock_store_instance = MockVectorStore.return_value
         db = Vectorstore(embedding_model="dummy-model")
 
-        db.add(large_number_docs, batch_size=100, sleep_time=mock_sleep)
+        db.add(large_number_docs, batch_size=100)
 
 
     # 検証
         assert mock_store_instance.add_documents.call_count == 18
-        assert mock_sleep.call_count == 17
+        assert mock_sleep.call_count == 0
+
+
+def test_429が返った時だけ待ってからやり直す():
+    docs = [Document(page_content="test")]*200
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), \
+         patch("src.vector_store.PGVector") as MockVectorStore, \
+         patch("src.vector_store.sleep", return_value=None) as mock_sleep:
+        mock_store_instance = MockVectorStore.return_value
+        mock_store_instance.add_documents.side_effect = [None, _QuotaError(), None]
+        db = Vectorstore(embedding_model="dummy-model")
+
+        db.add(docs, batch_size=100)
+
+        assert mock_store_instance.add_documents.call_count == 3
+        assert mock_sleep.call_count == 1
+
+
+def test_429以外のエラーはやり直さない():
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), \
+         patch("src.vector_store.PGVector") as MockVectorStore, \
+         patch("src.vector_store.sleep", return_value=None) as mock_sleep:
+        MockVectorStore.return_value.add_documents.side_effect = RuntimeError("boom")
+        db = Vectorstore(embedding_model="dummy-model")
+
+        with pytest.raises(RuntimeError):
+            db.add([Document(page_content="test")], batch_size=100)
+        assert mock_sleep.call_count == 0
+
+
+
+
+
+
+# ====PDFの逐次・並列読み込み==== #
+# PDFPlumberLoaderで一気に読んだ時と、ページ順・page・本文が同じになることを確認する
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    path = tmp_path / "sample.pdf"
+    write_sample_pdf(str(path), pages=5, lines_per_page=3)
+    return str(path)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ページ並列で読んでも一括で読んだ時と同じ結果になること(sample_pdf, workers):
+    expected = PDFPlumberLoader(file_path=sample_pdf).load()
+
+    loader = PDFLoader(sample_pdf, workers=workers, pages_per_task=2)
+    pages = list(loader._iter_extract())
+
+    assert [d.metadata["page"] for d in pages] == [0, 1, 2, 3, 4]
+    assert [d.page_content for d in pages] == [d.page_content for d in expected]
+    assert [d.metadata for d in pages] == [d.metadata for d in expected]
+    assert loader.load() == loader.text_splitter.split_documents(expected)
+
+
+def test_存在しないPDFはValueErrorになること(tmp_path):
+    with pytest.raises(ValueError):
+        PDFLoader(str(tmp_path / "missing.pdf")).load()
+
+
+def test_別々のスレッドから同時に呼ばれてもプロセスプールは1つだけ作ること(monkeypatch):
+    import threading
+    import time
+    from src import loader
+
+    created = []
 
+    class SlowPool:
+        def __init__(self, **kwargs):
+            time.sleep(0.01)  # 作っている間に他のスレッドが割り込めるようにする
+            created.append(self)
 
+        def shutdown(self, wait):
+            pass
 
+    monkeypatch.setattr(loader, "ProcessPoolExecutor", SlowPool)
+    monkeypatch.setattr(loader, "_pool", None)
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(loader._get_pool(2))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
 
+    assert len(created) == 1
+    assert all(p is created[0] for p in pools)
 
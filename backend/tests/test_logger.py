@@ -0,0 +1,106 @@
+# ここでテストしたいこと
+# ログを出す側はキューに積むだけで、ファイルへの書き込みを待たないこと
+# 長すぎるメッセージは切り詰めて書き込まれること
+# DEBUGのログはN件に1件だけ残ること
+# ログファイルが大きくなったら切り替わること
+# 子プロセスはログファイルを開かず、親プロセスのキュー経由で書き込まれること
+
+import logging
+import logging.handlers
+import time
+import pytest
+from src import config
+import logger as logger_module
+from logger import LoggerManager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "LOG_LEVEL", "DEBUG")
+    monkeypatch.setattr(config, "LOG_MAX_MESSAGE_CHARS", 50)
+    monkeypatch.setattr(config, "LOG_DEBUG_SAMPLE_EVERY", 3)
+    created = []
+
+    def _create(name):
+        m = LoggerManager()
+        created.append(m)
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.propagate = False  # pytestがルートに付けるハンドラの影響を受けないように
+        return m, m.get_logger(name)
+
+    yield _create
+    for m in created:
+        m.shutdown()
+
+
+def _read(tmp_path, name="log.txt"):
+    return (tmp_path / name).read_text(encoding="utf-8")
+
+
+def test_ログを出す側はファイルへの書き込みを待たないこと(manager, tmp_path, monkeypatch):
+    original = logging.handlers.RotatingFileHandler.emit
+
+    def slow_emit(self, record):
+        time.sleep(0.2)
+        original(self, record)
+
+    monkeypatch.setattr(logging.handlers.RotatingFileHandler, "emit", slow_emit)
+    m, logger = manager("test.logger.slow")
+
+    started = time.perf_counter()
+    logger.info("遅いディスク")
+    assert time.perf_counter() - started < 0.1
+
+    m.shutdown()  # 残っているログを書き切る
+    assert "遅いディスク" in _read(tmp_path)
+
+
+def test_長すぎるメッセージは切り詰められること(manager, tmp_path):
+    m, logger = manager("test.logger.truncate")
+    logger.info("あ" * 120)
+    m.shutdown()
+    text = _read(tmp_path)
+    assert "あ" * 50 + "… (+70 chars)" in text
+    assert "あ" * 51 not in text
+
+
+def test_DEBUGのログはN件に1件だけ残ること(manager, tmp_path):
+    m, logger = manager("test.logger.sampling")
+    for i in range(6):
+        logger.debug(f"dump {i}")
+    logger.info("info")
+    m.shutdown()
+    text = _read(tmp_path)
+    assert [f"dump {i}" in text for i in range(6)] == [True, False, False, True, False, False]
+    assert "info" in text
+
+
+def test_ログファイルが大きくなったら切り替わること(manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "LOG_MAX_BYTES", 200)
+    m, logger = manager("test.logger.rotate")
+    for i in range(20):
+        logger.info(f"line {i}")
+    m.shutdown()
+    assert (tmp_path / "log.txt.1").exists()
+    assert len(_read(tmp_path).encode("utf-8")) <= 200
+
+
+def test_子プロセスのログはファイルを開かず親プロセス経由で書き込まれること(manager, tmp_path, monkeypatch):
+    m, _ = manager("test.logger.parent")
+    log_queue = m.worker_queue()
+
+    # 子プロセスのinitializerで呼ぶものと同じ。この後のget_loggerは子プロセス用になる
+    monkeypatch.setattr(logger_module, "_manager", None)
+    logger_module.init_worker_logging(log_queue)
+    worker_logger = logger_module.get_logger("test.logger.worker")
+    worker_logger.propagate = False
+    try:
+        assert not any(isinstance(h, logging.FileHandler) for h in worker_logger.handlers)
+        worker_logger.info("子プロセスから")
+        m.shutdown()
+    finally:
+        worker_logger.handlers.clear()
+
+    assert "[test.logger.worker] INFO: 子プロセスから" in _read(tmp_path)
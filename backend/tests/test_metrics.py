@@ -0,0 +1,104 @@
+# ここでテストしたいこと
+# trackで包んだ関数（同期・async）の所要時間と実行中の数が記録されること（例外で終わっても）
+# レート制限器を通した呼び出しの時間・トークン数・429の回数が記録されること
+# キャッシュの段ごとのヒット数・同じ質問の相乗りの回数・埋め込みのバッチの待ち時間などが、/metricsが読まれた時に写されること
+# /metricsがPrometheusのテキスト形式で返ること
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry, Gauge, Histogram
+from src.metrics import StatsCollector, track
+from src.rate_limiter import RateLimiter
+
+
+def _sample(registry, name, labels=None):
+    return registry.get_sample_value(name, labels or {})
+
+
+@pytest.mark.asyncio
+async def test_asyncの関数の所要時間と実行中の数が記録されること():
+    registry = CollectorRegistry()
+    histogram = Histogram("t_seconds", "t", ["stage"], registry=registry)
+    gauge = Gauge("t_in_flight", "t", ["stage"], registry=registry)
+    seen = []
+
+    @track(histogram, gauge, stage="hyde")
+    async def work():
+        seen.append(_sample(registry, "t_in_flight", {"stage": "hyde"}))
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    assert await work() == "ok"
+    assert seen == [1.0]
+    assert _sample(registry, "t_in_flight", {"stage": "hyde"}) == 0.0
+    assert _sample(registry, "t_seconds_count", {"stage": "hyde"}) == 1.0
+    assert _sample(registry, "t_seconds_sum", {"stage": "hyde"}) >= 0.01
+
+
+def test_例外で終わった呼び出しも記録されること():
+    registry = CollectorRegistry()
+    histogram = Histogram("t_seconds", "t", registry=registry)
+
+    @track(histogram)
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        fail()
+    assert _sample(registry, "t_seconds_count") == 1.0
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+@pytest.mark.asyncio
+async def test_レート制限器を通した呼び出しが記録されること():
+    from prometheus_client import REGISTRY
+    limiter = RateLimiter("metrics-test", requests_per_minute=6000, tokens_per_minute=1_000_000, max_concurrency=2, min_backoff=0.0)
+    labels = {"api": "metrics-test"}
+
+    async with limiter.acquire(tokens=10):
+        assert _sample(REGISTRY, "api_in_flight", labels) == 1.0
+    with pytest.raises(QuotaExceeded):
+        async with limiter.acquire(tokens=5):
+            raise QuotaExceeded()
+
+    assert _sample(REGISTRY, "api_in_flight", labels) == 0.0
+    assert _sample(REGISTRY, "api_call_seconds_count", labels) == 2.0
+    assert _sample(REGISTRY, "api_tokens_total", labels) == 15.0
+    assert _sample(REGISTRY, "api_errors_total", labels) == 1.0
+    assert _sample(REGISTRY, "api_rate_limited_total", labels) == 1.0
+    assert _sample(REGISTRY, "api_wait_seconds_count", {**labels, "priority": "interactive"}) == 2.0
+
+
+def test_キャッシュの段ごとの累計が写されること():
+    registry = CollectorRegistry()
+    stats = {
+        "cache": {"corpus_version": 3, "exact": {"hits": 4, "misses": 6, "stale": 1, "revalidated": 1, "hit_ratio": 0.4, "size": 10}},
+        "limiters": {"llm": {"concurrency_limit": 8, "waiting": 2}},
+        "singleflight": {"in_flight": 1, "executions": 7, "collapsed": 3},
+        "embedding_batchers": {"models/gemini-embedding-001": {"max_queue_delay_ms": 4.0}},
+    }
+    registry.register(StatsCollector(lambda: stats))
+
+    assert _sample(registry, "chat_cache_requests_total", {"tier": "exact", "result": "hits"}) == 4
+    assert _sample(registry, "chat_cache_requests_total", {"tier": "exact", "result": "misses"}) == 6
+    assert _sample(registry, "chat_cache_entries", {"tier": "exact"}) == 10
+    assert _sample(registry, "api_concurrency_limit", {"api": "llm"}) == 8
+    assert _sample(registry, "api_waiting", {"api": "llm"}) == 2
+    assert _sample(registry, "chat_singleflight_runs_total", {"result": "collapsed"}) == 3
+    assert _sample(registry, "chat_singleflight_runs_total", {"result": "executions"}) == 7
+    assert _sample(registry, "chat_singleflight_in_flight") == 1
+    assert _sample(registry, "embedding_batch_max_queue_delay_seconds", {"model": "models/gemini-embedding-001"}) == 0.004
+
+
+def test_metricsがPrometheusの形式で返ること():
+    from src.app.main import app
+    client = TestClient(app)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "chat_graph_node_seconds" in response.text
+    assert "chat_cache_requests_total" in response.text  # 埋め込みのメモはBotの準備前でも出る
@@ -0,0 +1,162 @@
+# ここでテストしたいこと
+# クォータを守る偽の埋め込みAPIに大量に投げても、429から同時実行数を絞って全部成功すること
+# トークン数/分のバケットが空になったら、補充されるまで待たされること
+# 待っている呼び出しは、対話(INTERACTIVE)が取り込み(BULK)より先に通ること
+# 取り込みだけで同時実行数を使い切らず、対話用の枠が残ること
+# 429の判定は例外の属性で行い、メッセージの文字列では判定しないこと
+
+import asyncio
+import time
+import pytest
+from langchain_core.embeddings import Embeddings
+from src.embeddings import RateLimitedEmbeddings
+from src.rate_limiter import Priority, RateLimiter, is_rate_limit_error
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+class QuotaEmbeddings(Embeddings):
+    """同時にmax_concurrent件を超えて呼ばれたら429を返す、偽の埋め込みAPI"""
+    def __init__(self, max_concurrent:int, latency:float = 0.01):
+        self._max_concurrent = max_concurrent
+        self._latency = latency
+        self._in_flight = 0
+        self.rejected = 0
+        self.served = 0
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    async def aembed_documents(self, texts, **kwargs):
+        if self._in_flight >= self._max_concurrent:
+            self.rejected += 1
+            raise QuotaExceeded("RESOURCE_EXHAUSTED")
+        self._in_flight += 1
+        try:
+            await asyncio.sleep(self._latency)
+            self.served += 1
+            return [[float(len(t)), 1.0] for t in texts]
+        finally:
+            self._in_flight -= 1
+
+
+def _limiter(**kwargs):
+    settings = {"requests_per_minute": 100_000, "tokens_per_minute": 10_000_000, "max_concurrency": 16, "min_backoff": 0.01, "max_backoff": 0.05}
+    settings.update(kwargs)
+    return RateLimiter("test", **settings)
+
+
+@pytest.mark.asyncio
+async def test_クォータを超えたら同時実行数を絞って全部成功すること():
+    endpoint = QuotaEmbeddings(max_concurrent=3)
+    limiter = _limiter()
+    embeddings = RateLimitedEmbeddings(endpoint, limiter)
+
+    results = await asyncio.gather(*[embeddings.aembed_documents([f"chunk{i}"]) for i in range(40)])
+
+    assert len(results) == 40
+    assert endpoint.served == 40
+    assert endpoint.rejected > 0
+    assert limiter.rate_limited > 0
+    assert limiter.concurrency_limit < 16
+
+
+@pytest.mark.asyncio
+async def test_トークンのバケットが空になったら補充まで待つこと():
+    # 600トークン/分 = 10トークン/秒
+    limiter = _limiter(tokens_per_minute=600)
+    async with limiter.acquire(tokens=600):
+        pass
+
+    started = time.perf_counter()
+    async with limiter.acquire(tokens=2):
+        pass
+    assert time.perf_counter() - started >= 0.15
+
+
+@pytest.mark.asyncio
+async def test_対話の呼び出しが取り込みより先に通ること():
+    limiter = _limiter(max_concurrency=1, interactive_reserve=0)
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.acquire(priority=Priority.BULK):
+            await release.wait()
+
+    async def call(name, priority):
+        async with limiter.acquire(priority=priority):
+            order.append(name)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiting = [asyncio.create_task(call(f"bulk{i}", Priority.BULK)) for i in range(3)]
+    await asyncio.sleep(0)
+    waiting.append(asyncio.create_task(call("chat", Priority.INTERACTIVE)))
+    await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(holder, *waiting)
+
+    assert order[0] == "chat"
+    assert order[1:] == ["bulk0", "bulk1", "bulk2"]
+
+
+@pytest.mark.asyncio
+async def test_取り込みだけで同時実行数を使い切らないこと():
+    limiter = _limiter(max_concurrency=2, interactive_reserve=1)
+    release = asyncio.Event()
+    entered = []
+
+    async def call(name, priority):
+        async with limiter.acquire(priority=priority):
+            entered.append(name)
+            await release.wait()
+
+    tasks = [asyncio.create_task(call(f"bulk{i}", Priority.BULK)) for i in range(2)]
+    await asyncio.sleep(0.01)
+    assert entered == ["bulk0"]
+
+    tasks.append(asyncio.create_task(call("chat", Priority.INTERACTIVE)))
+    await asyncio.sleep(0.01)
+    assert entered == ["bulk0", "chat"]
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert entered[-1] == "bulk1"
+
+
+@pytest.mark.asyncio
+async def test_成功が続けば同時実行数が戻ること():
+    limiter = _limiter(max_concurrency=4)
+    with pytest.raises(QuotaExceeded):
+        async with limiter.acquire():
+            raise QuotaExceeded()
+    assert limiter.concurrency_limit == 2
+
+    for _ in range(10):
+        async with limiter.acquire():
+            pass
+    assert limiter.concurrency_limit == 4
+
+
+def test_429の判定は例外の属性で行うこと():
+    class ClientError(Exception):
+        def __init__(self):
+            super().__init__("429 RESOURCE_EXHAUSTED")
+            self.code = 429
+
+    try:
+        try:
+            raise ClientError()
+        except ClientError as e:
+            raise RuntimeError("Error embedding content") from e
+    except RuntimeError as wrapped:
+        assert is_rate_limit_error(wrapped)
+
+    assert not is_rate_limit_error(RuntimeError("429 quota exceeded"))
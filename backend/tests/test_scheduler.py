@@ -0,0 +1,119 @@
+# ここでテストしたいこと
+# 同時実行数がmax_concurrencyを超えないこと
+# 待っている呼び出しは、リクエストごとに順番に通されること（先に大量に積んだリクエストが他を待たせない）
+# 待ち行列が一杯なら429、待ち時間の上限を超えたら503で、Retry-Afterの秒数付きで断ること
+# 待っている間にキャンセルされたら、待ち行列から抜けること
+# /chatは混んでいる時に429とRetry-Afterヘッダーを返すこと
+
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from src.scheduler import FairScheduler, LLMScheduler, Overloaded, request_scope
+
+
+async def _hold(scheduler, seconds, log=None, label=None, request_id=None):
+    with request_scope(request_id):
+        async with scheduler.slot():
+            if log is not None:
+                log.append(label)
+            await asyncio.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_同時実行数が上限を超えないこと():
+    scheduler = FairScheduler("test", max_concurrency=2, max_queue=100, max_wait=5.0)
+    running, peak = 0, 0
+
+    async def work():
+        nonlocal running, peak
+        async with scheduler.slot():
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(work() for _ in range(10)))
+    assert peak == 2
+    assert scheduler.stats()["granted"] == 10
+    assert scheduler.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_待っている呼び出しはリクエストごとに順番に通されること():
+    scheduler = FairScheduler("test", max_concurrency=1, max_queue=100, max_wait=5.0)
+    log = []
+    blocker = asyncio.create_task(_hold(scheduler, 0.02))
+    await asyncio.sleep(0)
+    # Aが先に4件積み、その後でBが2件積む
+    tasks = [asyncio.create_task(_hold(scheduler, 0.001, log, "A", "A")) for _ in range(4)]
+    tasks += [asyncio.create_task(_hold(scheduler, 0.001, log, "B", "B")) for _ in range(2)]
+    await asyncio.gather(blocker, *tasks)
+    assert log == ["A", "B", "A", "B", "A", "A"]
+
+
+@pytest.mark.asyncio
+async def test_待ち行列が一杯なら429で断ること():
+    scheduler = FairScheduler("test", max_concurrency=1, max_queue=1, max_wait=5.0)
+    blocker = asyncio.create_task(_hold(scheduler, 0.05))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_hold(scheduler, 0.0))
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as e:
+        async with scheduler.slot():
+            pass
+    assert e.value.status_code == 429
+    assert e.value.retry_after >= 1
+    await asyncio.gather(blocker, waiter)
+    assert scheduler.stats()["rejected"]["queue_full"] == 1
+
+
+@pytest.mark.asyncio
+async def test_待ち時間の上限を超えたら503で断ること():
+    scheduler = FairScheduler("test", max_concurrency=1, max_queue=10, max_wait=0.01)
+    blocker = asyncio.create_task(_hold(scheduler, 0.1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as e:
+        async with scheduler.slot():
+            pass
+    assert e.value.status_code == 503
+    assert scheduler.stats()["queued"] == 0
+    await blocker
+    # 抜けた呼び出しの分の枠は残らず、次の呼び出しはすぐに通る
+    async with scheduler.slot():
+        assert scheduler.stats()["in_flight"] == 1
+
+
+@pytest.mark.asyncio
+async def test_待っている間にキャンセルされたら待ち行列から抜けること():
+    scheduler = FairScheduler("test", max_concurrency=1, max_queue=10, max_wait=5.0)
+    blocker = asyncio.create_task(_hold(scheduler, 0.02))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_hold(scheduler, 0.0))
+    await asyncio.sleep(0)
+    assert scheduler.stats()["queued"] == 1
+
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.stats()["queued"] == 0
+    await blocker
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_chatは混んでいる時に429とRetryAfterを返すこと(monkeypatch, mock_chatbot):
+    from src.app.main import app
+    from src.app.dependencies import get_bot
+    from src.app.router import chat
+
+    scheduler = LLMScheduler({"generate": {"max_concurrency": 1, "max_queue": 0, "max_wait": 1.0}})
+    monkeypatch.setattr(chat, "get_llm_scheduler", lambda: scheduler)
+    app.dependency_overrides[get_bot] = lambda: mock_chatbot
+    try:
+        response = TestClient(app).post("/chat/", json={"questions": ["質問1"]})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    mock_chatbot._graph.ainvoke.assert_not_called()
@@ -0,0 +1,60 @@
+# ここでテストしたいこと
+# 同じキーで同時に呼ばれたら1回しか実行されず、全員が同じ結果を受け取ること
+# 終わった後に同じキーで呼ばれたら、もう一度実行されること
+
+import asyncio
+import pytest
+from src.singleflight import SingleFlight, normalize_question
+
+
+@pytest.mark.parametrize("a, b", [
+    ("ともちゃんは誰？", " ともちゃんは誰? "),
+    ("ＡＢＣとは", "abcとは"),
+    ("この小説の\n主題は", "この小説の 主題は"),
+])
+def test_表記ゆれが同じキーになること(a, b):
+    assert normalize_question(a) == normalize_question(b)
+
+
+@pytest.mark.asyncio
+async def test_同時に来た同じキーは1回だけ実行されること():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*[flight.do("q", work) for _ in range(5)])
+
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "executions": 1, "collapsed": 4}
+
+
+@pytest.mark.asyncio
+async def test_終わった後は再実行されること():
+    flight = SingleFlight()
+
+    async def work():
+        return "answer"
+
+    await flight.do("q", work)
+    await flight.do("q", work)
+
+    assert flight.executions == 2
+
+
+@pytest.mark.asyncio
+async def test_例外は相乗りした全員に伝わること():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(flight.do("q", work), flight.do("q", work), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
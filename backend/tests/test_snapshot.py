@@ -0,0 +1,93 @@
+# ここでテストしたいこと
+# 保存したスナップショットが、同じ指紋ならそのまま読み込めること
+# 元の文書・埋め込みモデルが変わったら使われないこと（Webの文書はETag・Last-Modified・本文で見分ける）
+# DBの行がスナップショットと合わなければ、足りない行を書き戻し、余分な行を消すこと
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from src.snapshot import arestore_snapshot, load_snapshot, save_snapshot, source_fingerprint
+
+URL = "https://www.aozora.gr.jp/cards/000076/files/novel.html"
+
+
+def test_保存したスナップショットを読み込めること(tmp_path):
+    docs = [Document(id=f"id{i}", page_content=f"本文{i}", metadata={"page": i}) for i in range(3)]
+    vectors = np.arange(6, dtype=np.float32).reshape(3, 2)
+
+    save_snapshot(str(tmp_path / "snap"), docs, vectors, "fp")
+    snapshot = load_snapshot(str(tmp_path / "snap"), "fp")
+
+    assert len(snapshot) == 3
+    assert snapshot.documents[1] == docs[1]
+    assert isinstance(snapshot.vectors, np.memmap)
+    np.testing.assert_array_equal(snapshot.vectors, vectors)
+
+
+def test_指紋が違えば読み込まないこと(tmp_path):
+    save_snapshot(str(tmp_path / "snap"), [Document(page_content="a")], [[1.0]], "old")
+
+    assert load_snapshot(str(tmp_path / "snap"), "new") is None
+
+
+def test_スナップショットが無ければNoneを返すこと(tmp_path):
+    assert load_snapshot(str(tmp_path / "missing"), "fp") is None
+
+
+def test_元の文書かモデルが変われば指紋が変わること(tmp_path):
+    source = tmp_path / "doc.pdf"
+    source.write_bytes(b"version1")
+    first = source_fingerprint(str(source), "model-a")
+
+    assert source_fingerprint(str(source), "model-a") == first
+    assert source_fingerprint(str(source), "model-b") != first
+    source.write_bytes(b"version2")
+    assert source_fingerprint(str(source), "model-a") != first
+
+
+def _response(headers=None, content=b""):
+    return SimpleNamespace(headers=headers or {}, content=content, raise_for_status=lambda: None)
+
+
+def test_Webの文書はETagが変われば指紋が変わること():
+    with patch("src.snapshot.requests.head", return_value=_response({"ETag": '"v1"'})):
+        first = source_fingerprint(URL, "model-a")
+        assert source_fingerprint(URL, "model-a") == first
+    with patch("src.snapshot.requests.head", return_value=_response({"ETag": '"v2"'})):
+        assert source_fingerprint(URL, "model-a") != first
+
+
+def test_ETagが無ければWebの文書の本文で指紋を作ること():
+    with patch("src.snapshot.requests.head", return_value=_response()), \
+         patch("src.snapshot.requests.get", return_value=_response(content=b"version1")) as get:
+        first = source_fingerprint(URL, "model-a")
+        get.return_value = _response(content=b"version2")
+        assert source_fingerprint(URL, "model-a") != first
+
+
+def _snapshot(tmp_path, n):
+    docs = [Document(id=f"id{i}", page_content=f"本文{i}", metadata={"source_file": "doc.pdf"}) for i in range(n)]
+    save_snapshot(str(tmp_path / "snap"), docs, np.arange(n * 2, dtype=np.float32).reshape(n, 2), "fp")
+    return load_snapshot(str(tmp_path / "snap"), "fp")
+
+
+@pytest.mark.asyncio
+async def test_DBの行がスナップショットと合えば何もしないこと(tmp_path):
+    store = SimpleNamespace(aget_ids_by_metadata=AsyncMock(return_value=["id0", "id1", "id2"]), adelete=AsyncMock(), aadd_with_vectors=AsyncMock())
+
+    assert await arestore_snapshot(store, _snapshot(tmp_path, 3), "doc.pdf") == (0, 0)
+    store.adelete.assert_not_awaited()
+    store.aadd_with_vectors.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_DBの行が足りなければスナップショットのベクトルで書き戻すこと(tmp_path):
+    store = SimpleNamespace(aget_ids_by_metadata=AsyncMock(return_value=["id1", "old"]), adelete=AsyncMock(), aadd_with_vectors=AsyncMock())
+
+    assert await arestore_snapshot(store, _snapshot(tmp_path, 5), "doc.pdf", batch_size=2) == (4, 1)
+    store.adelete.assert_awaited_once_with(["old"])
+    written = [doc.id for call in store.aadd_with_vectors.await_args_list for doc in call.args[0]]
+    assert written == ["id0", "id2", "id3", "id4"]
+    np.testing.assert_array_equal(store.aadd_with_vectors.await_args_list[0].args[1], [[0, 1], [4, 5]])
@@ -0,0 +1,60 @@
+# ここでテストしたいこと
+# VectorIndexがPGVector(COSINE)と同じ「1 - コサイン類似度」の距離を返すこと
+# 容量を超えて追加しても正しく検索できること
+# retainで行をまとめて取り除いても、残りの行が正しく検索できること
+
+import numpy as np
+import pytest
+from src.vector_index import VectorIndex
+
+
+def test_空の索引は空のリストを返すこと():
+    index = VectorIndex()
+    assert index.search([1.0, 0.0], k=1) == []
+
+
+def test_コサイン距離が小さい順に返ること():
+    index = VectorIndex()
+    index.add_many([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], ["x", "y", "xy"])
+
+    result = index.search([2.0, 0.1], k=3)
+
+    assert [payload for payload, _ in result] == ["x", "xy", "y"]
+    assert result[0][1] == pytest.approx(1 - 2.0 / np.linalg.norm([2.0, 0.1]), abs=1e-6)
+    assert result[2][1] == pytest.approx(1 - 0.1 / np.linalg.norm([2.0, 0.1]), abs=1e-6)
+
+
+def test_初期容量を超えても全件検索できること():
+    index = VectorIndex(initial_capacity=2)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8))
+    for i, v in enumerate(vectors):
+        index.add(v, i)
+
+    assert len(index) == 50
+    for i in (0, 17, 49):
+        payload, distance = index.search(vectors[i], k=1)[0]
+        assert payload == i
+        assert distance == pytest.approx(0.0, abs=1e-5)
+
+
+def test_次元が違うベクトルはエラーになること():
+    index = VectorIndex()
+    index.add([1.0, 0.0], "x")
+    with pytest.raises(ValueError):
+        index.add([1.0, 0.0, 0.0], "y")
+
+
+def test_retainで取り除いた後も残りの行が検索できること():
+    index = VectorIndex(initial_capacity=2)
+    vectors = np.eye(16, dtype=np.float32)
+    index.add_many(vectors, list(range(16)))
+
+    removed = index.retain(lambda payload: payload % 4 == 0)
+
+    assert removed == [i for i in range(16) if i % 4]
+    assert len(index) == 4
+    for i in (0, 4, 8, 12):
+        payload, distance = index.search(vectors[i], k=1)[0]
+        assert payload == i
+        assert distance == pytest.approx(0.0, abs=1e-6)
@@ -3,3 +3,163 @@
 # やらなければいけないこと
 # 
 
+
+# ====取り込みのパイプライン==== #
+# 埋め込みと書き込みが並行して進み、全てのチャンクが書き込まれること
+# 1つのバッチが失敗しても、他のバッチは書き込まれること
+# 書き込みが遅い時は、キューの上限で埋め込みが先に進み過ぎないこと
+# asyncのイテレータで渡したチャンクは、読んだそばからバッチにして流されること
+
+import asyncio
+import pytest
+from langchain_core.documents import Document
+from src.vector_store import IngestionPipeline
+
+
+def _docs(n):
+    return [Document(id=str(i), page_content=f"チャンク{i}") for i in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_埋め込みと書き込みが並行して全て書き込まれること():
+    written = []
+    embedding_while_writing = False
+    embedding = 0
+
+    async def embed(texts):
+        nonlocal embedding
+        embedding += 1
+        await asyncio.sleep(0.01)
+        embedding -= 1
+        return [[float(len(t))] for t in texts]
+
+    async def write(docs, vectors):
+        nonlocal embedding_while_writing
+        await asyncio.sleep(0.01)
+        embedding_while_writing |= embedding > 0
+        written.extend(d.id for d in docs)
+
+    progress = []
+    async def on_batch(done, total):
+        progress.append((done, total))
+
+    result = await IngestionPipeline(embed, write, batch_size=10, embed_workers=3, queue_size=2).run(_docs(95), on_batch=on_batch)
+
+    assert sorted(written, key=int) == [str(i) for i in range(95)]
+    assert result.written == 95
+    assert result.failures == []
+    assert embedding_while_writing
+    assert progress[-1] == (10, 10)
+
+
+@pytest.mark.asyncio
+async def test_失敗したバッチ以外は書き込まれること():
+    written = []
+
+    async def embed(texts):
+        if "チャンク10" in texts:
+            raise RuntimeError("埋め込みに失敗")
+        return [[0.0] for _ in texts]
+
+    async def write(docs, vectors):
+        if docs[0].id == "20":
+            raise RuntimeError("書き込みに失敗")
+        written.extend(d.id for d in docs)
+
+    result = await IngestionPipeline(embed, write, batch_size=10, embed_workers=2).run(_docs(40))
+
+    assert result.written == 20
+    assert result.failed == 20
+    assert sorted((f.index, f.stage) for f in result.failures) == [(1, "embed"), (2, "write")]
+    assert sorted(written, key=int) == [str(i) for i in list(range(10)) + list(range(30, 40))]
+
+
+@pytest.mark.asyncio
+async def test_書き込みが遅い時は埋め込みが先に進み過ぎないこと():
+    embedded = 0
+    release = asyncio.Event()
+
+    async def embed(texts):
+        nonlocal embedded
+        embedded += 1
+        return [[0.0] for _ in texts]
+
+    async def write(docs, vectors):
+        await release.wait()
+
+    task = asyncio.create_task(IngestionPipeline(embed, write, batch_size=1, embed_workers=2, queue_size=2).run(_docs(50)))
+    await asyncio.sleep(0.05)
+    # 書き込み中の1件 + キューの2件 + キューに入れようとして待っている埋め込み2本
+    assert embedded <= 5
+
+    release.set()
+    result = await task
+    assert result.written == 50
+
+
+@pytest.mark.asyncio
+async def test_asyncのイテレータは読んだそばからバッチにして流されること():
+    read = 0
+    read_when_embedded = []
+
+    async def documents():
+        nonlocal read
+        for doc in _docs(25):
+            read += 1
+            yield doc
+
+    async def embed(texts):
+        read_when_embedded.append(read)
+        return [[0.0] for _ in texts]
+
+    async def write(docs, vectors):
+        pass
+
+    progress = []
+    async def on_batch(done, total):
+        progress.append((done, total))
+
+    result = await IngestionPipeline(embed, write, batch_size=10, embed_workers=1, queue_size=1).run(documents(), on_batch=on_batch)
+
+    assert (result.total, result.written) == (25, 25)
+    # 最初のバッチは、全てのチャンクを読み終える前に埋め込まれること
+    assert read_when_embedded[0] < 25
+    assert progress[-1] == (3, 3)
+
+
+# ====COPYでの一括書き込み==== #
+# COPYで送る行が、PGVectorと同じ列（ID・float32のベクトル・本文・JSONBのメタデータ）になること
+# bulk_insertの時だけCOPYで書き込むこと
+
+from unittest.mock import AsyncMock, patch
+import numpy as np
+from psycopg.types.json import Jsonb
+from src.vector_store import Vectorstore, _copy_rows
+
+
+def test_COPYで送る行がPGVectorと同じ列になること():
+    docs = [Document(id="a", page_content="本文", metadata={"page": 1}), Document(page_content="IDなし")]
+
+    rows = _copy_rows(docs, [[0.1, 0.2], [0.3, 0.4]])
+
+    assert rows[0][0] == "a"
+    assert rows[1][0]  # IDが無ければuuidを振る
+    assert rows[0][1].dtype == np.float32
+    assert rows[0][2] == "本文"
+    assert isinstance(rows[0][3], Jsonb) and rows[0][3].obj == {"page": 1}
+    with pytest.raises(ValueError):
+        _copy_rows(docs, [[0.1, 0.2]])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bulk_insert, expected", [(True, 1), (False, 0)])
+async def test_bulk_insertの時だけCOPYで書き込むこと(bulk_insert, expected):
+    with patch("src.vector_store.GoogleGenerativeAIEmbeddings"), patch("src.vector_store.PGVector") as MockVectorStore:
+        MockVectorStore.return_value.aadd_embeddings = AsyncMock(return_value=["a"])
+        db = Vectorstore(embedding_model="dummy-model", bulk_insert=bulk_insert)
+        db.acopy_with_vectors = AsyncMock(return_value=["a"])
+
+        await db.aadd_with_vectors(_docs(1), [[0.1]])
+
+        assert db.acopy_with_vectors.await_count == expected
+        assert MockVectorStore.return_value.aadd_embeddings.await_count == 1 - expected
@@ -331,7 +331,7 @@ const UploadInterface = () => {
 
       toast({
         title: "Upload Successful",
-        description: `${res.data.processed_pages} ページをデータベースに登録しました。`,
+        description: `アップロードを受け付けました。バックグラウンドで登録しています（ジョブID: ${res.data.job_id}）。`,
         status: "success",
         duration: 5000,
         isClosable: true,
@@ -4,12 +4,17 @@
  * Aozora RAG API
  * OpenAPI spec version: 0.1.0
  */
-import { useMutation } from "@tanstack/react-query";
+import { useMutation, useQuery } from "@tanstack/react-query";
 import type {
+  DataTag,
   MutationFunction,
   QueryClient,
+  QueryFunction,
+  QueryKey,
   UseMutationOptions,
   UseMutationResult,
+  UseQueryOptions,
+  UseQueryResult,
 } from "@tanstack/react-query";
 
 import * as axios from "axios";
@@ -20,6 +25,7 @@ import type {
   ChatInput,
   ChatOutput,
   HTTPValidationError,
+  IngestionJob,
   UploadResponse,
 } from "./model";
 
@@ -106,7 +112,8 @@ export const useChatEndpointChatPost = <
 };
 
 /**
- * ファイルをアップロードし、ドキュメントとして処理します。
+ * ファイルを受け付け、取り込みジョブとして登録します。
+解析・埋め込みは裏で行われるので、進み具合は GET /upload/jobs/{job_id} で確認してください。
 
 - **file**: アップロードするファイル
 - **title**: ユーザーが指定するタイトル
@@ -194,3 +201,89 @@ export const useUploadFile = <
 
   return useMutation(mutationOptions, queryClient);
 };
+
+/**
+ * 取り込みジョブの状態（queued / parsing / embedding n/m / done / failed）を返します。
+ * @summary Get Upload Job
+ */
+export const getUploadJob = (
+  jobId: string,
+  options?: AxiosRequestConfig,
+): Promise<AxiosResponse<IngestionJob>> => {
+  return axios.default.get(
+    `http://localhost:8005/upload/jobs/${jobId}`,
+    options,
+  );
+};
+
+export const getGetUploadJobQueryKey = (jobId?: string) => {
+  return [`http://localhost:8005/upload/jobs/${jobId}`] as const;
+};
+
+export const getGetUploadJobQueryOptions = <
+  TData = Awaited<ReturnType<typeof getUploadJob>>,
+  TError = AxiosError<HTTPValidationError>,
+>(
+  jobId: string,
+  options?: {
+    query?: Partial<
+      UseQueryOptions<Awaited<ReturnType<typeof getUploadJob>>, TError, TData>
+    >;
+    axios?: AxiosRequestConfig;
+  },
+) => {
+  const { query: queryOptions, axios: axiosOptions } = options ?? {};
+
+  const queryKey = queryOptions?.queryKey ?? getGetUploadJobQueryKey(jobId);
+
+  const queryFn: QueryFunction<Awaited<ReturnType<typeof getUploadJob>>> = ({
+    signal,
+  }) => getUploadJob(jobId, { signal, ...axiosOptions });
+
+  return {
+    queryKey,
+    queryFn,
+    enabled: !!jobId,
+    ...queryOptions,
+  } as UseQueryOptions<
+    Awaited<ReturnType<typeof getUploadJob>>,
+    TError,
+    TData
+  > & { queryKey: DataTag<QueryKey, TData, TError> };
+};
+
+export type GetUploadJobQueryResult = NonNullable<
+  Awaited<ReturnType<typeof getUploadJob>>
+>;
+export type GetUploadJobQueryError = AxiosError<HTTPValidationError>;
+
+/**
+ * @summary Get Upload Job
+ */
+
+export function useGetUploadJob<
+  TData = Awaited<ReturnType<typeof getUploadJob>>,
+  TError = AxiosError<HTTPValidationError>,
+>(
+  jobId: string,
+  options?: {
+    query?: Partial<
+      UseQueryOptions<Awaited<ReturnType<typeof getUploadJob>>, TError, TData>
+    >;
+    axios?: AxiosRequestConfig;
+  },
+  queryClient?: QueryClient,
+): UseQueryResult<TData, TError> & {
+  queryKey: DataTag<QueryKey, TData, TError>;
+} {
+  const queryOptions = getGetUploadJobQueryOptions(jobId, options);
+
+  const query = useQuery(queryOptions, queryClient) as UseQueryResult<
+    TData,
+    TError
+  > & { queryKey: DataTag<QueryKey, TData, TError> };
+
+  query.queryKey = queryOptions.queryKey;
+
+  return query;
+}
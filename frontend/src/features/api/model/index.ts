@@ -13,6 +13,11 @@ export * from "./chatInputQuestions";
 export * from "./chatOutput";
 export * from "./chatOutputResponses";
 export * from "./hTTPValidationError";
+export * from "./ingestionJob";
+export * from "./ingestionJobError";
+export * from "./ingestionJobReport";
+export * from "./ingestionReport";
+export * from "./jobStatus";
 export * from "./sourceItem";
 export * from "./uploadResponse";
 export * from "./validationError";
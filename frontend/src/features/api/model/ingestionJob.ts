@@ -0,0 +1,24 @@
+/**
+ * Generated by orval v7.17.0 🍺
+ * Do not edit manually.
+ * Aozora RAG API
+ * OpenAPI spec version: 0.1.0
+ */
+import type { IngestionJobError } from "./ingestionJobError";
+import type { IngestionJobReport } from "./ingestionJobReport";
+import type { JobStatus } from "./jobStatus";
+
+export interface IngestionJob {
+  id: string;
+  title: string;
+  filename: string;
+  file_path: string;
+  status?: JobStatus;
+  total_chunks?: number;
+  total_batches?: number;
+  done_batches?: number;
+  error?: IngestionJobError;
+  report?: IngestionJobReport;
+  created_at: number;
+  updated_at: number;
+}
@@ -0,0 +1,8 @@
+/**
+ * Generated by orval v7.17.0 🍺
+ * Do not edit manually.
+ * Aozora RAG API
+ * OpenAPI spec version: 0.1.0
+ */
+
+export type IngestionJobError = string | null;
@@ -0,0 +1,9 @@
+/**
+ * Generated by orval v7.17.0 🍺
+ * Do not edit manually.
+ * Aozora RAG API
+ * OpenAPI spec version: 0.1.0
+ */
+import type { IngestionReport } from "./ingestionReport";
+
+export type IngestionJobReport = IngestionReport | null;
@@ -0,0 +1,16 @@
+/**
+ * Generated by orval v7.17.0 🍺
+ * Do not edit manually.
+ * Aozora RAG API
+ * OpenAPI spec version: 0.1.0
+ */
+
+export interface IngestionReport {
+  new?: number;
+  reused?: number;
+  deleted?: number;
+  embedding_seconds?: number;
+  seconds_saved?: number;
+  failed?: number;
+  errors?: string[];
+}
@@ -0,0 +1,17 @@
+/**
+ * Generated by orval v7.17.0 🍺
+ * Do not edit manually.
+ * Aozora RAG API
+ * OpenAPI spec version: 0.1.0
+ */
+
+export type JobStatus = (typeof JobStatus)[keyof typeof JobStatus];
+
+// eslint-disable-next-line @typescript-eslint/no-redeclare
+export const JobStatus = {
+  queued: "queued",
+  parsing: "parsing",
+  embedding: "embedding",
+  done: "done",
+  failed: "failed",
+} as const;
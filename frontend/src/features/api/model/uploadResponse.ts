@@ -4,8 +4,10 @@
  * Aozora RAG API
  * OpenAPI spec version: 0.1.0
  */
+import type { JobStatus } from "./jobStatus";
 
 export interface UploadResponse {
   message: string;
-  processed_pages: number;
+  job_id: string;
+  status: JobStatus;
 }
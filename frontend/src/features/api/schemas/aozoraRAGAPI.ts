@@ -31,7 +31,8 @@ export const chatEndpointChatPostResponse = zod.object({
 
 
 /**
- * ファイルをアップロードし、ドキュメントとして処理します。
+ * ファイルを受け付け、取り込みジョブとして登録します。
+解析・埋め込みは裏で行われるので、進み具合は GET /upload/jobs/{job_id} で確認してください。
 
 - **file**: アップロードするファイル
 - **title**: ユーザーが指定するタイトル
@@ -44,5 +45,50 @@ export const uploadFileBody = zod.object({
 
 export const uploadFileResponse = zod.object({
   "message": zod.string(),
-  "processed_pages": zod.number()
+  "job_id": zod.string(),
+  "status": zod.enum(['queued', 'parsing', 'embedding', 'done', 'failed'])
+})
+
+
+/**
+ * 取り込みジョブの状態（queued / parsing / embedding n/m / done / failed）を返します。
+ * @summary Get Upload Job
+ */
+export const getUploadJobParams = zod.object({
+  "job_id": zod.string()
+})
+
+export const getUploadJobResponseStatusDefault = `queued`;
+export const getUploadJobResponseTotalChunksDefault = 0;
+export const getUploadJobResponseTotalBatchesDefault = 0;
+export const getUploadJobResponseDoneBatchesDefault = 0;
+export const getUploadJobResponseReportOneNewDefault = 0;
+export const getUploadJobResponseReportOneReusedDefault = 0;
+export const getUploadJobResponseReportOneDeletedDefault = 0;
+export const getUploadJobResponseReportOneEmbeddingSecondsDefault = 0;
+export const getUploadJobResponseReportOneSecondsSavedDefault = 0;
+export const getUploadJobResponseReportOneFailedDefault = 0;
+export const getUploadJobResponseReportOneErrorsDefault = [];
+
+export const getUploadJobResponse = zod.object({
+  "id": zod.string(),
+  "title": zod.string(),
+  "filename": zod.string(),
+  "file_path": zod.string(),
+  "status": zod.enum(['queued', 'parsing', 'embedding', 'done', 'failed']).default(getUploadJobResponseStatusDefault),
+  "total_chunks": zod.number().default(getUploadJobResponseTotalChunksDefault),
+  "total_batches": zod.number().default(getUploadJobResponseTotalBatchesDefault),
+  "done_batches": zod.number().default(getUploadJobResponseDoneBatchesDefault),
+  "error": zod.union([zod.string(),zod.null()]).optional(),
+  "report": zod.union([zod.object({
+  "new": zod.number().default(getUploadJobResponseReportOneNewDefault),
+  "reused": zod.number().default(getUploadJobResponseReportOneReusedDefault),
+  "deleted": zod.number().default(getUploadJobResponseReportOneDeletedDefault),
+  "embedding_seconds": zod.number().default(getUploadJobResponseReportOneEmbeddingSecondsDefault),
+  "seconds_saved": zod.number().default(getUploadJobResponseReportOneSecondsSavedDefault),
+  "failed": zod.number().default(getUploadJobResponseReportOneFailedDefault),
+  "errors": zod.array(zod.string()).default(getUploadJobResponseReportOneErrorsDefault)
+}),zod.null()]).optional(),
+  "created_at": zod.number(),
+  "updated_at": zod.number()
 })